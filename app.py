@@ -1,25 +1,22 @@
+import time
+RUN_STARTED = time.perf_counter()  # Taken before the imports so the first run's cold start includes them
+
 import streamlit as st
-import requests
-import json
-from datetime import datetime
-from bs4 import BeautifulSoup
 import pandas as pd
-import io
-from urllib.parse import urljoin, urlparse
+import numpy as np
+from datetime import datetime
+from collections import deque
 import os
-import re
-from collections import Counter
-import nltk
-import html
-import logging
-
-# --- Setup Logger (Patch 3) ---
-logger = logging.getLogger(__name__)
-
-# --- NLTK Stopwords Fix (Patch 1) ---
-# Hardcode stopwords to avoid nltk.download() errors on Streamlit Cloud
-STOPWORDS = set(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't", 'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 'wouldn', "wouldn't"])
-
+import statistics
+
+from topic_generator import (
+    API_RPM_LIMIT, API_TPM_LIMIT, CRAWL_PAGE_BUDGET, EXPORT_FORMATS, TOPIC_COLUMNS, TopicSearchIndex,
+    analysis_details, analyze_scraped_text, api_key_pool, available_export_formats, build_business_details,
+    build_topic_query, export_bytes, export_tables, flag_near_duplicates, generate_json, generate_topics_fanout,
+    get_prompt_cache_registry, get_rate_limiter, get_response_cache, get_result_store, isin_mask,
+    iter_scrape_website, match_destination_pages, memory_report, prepare_dataframe, result_key,
+    stream_topic_generation, topic_prompt_prefix, validate_api_key,
+)
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -185,17 +182,22 @@ with st.expander("Instructions"):
         - Paste this key into the **"Enter Google API Key"** field in the Topic Generator's sidebar.
         """)
         
-try:
-    mod_time = os.path.getmtime(__file__)
-    last_updated_date = datetime.fromtimestamp(mod_time).strftime('%m/%d/%Y')
-except Exception:
-    last_updated_date = "N/A" # Fallback if file path is not accessible
-    
-st.markdown(f"<div style='text-align: right; font-size: 0.8em; color: grey;'>Last Updated: {last_updated_date}</div>", unsafe_allow_html=True)
+@st.cache_resource
+def get_last_updated_date():
+    """Modification date of this file, read once per process."""
+    try:
+        mod_time = os.path.getmtime(__file__)
+        return datetime.fromtimestamp(mod_time).strftime('%m/%d/%Y')
+    except Exception:
+        return "N/A" # Fallback if file path is not accessible
+
+st.markdown(f"<div style='text-align: right; font-size: 0.8em; color: grey;'>Last Updated: {get_last_updated_date()}</div>", unsafe_allow_html=True)
 
 
 # --- Initialize Session State ---
-if 'api_key' not in st.session_state: st.session_state.api_key = ""
+# The server's GEMINI_API_KEYS pool is handed to every visitor, so it is only used when the deployment opts in
+SHARED_API_KEYS = os.environ.get("GEMINI_API_KEYS", "") if os.environ.get("TOPIC_GENERATOR_SHARE_API_KEYS") == "1" else ""
+if 'api_key' not in st.session_state: st.session_state.api_key = SHARED_API_KEYS
 if 'industry' not in st.session_state: st.session_state.industry = ""
 if 'tone' not in st.session_state: st.session_state.tone = ""
 if 'audience_input' not in st.session_state: st.session_state.audience_input = ""
@@ -203,462 +205,69 @@ if 'product_input' not in st.session_state: st.session_state.product_input = ""
 if 'guidelines' not in st.session_state: st.session_state.guidelines = ""
 if 'analysis_results' not in st.session_state: st.session_state.analysis_results = None
 if 'analyzed_url' not in st.session_state: st.session_state.analyzed_url = ""
-if 'scraped_links' not in st.session_state: st.session_state.scraped_links = []
 if 'generated_data' not in st.session_state: st.session_state.generated_data = None
 if 'analyze_btn_clicked' not in st.session_state: st.session_state.analyze_btn_clicked = False
 if 'dataframe' not in st.session_state: st.session_state.dataframe = pd.DataFrame()
+if 'dataframe_version' not in st.session_state: st.session_state.dataframe_version = 0
 if 'available_pages_df' not in st.session_state: st.session_state.available_pages_df = pd.DataFrame()
+if 'crawl_partial' not in st.session_state: st.session_state.crawl_partial = None
+if 'crawl_stopped' not in st.session_state: st.session_state.crawl_stopped = False
 
 
-# --- Functions ---
-BOILERPLATE_TOKENS = ['©', 'privacy', 'terms', 'cookie', 'subscribe', 'navigation']
-MIN_PARAGRAPH_WORDS = 6
-MIN_DIV_WORDS = 12
-
-def is_boilerplate(s):
-    return any(tok in s.lower() for tok in BOILERPLATE_TOKENS)
-
-def validate_api_key(api_key):
-    """Checks if the API key is valid by making a simple request."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
-    try:
-        response = requests.get(url, timeout=10)
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
-
-# --- NEW SCRAPING & SUMMARIZING FUNCTIONS ---
-
-def summarize_text(text, sentence_count=1):
-    """Simple extractive summary from real text. Returns empty string if input is empty/placeholder."""
-    if not text or text.strip() == "" or text.strip().lower() == "no summary available.":
-        return ""  # explicit empty summary to avoid returning the placeholder
-    
-    text = html.unescape(re.sub(r'\s+', ' ', text))  # Normalize whitespace and unescape entities
-    # Split into sentences (simple heuristic)
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    # Choose the first sentence that's long enough, otherwise the longest sentence, otherwise a snippet
-    for s in sentences:
-        if len(s.split()) >= 8:
-            return s.strip()
-    if sentences:
-        longest = max(sentences, key=lambda s: len(s.split()))
-        if len(longest.split()) >= 4:
-            return longest.strip()
-    # fallback snippet
-    return (text[:200].rstrip() + "...") if len(text) > 200 else text.strip()
-
-def extract_meta_description(soup):
-    """Robust meta description lookup."""
-    # common patterns: <meta name="description">, <meta property="og:description">, <meta name="twitter:description">
-    selectors = [
-        ('name', 'description'),
-        ('property', 'og:description'),
-        ('name', 'twitter:description'),
-        ('itemprop', 'description'),
-    ]
-    for attr, val in selectors:
-        tag = soup.find('meta', attrs={attr: val})
-        if tag and tag.get('content'):
-            return tag['content'].strip()
-    return "No Meta Description"
-
-def clean_soup(soup):
-    """Remove unwanted tags and attributes to make text extraction cleaner."""
-    for junk_tag in soup(["script", "style", "nav", "header", "footer", "aside", "form", "noscript"]):
-        junk_tag.extract()
-    # remove common junk by id/class
-    for junk in soup.find_all(id=re.compile(r"menu|nav|header|footer|sidebar|cookie|consent", re.IGNORECASE)):
-        junk.extract()
-    for junk in soup.find_all(class_=re.compile(r"menu|nav|header|footer|sidebar|skip|cookie|consent", re.IGNORECASE)):
-        junk.extract()
-    return soup
-
-def get_best_paragraph(soup):
-    """Return the best candidate paragraph text from the parsed page."""
-    candidates = []
-
-    # 1) Prefer paragraphs with >= MIN_PARAGRAPH_WORDS
-    main_content = soup.find("main") or soup.find("article") or soup.find("div", attrs={"role": "main"})
-    if main_content:
-        candidates += [p.get_text(separator=' ', strip=True) for p in main_content.find_all("p") if not is_boilerplate(p.get_text(strip=True)) and len(p.get_text(strip=True).split()) >= MIN_PARAGRAPH_WORDS]
-
-    # 2) If none found, examine all <p> in body
-    if not candidates:
-        body = soup.find("body")
-        if body:
-            candidates = [p.get_text(separator=' ', strip=True) for p in body.find_all("p") if not is_boilerplate(p.get_text(strip=True)) and len(p.get_text(strip=True).split()) >= MIN_PARAGRAPH_WORDS]
-
-    # 2a) consider headings with following sibling text (PATCH #2)
-    if not candidates:
-        for h in soup.find_all(['h1','h2','h3']):
-            heading = h.get_text(separator=' ', strip=True)
-            sib = h.find_next_sibling()
-            gathered = []
-            while sib and len(' '.join(gathered).split()) < 60:
-                txt = sib.get_text(separator=' ', strip=True)
-                if txt:
-                    gathered.append(txt)
-                sib = sib.find_next_sibling()
-            combined = ' '.join([heading] + gathered).strip()
-            if len(combined.split()) >= MIN_PARAGRAPH_WORDS and not is_boilerplate(combined):
-                candidates.append(combined)
-
-    # 3) If still empty, try collecting large text blocks from divs
-    if not candidates:
-        div_texts = []
-        for d in soup.find_all("div"):
-            txt = d.get_text(separator=' ', strip=True)
-            if txt and len(txt.split()) >= MIN_DIV_WORDS and not is_boilerplate(txt): # Use MIN_DIV_WORDS
-                div_texts.append(txt)
-        candidates = div_texts
-
-    # 4) As last resort, use body text chunks split by double newline or long sentences
-    if not candidates:
-        full = soup.get_text(separator='\n', strip=True)
-        chunks = [c.strip() for c in re.split(r'\n{2,}|\r\n{2,}', full) if len(c.split()) >= MIN_PARAGRAPH_WORDS and not is_boilerplate(c)]
-        candidates = chunks
-
-    # 5) Choose best candidate: prefer first paragraph >=MIN_PARAGRAPH_WORDS, otherwise the longest candidate
-    for p in candidates:
-        if p and len(p.split()) >= MIN_PARAGRAPH_WORDS: # Use MIN_PARAGRAPH_WORDS
-            return p.strip()
-    if candidates:
-        longest = max(candidates, key=lambda s: len(s.split()))
-        return longest.strip()
-    return ""
-
-
-def scrape_page_details(url, headers):
-    """Scrapes details from a single page and avoids returning the title as the content summary."""
+# --- Sidebar Logic ---
+@st.cache_resource
+def load_coffee_button():
+    """Imports the optional Buy Me a Coffee button once per process; None when streamlit-extras is missing."""
     try:
-        response = requests.get(url, headers=headers, timeout=8)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        title = soup.title.string.strip() if soup.title and soup.title.string else "No Title"
-        meta = extract_meta_description(soup)
-
-        soup = clean_soup(soup)
-        content_text = get_best_paragraph(soup) # This now uses the new function
-
-        # Better fallback: remove title/meta and pick the longest meaningful chunk
-        if not content_text:
-            full_text = soup.get_text(separator='\n', strip=True)
-            if title and title != "No Title" and title in full_text:
-                # remove only the first occurrence to preserve repeated phrases later
-                full_text = re.sub(rf'\b{re.escape(title)}\b', '', full_text, count=1, flags=re.IGNORECASE).strip()
-            if meta and meta != "No Meta Description" and meta in full_text:
-                full_text = re.sub(rf'\b{re.escape(meta)}\b', '', full_text, count=1, flags=re.IGNORECASE).strip()
-
-            # Keep only lines that look meaningful (>= 8 words, but using new constant)
-            lines = [ln.strip() for ln in full_text.splitlines() if len(ln.split()) >= MIN_PARAGRAPH_WORDS and not is_boilerplate(ln)]
-            if lines:
-                content_text = max(lines, key=lambda s: len(s.split()))
-            else:
-                # Last resort: cleaned continuous text snippet (without title)
-                plain = re.sub(r'\s+', ' ', full_text).strip()
-                content_text = plain[:1000] if plain else ""
-
-        summary = summarize_text(content_text)
-
-        # Guard: if summary equals the title, try alternative paragraph or give empty summary
-        if summary and title and summary.strip().lower() == title.strip().lower():
-            paras = [p.get_text(separator=' ', strip=True) for p in soup.find_all('p') if len(p.get_text(strip=True).split()) >= MIN_PARAGRAPH_WORDS]
-            # prefer paragraph that is not the title and not identical to content_text
-            paras = [p for p in paras if p.strip().lower() != title.strip().lower() and p.strip().lower() != (content_text or "").strip().lower()]
-            alt = max(paras, key=lambda s: len(s.split())) if paras else ""
-            if alt:
-                summary = summarize_text(alt) or (alt[:200].rstrip() + "..." if len(alt) > 200 else alt)
-            else:
-                # fallback to meta description if available
-                if meta and meta != "No Meta Description" and len(meta.split()) >= 5:
-                    summary = meta
-                else:
-                    summary = ""
-
-        if not summary:
-            # Use logger.debug for production, print for this environment
-            logger.debug("no summary for %s; title=%s content_len=%d", url, title, len(content_text.split()) if content_text else 0)
-            summary = ""  # caller can decide placeholder display
-
-        return {'URL': url, 'Page Title': title, 'Meta Description': meta, 'Content Summary': summary}
-    except requests.RequestException:
+        from streamlit_extras.buy_me_a_coffee import button
+        return button
+    except ImportError:
         return None
 
-
-def scrape_website(url):
-    """Scrapes the main page and extracts internal links and their details."""
-    try:
-        # UPDATED: Using a Googlebot User-Agent to bypass simple firewalls
-        headers = {'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'}
-        response = requests.get(url, headers=headers, timeout=12)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        for script in soup(["script", "style"]):
-            script.extract()
-
-        main_text = soup.get_text(separator='\n', strip=True)
-
-        links = set()
-        base_netloc = urlparse(url).netloc
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href'].strip()
-            if not href or href.startswith('#') or href.startswith('mailto:') or href.startswith('tel:') or href.lower().startswith('javascript:'):
-                continue
-            full_url = urljoin(url, href)
-            parsed = urlparse(full_url)
-            if parsed.netloc == base_netloc:
-                clean_url = parsed.scheme + "://" + parsed.netloc + parsed.path
-                links.add(clean_url.rstrip('/'))
-
-        pages = []
-        homepage_details = scrape_page_details(url, headers)
-        if homepage_details:
-            pages.append(homepage_details)
-
-        for link in list(links)[:19]:
-            if link.rstrip('/') != url.rstrip('/'):
-                details = scrape_page_details(link, headers)
-                if details:
-                    pages.append(details)
-
-        # Deduplicate by URL
-        unique_pages = list({p['URL']: p for p in pages}.values())
-
-        return main_text[:15000], unique_pages, None
-    except requests.RequestException as e:
-        return None, [], f"Failed to fetch website content: {e}"
-
-# --- END NEW SCRAPING FUNCTIONS ---
-
-
-def analyze_scraped_text(api_key, text):
-    """Uses AI to analyze scraped text and extract business details."""
-    industry_database = """
-- Adult Products: Products related to adult entertainment and intimacy (e.g., Adult toys, lingerie, sexual wellness products)
-- Agriculture & Environment: Farming, natural resource management, sustainability (e.g., Crop production, livestock, forestry, conservation)
-- Performing Arts & Cultural Experiences: Creative expression, entertainment (e.g., Theater, dance, concerts, museums)
-- Visual Arts & Entertainment: Creative expression, entertainment (e.g., Visual arts, film, television, gaming)
-- Autos & Vehicles: Design, manufacturing, and sales of vehicles (e.g., Cars, trucks, motorcycles, RVs)
-- Beauty & Fitness: Personal care, appearance, physical well-being (e.g., Cosmetics, skincare, gyms, personal training)
-- Business & Industrial: Commercial activities, manufacturing, professional services (e.g., Manufacturing, construction, logistics, B2B services)
-- Computers & Electronics: Technology and electronic devices (e.g., Hardware, software, IT services, consumer electronics)
-- Fashion: Clothing, footwear, accessories, and style (e.g., Apparel design, manufacturing, retail)
-- Finance: Money management, investments, banking (e.g., Banking, insurance, financial planning, accounting)
-- Firearms & Weapons: Firearms, ammunition, and related equipment (e.g., Guns, rifles, hunting gear)
-- Food & Beverage: Production and sale of food and drinks (e.g., Restaurants, cafes, food manufacturing, grocery stores)
-- Gifts & Shopping: Retail, e-commerce, and consumer goods (e.g., Gift shops, department stores, online retailers)
-- Health & Wellness: Healthcare, personal well-being (e.g., Hospitals, clinics, pharmacies, mental health services, supplements)
-- Hobbies & Leisure: Recreational activities and pastimes (e.g., Arts and crafts, gaming, sports, travel)
-- Home & Garden: Home improvement, décor, gardening (e.g., Furniture, appliances, home décor, landscaping)
-- Hospitality & Travel: Accommodation, tourism, and travel services (e.g., Hotels, resorts, airlines, travel agencies)
-- Internet & Telecommunications: Digital communication and online services (e.g., ISPs, social media platforms)
-- Jobs & Education: Employment, training, and education (e.g., Recruitment, schools, universities, online learning)
-- Kids & Family: Products and services for children and families (e.g., Toys, childcare, parenting resources)
-- Law & Government: Legal services, public administration (e.g., Law firms, government agencies, courts)
-- Lifestyle: Personal interests, values, and way of living (e.g., Fashion, beauty, travel, food)
-- Logistics & Transportation: Movement of goods and people (e.g., Shipping, trucking, warehousing, airlines)
-- Marketing: Promoting products, services, or ideas (e.g., Market research, advertising, digital marketing)
-- Media & Communications: Information dissemination, journalism (e.g., Journalism, publishing, broadcasting)
-- Medical Cannabis: Cannabis for medical use (e.g., Dispensaries, cultivation, medical marijuana products)
-- News: Current events and information (e.g., Newspapers, online news portals)
-- Not For Profit: Charitable organizations and social causes (e.g., Charities, foundations, NGOs)
-- People & Society: Social issues, community, and culture (e.g., Social services, advocacy groups)
-- Pets & Animals: Pet care and animal welfare (e.g., Pet food, veterinary services, animal shelters)
-- Real Estate: Property, land, and buildings (e.g., Residential, commercial, real estate brokerage)
-- Recreational Cannabis: Cannabis for recreational use (where legal) (e.g., Dispensaries, cannabis products)
-- Science: Research, discovery, and innovation (e.g., Scientific research institutions, laboratories)
-- Specialty Products: Unique, niche, or regulated goods (e.g., Antiques, collectibles, luxury goods)
-- Vices & Adult Entertainment: Activities and products considered taboo (e.g., Gambling, pornography, tobacco, alcohol)
-- Other: Any industry not explicitly categorized above.
-"""
-    
-    system_prompt = f"""You are an expert marketing analyst. Analyze the provided website text and extract the following information. Be concise and summarize the findings.
-
-Industry Database:
-{industry_database}
-
-Your Tasks:
-1.  Analyze the website text to determine its primary industry (e.g., "AI-based logistics").
-2.  Compare this identified industry against the 'Industry Database' provided above.
-3.  Format the 'identified_industry' output:
-    - If a clear match is found, return the category name (e.g., "Health & Wellness").
-    - If no clear match is found, return "Not found (Identified as: [Industry you found])".
-4.  Extract all other required information.
-5.  For 'business_services_products', identify each distinct service or product. For each one, find its most relevant industry, target audience, and the specific pain point it solves.
-
-- **target_audience_pain_points:** The *overall* target audience and their main problems.
-- **business_services_products:** A list of objects, where each object contains:
-    - 'service_or_product' (string)
-    - 'associated_industry' (string)
-    - 'associated_audience' (string)
-    - 'associated_pain_point' (string)
-- **target_location:** The primary geographical market (e.g., USA, California, Global).
-- **identified_industry:** [Your formatted output from step 3]
-- **branding_tone_voice:** The style and personality of the business's communication.
-- **branding_guidelines_summary:** Summarize any core messaging or branding principles evident from the text."""
-    
-    schema = {
-        "type": "OBJECT",
-        "properties": {
-            "target_audience_pain_points": {"type": "STRING"},
-            "business_services_products": {
-                "type": "ARRAY",
-                "items": {
-                    "type": "OBJECT",
-                    "properties": {
-                        "service_or_product": {"type": "STRING"},
-                        "associated_industry": {"type": "STRING"},
-                        "associated_audience": {"type": "STRING"},
-                        "associated_pain_point": {"type": "STRING"}
-                    },
-                    "required": ["service_or_product", "associated_industry", "associated_audience", "associated_pain_point"]
-                }
-            },
-            "target_location": {"type": "STRING"},
-            "identified_industry": {"type": "STRING", "description": "The industry, formatted as specified in the prompt."},
-            "branding_tone_voice": {"type": "STRING"},
-            "branding_guidelines_summary": {"type": "STRING"}
-        },
-        "required": ["target_audience_pain_points", "business_services_products", "target_location", "identified_industry", "branding_tone_voice", "branding_guidelines_summary"]
-    }
-    
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": text}]}],
-        "systemInstruction": {"parts": [{"text": system_prompt}]},
-        "generationConfig": {"responseMimeType": "application/json", "responseSchema": schema}
-    }
-    options = {'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(payload)}
-    
-    response, error = fetch_with_retry(api_url, options)
-
+def wait_message(what):
+    return lambda: st.info(f"The same {what} is already running in another session. Waiting for its result...")
+
+def rate_wait_message(slot):
+    """on_wait callback for the API calls: shows a rate limiter wait in `slot`."""
+    return lambda seconds: slot.caption(f"Waiting {seconds:.0f}s for API rate limit capacity (GEMINI_RPM_LIMIT / GEMINI_TPM_LIMIT)...")
+
+def stored_result(key, compute, keep, what):
+    """Shares `compute()` through the process-wide result store. Bypassing the response cache also refreshes the stored result."""
+    store = get_result_store()
+    if st.session_state.get('bypass_response_cache', False):
+        store.invalidate(key)
+    return store.get_or_compute(key, compute, keep, on_wait=wait_message(what))
+
+def run_website_analysis(api_key, website_url, scraped_text, pages_df):
+    """Runs the AI analysis on scraped content and fills the business details from it."""
+    with st.spinner("Analyzing website..."):
+        use_cache = not st.session_state.get('bypass_response_cache', False)
+        wait_status = st.empty()
+        analysis, error = stored_result(result_key("analysis", website_url, scraped_text),
+                                        lambda: analyze_scraped_text(api_key, scraped_text, use_cache=use_cache, on_wait=rate_wait_message(wait_status)),
+                                        keep=lambda result: not result[1], what="website analysis")
+        wait_status.empty()
     if error:
-        return None, error
-    if response.status_code == 200:
-        try:
-            result = response.json()
-            analysis = json.loads(result['candidates'][0]['content']['parts'][0]['text'])
-            return analysis, None
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
-            return None, f"Failed to parse analysis from AI: {e}"
-    else:
-        try:
-            error_details = response.json()
-            return None, f"AI analysis failed with status {response.status_code}: {json.dumps(error_details)}"
-        except json.JSONDecodeError:
-            return None, f"AI analysis failed with status {response.status_code}: {response.text}"
-
-
-def fetch_with_retry(url, options, retries=3):
-    """Retry logic for the API call with a timeout. Returns (response, error_message)."""
-    for i in range(retries):
-        try:
-            response = requests.post(url, headers=options['headers'], data=options['body'], timeout=180) # Increased to 180s
-            if response.status_code < 500:
-                return response, None
-        except requests.exceptions.RequestException as e:
-            if i == retries - 1:
-                error_msg = f"A network error occurred: {e}. Please check the connection and try again."
-                return None, error_msg
-    error_msg = f"The server responded with an error (Status {response.status_code}) after multiple retries."
-    return None, error_msg
-
-def convert_df_to_csv(topics_df, available_pages_df, analysis_data, analyzed_url):
-    """Prepares data for CSV export with all three tables."""
-    output = io.StringIO()
-
-    # Table 1: Business Analysis Summary
-    if analysis_data:
-        output.write("Table 1: Business Analysis Summary\n")
-        summary_df = pd.DataFrame([
-            ["Website URL:", analyzed_url],
-            ["Target Location:", analysis_data.get('target_location', 'Not found')],
-            ["Identified Industry:", analysis_data.get('identified_industry', 'Not found')],
-            ["Target Audience and Pain Points:", analysis_data.get('target_audience_pain_points', 'Not found')]
-        ])
-        summary_df.to_csv(output, header=False, index=False)
-        output.write("\n")
-        
-        output.write("Business Services and/or Products\n")
-        products_df = pd.DataFrame(analysis_data.get('business_services_products', []))
-        # Rename columns for clarity in CSV
-        if not products_df.empty:
-            products_df.columns = ["Service/Product", "Associated Industry", "Associated Audience", "Associated Pain Point"]
-        products_df.to_csv(output, index=False)
-        output.write("\n")
-
-
-    # Table 2: Available Pages for Linking
-    if not available_pages_df.empty:
-        output.write("Table 2: Available Pages for Linking\n")
-        # Ensure available_pages_df is a DataFrame before exporting
-        if isinstance(available_pages_df, pd.DataFrame):
-            available_pages_df.to_csv(output, index=False)
-        else:
-            pd.DataFrame(available_pages_df).to_csv(output, index=False)
-        output.write("\n")
-
-    # Table 3: Topics
-    output.write("Table 3: Topics\n")
-    topics_df.to_csv(output, index=False)
-    
-    return output.getvalue().encode('utf-8')
-
-def prepare_dataframe(data):
-    """Flattens the nested topic data into a DataFrame."""
-    rows = []
-    header = ["Category", "Group Name", "Target Audience", "Publication Niche", "Funnel Stage", "Topic", "Suggested Headline", "Rationale", "Anchor text", "Destination Page", "Focus Keyword"]
-    
-    # 1. Process topics for Products/Services
-    for item in data.get('productBasedTopics', []):
-        group_name = item.get('productName')
-        for funnel in item.get('funnels', []):
-            for audience in funnel.get('audiences', []):
-                for pub in audience.get('publications', []):
-                    for topic in pub.get('topics', []):
-                        rows.append({
-                            "Category": "Product/Service",
-                            "Group Name": group_name,
-                            "Target Audience": audience.get('audienceName'),
-                            "Publication Niche": pub.get('publicationNiche'),
-                            "Funnel Stage": funnel.get('funnelStage'),
-                            "Topic": topic.get('topic'),
-                            "Suggested Headline": topic.get('suggestedHeadline'),
-                            "Rationale": topic.get('rationale'),
-                            "Anchor text": topic.get('anchorText'),
-                            "Destination Page": topic.get('destinationPage'),
-                            "Focus Keyword": topic.get('focusKeyword')
-                        })
-
-    # 2. Process topics for Available Pages
-    for page in data.get('pageBasedTopics', []):
-        group_name = page.get('pageTitle')
-        for funnel in page.get('funnels', []):
-            for audience in funnel.get('audiences', []):
-                for pub in audience.get('publications', []):
-                    for topic in pub.get('topics', []):
-                        rows.append({
-                            "Category": "Available Page",
-                            "Group Name": group_name,
-                            "Target Audience": audience.get('audienceName'),
-                            "Publication Niche": pub.get('publicationNiche'),
-                            "Funnel Stage": funnel.get('funnelStage'),
-                            "Topic": topic.get('topic'),
-                            "Suggested Headline": topic.get('suggestedHeadline'),
-                            "Rationale": topic.get('rationale'),
-                            "Anchor text": topic.get('anchorText'),
-                            "Destination Page": topic.get('destinationPage'),
-                            "Focus Keyword": topic.get('focusKeyword')
-                        })
-
-    return pd.DataFrame(rows, columns=header)
-
-
-# --- Sidebar Logic ---
-if st.session_state.get('analyze_btn_clicked', False):
+        st.error(error)
+        return
+    # Stored results are shared with other sessions: keep references, never modify them
+    st.session_state.analysis_results = analysis
+    st.session_state.analyzed_url = website_url
+    st.session_state.available_pages_df = pages_df
+    st.session_state.update(analysis_details(analysis))
+    st.success("Website analyzed!")
+    st.rerun()
+
+
+if st.session_state.get('crawl_stopped', False):
+    # The stop button's rerun interrupted the crawl; continue with the pages collected so far
+    st.session_state.crawl_stopped = False
+    partial, st.session_state.crawl_partial = st.session_state.crawl_partial, None
+    if partial and not partial['pages_df'].empty:
+        st.info(f"Crawl stopped early. Continuing with {len(partial['pages_df'])} pages.")
+        run_website_analysis(st.session_state.get("api_key"), partial['url'], partial['text'], partial['pages_df'])
+
+elif st.session_state.get('analyze_btn_clicked', False):
     st.session_state.analyze_btn_clicked = False # Reset flag
     api_key = st.session_state.get("api_key")
     website_url = st.session_state.get("website_url_input")
@@ -667,40 +276,44 @@ if st.session_state.get('analyze_btn_clicked', False):
     elif not website_url:
         st.error("Please enter a website URL.")
     else:
-        with st.spinner("Scraping and analyzing website..."):
-            scraped_text, scraped_pages, error = scrape_website(website_url)
-            if error:
-                if "403" in str(error):
-                    st.error("This website blocked scraping (403 Forbidden). Please analyze the site manually and paste the Business details into the fields on the settings bar.")
-                else:
-                    st.error(error)
-            else:
-                analysis, error = analyze_scraped_text(api_key, scraped_text)
+        progress = st.progress(0.0, text="Scraping website...")
+        stop_slot = st.empty()
+        st.subheader("Table 2: Available Pages for Linking")
+        live_table = st.empty()
+
+        def crawl():
+            stop_slot.button("Stop crawl and use pages so far", on_click=lambda: st.session_state.update(crawl_stopped=True))
+            scraped_text, pages_df, error = None, pd.DataFrame(), None
+            for scraped_text, scraped_pages, finished, planned, error in iter_scrape_website(website_url):
                 if error:
-                    st.error(error)
-                else:
-                    st.session_state.analysis_results = analysis
-                    st.session_state.analyzed_url = website_url
-                    st.session_state.scraped_links = scraped_pages
-                    st.session_state.available_pages_df = pd.DataFrame(scraped_pages)
-                    st.session_state.industry = analysis.get('identified_industry', '')
-                    st.session_state.tone = analysis.get('branding_tone_voice', '')
-                    st.session_state.audience_input = analysis.get('target_audience_pain_points', '')
-                    
-                    # Convert services list to a string for the text area
-                    products_list = analysis.get('business_services_products', [])
-                    products_str = "\n".join([f"- {p.get('service_or_product')}" for p in products_list])
-                    st.session_state.product_input = products_str
-                    
-                    st.session_state.guidelines = analysis.get('branding_guidelines_summary', '')
-                    st.success("Website analyzed!")
-                    st.rerun()
+                    break
+                pages_df = pd.DataFrame(scraped_pages)
+                st.session_state.crawl_partial = {'url': website_url, 'text': scraped_text, 'pages_df': pages_df}
+                progress.progress(finished / planned if planned else 1.0, text=f"Scraped {finished}/{planned} subpages ({len(scraped_pages)} pages found)...")
+                live_table.dataframe(pages_df, use_container_width=True)
+            return {'text': scraped_text, 'pages_df': pages_df, 'error': error}
+
+        site = get_result_store().get_or_compute(result_key("crawl", website_url, CRAWL_PAGE_BUDGET), crawl, keep=lambda result: not result['error'],
+                                                 on_wait=wait_message("website crawl"))
+        scraped_text, error = site['text'], site['error']
+        st.session_state.crawl_partial = None
+        progress.empty()
+        stop_slot.empty()
+        live_table.empty()
+
+        if error:
+            if "403" in str(error):
+                st.error("This website blocked scraping (403 Forbidden). Please analyze the site manually and paste the Business details into the fields on the settings bar.")
+            else:
+                st.error(error)
+        else:
+            run_website_analysis(api_key, website_url, scraped_text, site['pages_df'])
 
 with st.sidebar:
     st.markdown("<h2 style='font-weight: bold;'>Settings</h2>", unsafe_allow_html=True)
 
     with st.expander("1. Google API Key", expanded=True):
-        st.text_input("Enter Google API Key", type="password", help="Your key is saved for the current session.", key="api_key_input", on_change=lambda: st.session_state.update(api_key=st.session_state.api_key_input))
+        st.text_input("Enter Google API Key", type="password", help="Your key is saved for the current session. Separate several keys with commas to use them in turn.", key="api_key_input", on_change=lambda: st.session_state.update(api_key=st.session_state.api_key_input))
         
         if st.button("Validate"):
             if st.session_state.api_key and validate_api_key(st.session_state.api_key):
@@ -733,14 +346,26 @@ with st.sidebar:
     
     # Adding the Buy Me a Coffee button
     # Make sure to replace "your-username" with the actual username
-    try:
-        from streamlit_extras.buy_me_a_coffee import button
-        button(username="your-username", floating=False, width=221)
-    except ImportError:
+    coffee_button = load_coffee_button()
+    if coffee_button:
+        coffee_button(username="your-username", floating=False, width=221)
+    else:
         st.write("Could not import Buy Me A Coffee button. Is `streamlit-extras` installed?")
 
 
 # --- Main Window Button and Topic Generation Logic ---
+def topic_result(data, errors, pages):
+    """Generated topics as kept in the result store, with destination pages checked against the crawl
+    and the DataFrame built once for every session that shares them."""
+    data, matched = match_destination_pages(data, pages, st.session_state.analyzed_url, rematch_products=st.session_state.get('local_destinations', True))
+    return {'data': data, 'dataframe': flag_near_duplicates(prepare_dataframe(data)) if data else None, 'errors': errors, 'matched': matched}
+
+def set_topics(result):
+    """Points the session at generated topics and bumps the version that the memoized Table 3 views are keyed on."""
+    st.session_state.generated_data = result['data']
+    st.session_state.dataframe = result['dataframe']
+    st.session_state.dataframe_version += 1
+
 st.divider()
 
 api_key_ready = bool(st.session_state.api_key)
@@ -754,6 +379,21 @@ if is_ready:
 col1, col2 = st.columns([1, 2])
 with col1:
     generate_btn = st.button("Generate Topics", type="primary")
+    st.toggle("Stream topics as they are generated", value=True, key="stream_topics")
+    st.toggle("Split into one request per product/page batch", value=False, key="fanout_topics", help="Recommended for sites with many pages. Requests run in parallel and a failed batch is retried on its own.")
+    st.toggle("Match destination pages locally", value=True, key="local_destinations", help="Leave the crawled URL list out of the prompt and pick each product topic's destination page from the crawled pages here. Destination pages are always checked against the crawl.")
+    st.toggle("Bypass response cache", value=False, key="bypass_response_cache", help="Always call the API, even when the same inputs were answered before. The fresh response replaces the cached one.")
+    cache_stats = get_response_cache().stats()
+    st.caption(f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} saved responses")
+    store_stats = get_result_store().stats()
+    st.caption(f"Shared results: {store_stats['entries']} kept ({store_stats['bytes'] / 1024 / 1024:.1f} MB), {store_stats['hits']} reused, {store_stats['joined']} joined a run already in progress")
+    prompt_cache = get_prompt_cache_registry()
+    if prompt_cache.prompt_tokens:
+        st.caption(f"Prompt cache: {prompt_cache.cached_tokens:,} of {prompt_cache.prompt_tokens:,} input tokens served from cached prefixes")
+    key_count = len(api_key_pool(st.session_state.api_key))
+    limits = " / ".join(f"{limit:,} {unit}" for limit, unit in ((API_RPM_LIMIT, "requests"), (API_TPM_LIMIT, "tokens")) if limit)
+    st.caption(f"API queue: {get_rate_limiter().waiting} waiting for capacity ({key_count} key{'s' if key_count != 1 else ''}, "
+               f"{limits + ' per minute each' if limits else 'no rate limit set'})")
 
 with col2:
     api_tag = '<span class="status-tag tag-green">API Key</span>' if api_key_ready else '<span class="status-tag tag-red">API Key</span>'
@@ -775,119 +415,147 @@ if generate_btn:
         with st.spinner("Generating topics... This may take up to a minute."):
             current_date = datetime.now().strftime('%B %d, %Y')
             
-            system_prompt = """You are a strategic content and marketing analyst. Your task is to generate two distinct sets of topics based on the provided business details:
-            
-            1.  **Topics for each Product/Service:** For EACH item in the `List of Business Services`, generate **creative, non-promotional** topics for all three marketing funnels (ToFu, MoFu, BoFu) that address the associated pain points.
-                - *Example Good (ToFu):* "5 Common Mistakes to Avoid When Applying for an MMJ Card"
-                - *Example Bad (Promotional):* "Get Your MMJ Card Today With Our Help"
-            
-            2.  **Topics for each Available Page:** For EACH item in the `List of Available Pages`, generate **non-promotional, page-specific** topics for all three marketing funnels (ToFu, MoFu, BoFu) based on that page's summary.
-                - *Example Good (MoFu):* "What to Expect at Your First MMJ Appointment" (for a "Patient Forms" page)
-                - *Example Bad (Promotional):* "Book Your Appointment at Our Tampa Office"
-
-            **CRITICAL RULE: DO NOT CREATE PROMOTIONAL TOPICS.**
-            These topics are for external guest posts, not the company's website.
-            - **AVOID:** Direct calls to action (e.g., "Book Now," "Get Certified," "Schedule Today").
-            - **AVOID:** Topics focused on "expert help" or "support" from this specific company (e.g., "Why Our Doctors Are Best").
-            - **AVOID:** Topics designed to persuade the user to choose this company's service.
-            - **FOCUS ON:** Explaining concepts, processes, general information, and answering the target audience's questions and pain points.
-
-            For EACH funnel stage (ToFu, MoFu, BoFu) in both sets, you must identify a relevant `audienceName` and `publicationNiche`, and then provide at least one topic.
-
-            For each generated topic, you must provide six elements:
-            - 'topic': A short, concise title (MAXIMUM 60 characters).
-            - 'suggestedHeadline': A longer, more engaging headline for an article.
-            - 'rationale': A brief explanation of the topic's value.
-            - 'anchorText': A descriptive, concise, and relevant anchor text. VARY the type of anchor text (Branded, Naked, Title, Generic, Exact Match, Partial Match) based on the context.
-            - 'destinationPage': 
-                - For `productBasedTopics`, select the most relevant URL from the `List of Available URLs` that matches the product.
-                - For `pageBasedTopics`, this MUST be the *exact* `pageURL` for the page you are generating topics for.
-            - 'focusKeyword': Based on the topic and headline, suggest a primary focus keyword for the content.
-            
-            The final output must be a single JSON object adhering to the provided schema.
-            """
-
-            user_query = f"Current Date: {current_date}\n\n"
-            if st.session_state.analyzed_url:
-                 user_query += f"Base Website URL for Destination Pages: {st.session_state.analyzed_url}\n"
-                 if st.session_state.scraped_links:
-                     user_query += "List of Available URLs to choose from for the 'destinationPage' (with their anchor text for context):\n"
-                     # Convert list of dicts to list of dicts before iterating
-                     pages_list_for_query = st.session_state.available_pages_df.to_dict('records')
-                     for page in pages_list_for_query:
-                         user_query += f"- {page['URL']} (Context: {page['Page Title']})\n"
-                     user_query += "\n"
-            
-            if st.session_state.analysis_results:
-                products_list = st.session_state.analysis_results.get('business_services_products', [])
-                if products_list:
-                    user_query += "List of Business Services to generate topics for:\n"
-                    for product in products_list:
-                        user_query += f"- {product['service_or_product']} (Audience: {product['associated_audience']}, Pain Point: {product['associated_pain_point']})\n"
-                    user_query += "\n"
-
-            if not st.session_state.available_pages_df.empty:
-                user_query += "List of Available Pages to generate topics for:\n"
-                pages_list = st.session_state.available_pages_df.to_dict('records')
-                for page in pages_list:
-                    user_query += f"- Page Title: {page['Page Title']}\n  URL: {page['URL']}\n  Summary: {page['Content Summary']}\n"
-                user_query += "\n"
-
-
-            if st.session_state.guidelines:
-                user_query += f"Full Copywriting Guidelines:\n---\n{st.session_state.guidelines}\n---\n"
-                optional_inputs = {"Specific Industry/Niche": st.session_state.industry, "Specific Branding Tone/Voice": st.session_state.tone, "Specific Target Audiences": st.session_state.audience_input, "Specific Products/Services": st.session_state.product_input}
-                if st.session_state.analysis_results:
-                    optional_details = "\n".join([f"- {key}: {value}" for key, value in optional_inputs.items() if value and value != st.session_state.analysis_results.get(key.lower().replace('specific ', '').replace(' ', '_'))])
+            analysis = st.session_state.analysis_results
+            products_list = analysis.get('business_services_products', []) if analysis else []
+            pages_list = st.session_state.available_pages_df.to_dict('records')
+            local_destinations = st.session_state.get('local_destinations', True)
+            url_pages = pages_list if not st.session_state.available_pages_df.empty and not local_destinations else []
+            business_details = build_business_details(st.session_state.guidelines, st.session_state.industry, st.session_state.tone, st.session_state.audience_input, st.session_state.product_input, analysis)
+
+            user_query = build_topic_query(current_date, st.session_state.analyzed_url, url_pages, products_list, pages_list, business_details)
+            prefix = topic_prompt_prefix(local_destinations=not url_pages)
+            use_cache = not st.session_state.get('bypass_response_cache', False)
+
+            fanout = st.session_state.get('fanout_topics', False) and bool(products_list or pages_list)
+            live_status = st.empty()
+            live_table = st.empty()
+
+            def generate():
+                if fanout:
+                    def show_progress(data, finished, total):
+                        live_status.caption(f"Finished {finished}/{total} requests, {get_rate_limiter().waiting} waiting for API capacity...")
+                        live_table.dataframe(prepare_dataframe(data), use_container_width=True)
+
+                    def show_wait(seconds):
+                        live_status.caption(f"Waiting {seconds:.0f}s for API rate limit capacity, {get_rate_limiter().waiting} requests queued...")
+
+                    data, shard_errors = generate_topics_fanout(st.session_state.api_key, current_date, st.session_state.analyzed_url, url_pages, products_list, pages_list, business_details,
+                                                                show_progress, use_cache=use_cache, on_wait=show_wait)
+                    return topic_result(data if data['productBasedTopics'] or data['pageBasedTopics'] else None, shard_errors, pages_list)
+                if st.session_state.get('stream_topics', True):
+                    def show_rows(rows):
+                        live_status.caption(f"Received {len(rows)} topics so far...")
+                        live_table.dataframe(pd.DataFrame(rows, columns=TOPIC_COLUMNS), use_container_width=True)
+
+                    data, error_msg = stream_topic_generation(st.session_state.api_key, prefix, user_query, show_rows, use_cache, on_wait=rate_wait_message(live_status))
                 else:
-                    optional_details = "\n".join([f"- {key}: {value}" for key, value in optional_inputs.items() if value])
-                if optional_details: user_query += f"\nSupplemental Details from Optional Fields:\n{optional_details}"
-            else: 
-                user_query += "Business Details:\n"
-                primary_inputs = {"Industry/Niche": st.session_state.industry, "Branding Tone/Voice": st.session_state.tone, "Target Audiences": st.session_state.audience_input, "Products/Services to Highlight": st.session_state.product_input}
-                primary_details = "\n".join([f"- {key}: {value}" for key, value in primary_inputs.items() if value])
-                user_query += primary_details
-
-            topic_properties = {"type": "OBJECT", "properties": {"topic": {"type": "STRING"}, "suggestedHeadline": {"type": "STRING"}, "rationale": {"type": "STRING"}, "anchorText": {"type": "STRING"}, "destinationPage": {"type": "STRING"}, "focusKeyword": {"type": "STRING"}}, "required": ["topic", "suggestedHeadline", "rationale", "anchorText", "destinationPage", "focusKeyword"]}
-            publication_properties = {"type": "OBJECT", "properties": {"publicationNiche": {"type": "STRING"}, "topics": {"type": "ARRAY", "items": topic_properties}}, "required": ["publicationNiche", "topics"]}
-            audience_properties = {"type": "OBJECT", "properties": {"audienceName": {"type": "STRING"}, "publications": {"type": "ARRAY", "items": publication_properties}}, "required": ["audienceName", "publications"]}
-            funnel_properties = {"type": "OBJECT", "properties": {"funnelStage": {"type": "STRING", "enum": ["ToFu", "MoFu", "BoFu"]}, "audiences": {"type": "ARRAY", "items": audience_properties}}, "required": ["funnelStage", "audiences"]}
-            
-            product_based_topics_properties = {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"productName": {"type": "STRING", "description": "The name of the product/service."}, "funnels": {"type": "ARRAY", "items": funnel_properties}}, "required": ["productName", "funnels"]}}
-            
-            page_based_topics_properties = {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"pageTitle": {"type": "STRING"}, "pageURL": {"type": "STRING"}, "funnels": {"type": "ARRAY", "items": funnel_properties}}, "required": ["pageTitle", "pageURL", "funnels"]}}
-            
-            schema = {"type": "OBJECT", "properties": {"productBasedTopics": product_based_topics_properties, "pageBasedTopics": page_based_topics_properties}, "required": ["productBasedTopics", "pageBasedTopics"]}
-
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={st.session_state.api_key}"
-            payload = {"contents": [{"parts": [{"text": user_query}]}], "systemInstruction": {"parts": [{"text": system_prompt}]}, "generationConfig": {"responseMimeType": "application/json", "responseSchema": schema}}
-            options = {'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(payload)}
-            
-            response, error_msg = fetch_with_retry(api_url, options)
-            
-            if error_msg:
-                st.error(error_msg)
-            elif response and response.status_code == 200:
-                try:
-                    result = response.json()
-                    text_content = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-                    if text_content:
-                        data = json.loads(text_content)
-                        st.session_state.generated_data = data
-                        st.session_state.dataframe = prepare_dataframe(data)
-                    else:
-                        st.error("No content received from API.")
-                except (json.JSONDecodeError, IndexError, KeyError) as e:
-                    st.error(f"Failed to parse API response: {e}")
-            elif response:
-                 try:
-                     error_details = response.json()
-                     st.error(f"API request failed with status code: {response.status_code}.")
-                     st.json(error_details)
-                 except json.JSONDecodeError:
-                     st.error(f"API request failed with status code: {response.status_code}.")
+                    data, error_msg = generate_json(st.session_state.api_key, prefix, user_query, use_cache, on_wait=rate_wait_message(live_status))
+                return topic_result(None if error_msg else data, [error_msg] if error_msg else [], pages_list)
+
+            # Streaming and single requests give the same result for the same prompt; fan-out is stored separately
+            result = stored_result(result_key("topics", st.session_state.analyzed_url, prefix.digest, user_query, fanout), generate,
+                                   keep=lambda result: result['data'] is not None and not result['errors'], what="topic generation")
+            live_status.empty()
+            live_table.empty()
+            if fanout and result['data'] is None:
+                st.error("No topics were generated: every request failed. The reasons are listed below.")
+            for error_msg in result['errors']:
+                if fanout and result['data'] is not None:
+                    st.warning(f"Some topics could not be generated ({error_msg})")
+                else:
+                    st.error(error_msg)
+            if result['data'] is not None:
+                if result['matched']:
+                    st.caption(f"{result['matched']} destination pages were matched to crawled pages locally.")
+                set_topics(result)
 
 # --- Display Results ---
+TOPIC_FILTERS = [("Category", "Filter by Category"), ("Funnel Stage", "Filter by Funnel Stage"), ("Target Audience", "Filter by Target Audience")]
+
+def session_memo(name, key, compute):
+    """Returns compute() memoized in session state under `name`, recomputed only when `key` changes."""
+    memo = st.session_state.get(name)
+    if memo is None or memo[0] != key:
+        memo = (key, compute())
+        st.session_state[name] = memo
+    return memo[1]
+
+def filter_topics(df, search_query, selections, hide_duplicates=False):
+    """Rows matching the search box and the selected value of every filter column."""
+    if search_query:
+        # The index is only built once someone searches, then reused until the topics change
+        search_index = session_memo('topics_search_index', st.session_state.dataframe_version, lambda: TopicSearchIndex(df, TOPIC_COLUMNS))
+        mask = search_index.mask(search_query)
+    else:
+        mask = np.ones(len(df), dtype=bool)
+    for column, selected in selections.items():
+        mask &= isin_mask(df[column], selected)
+    if hide_duplicates and "Near Duplicate" in df.columns:
+        mask &= ~df["Near Duplicate"].to_numpy(dtype=bool)
+    return df[mask]
+
+def lazy_export(fmt, key, tables):
+    """Returns a callable for st.download_button that builds the export on click, reusing it until `key` changes.
+
+    The callable runs outside the script thread, so it closes over the session's export dict instead of
+    reading session state.
+    """
+    exports = st.session_state.setdefault('topic_exports', {})
+    def build():
+        cached = exports.get(fmt)
+        if cached is None or cached[0] != key:
+            for stale in [name for name, (built_for, _) in exports.items() if built_for != key]:
+                exports.pop(stale, None)
+            cached = (key, export_bytes(fmt, tables))
+            exports[fmt] = cached
+        return cached[1]
+    return build
+
+@st.fragment
+def show_topics_table():
+    """Table 3 with its search box, filters and download. Changing them reruns only this fragment."""
+    df = st.session_state.dataframe
+    version = st.session_state.dataframe_version
+    options = session_memo('topics_filter_options', version, lambda: {column: list(df[column].unique()) for column, _ in TOPIC_FILTERS})
+
+    # Search bar
+    search_query = st.text_input("Search topics...", help='All words must match. Limit a word to one column with column:word (e.g. keyword:mmj) and match exact phrases with "quotes".')
+
+    # Filter dropdowns
+    selections = {}
+    for (column, label), col in zip(TOPIC_FILTERS, st.columns(len(TOPIC_FILTERS))):
+        with col:
+            selections[column] = st.multiselect(label, options[column], default=options[column])
+
+    duplicates = int(df["Near Duplicate"].sum()) if "Near Duplicate" in df.columns else 0
+    hide_duplicates = st.checkbox(f"Hide near-duplicate topics ({duplicates})", value=False, key='hide_duplicates',
+                                  help="Topics whose wording mostly repeats an earlier topic, marked in the Near Duplicate column. The first topic of each Duplicate Group is kept.") if duplicates else False
+
+    view_key = (version, search_query, tuple(tuple(selected) for selected in selections.values()), hide_duplicates)
+    filtered_df = session_memo('topics_filtered', view_key, lambda: filter_topics(df, search_query, selections, hide_duplicates))
+    st.dataframe(filtered_df, use_container_width=True)
+
+    st.divider()
+
+    # Use a single download button for all tables; the file is only built when it is clicked
+    formats = available_export_formats()
+    fmt_col, button_col = st.columns([1, 3], vertical_alignment="bottom")
+    with fmt_col:
+        fmt = st.selectbox("Export format", formats, key='export_format')
+    extension, mime = EXPORT_FORMATS[fmt][:2]
+    tables = export_tables(filtered_df, st.session_state.available_pages_df, st.session_state.analysis_results, st.session_state.analyzed_url)
+    with button_col:
+        st.download_button(
+            label=f"Download All Results as {fmt}",
+            help="The topics table is exported as shown above, with the search, filters and hidden near-duplicates applied.",
+            data=lazy_export(fmt, view_key, tables),
+            file_name=f"topic_generator_output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+            mime=mime,
+            on_click="ignore",
+        )
+    if len(filtered_df) < len(df):
+        st.caption(f"The download includes the {len(filtered_df):,} of {len(df):,} topics shown above. Clear the search and filters and show near-duplicates to export all of them.")
+
 if not st.session_state.dataframe.empty:
     st.header("Generated Topics", divider="rainbow")
     
@@ -927,42 +595,30 @@ if not st.session_state.dataframe.empty:
         st.dataframe(st.session_state.available_pages_df, use_container_width=True)
 
     st.subheader("Table 3: Topics")
-    
-    df_to_display = st.session_state.dataframe.copy()
-
-    # Search bar
-    search_query = st.text_input("Search topics...")
-    if search_query:
-        df_to_display = df_to_display[df_to_display.apply(lambda row: row.astype(str).str.contains(search_query, case=False).any(), axis=1)]
-
-    # Filter dropdowns
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        categories = df_to_display['Category'].unique()
-        selected_categories = st.multiselect("Filter by Category", categories, default=categories)
-    with col2:
-        funnels = df_to_display['Funnel Stage'].unique()
-        selected_funnels = st.multiselect("Filter by Funnel Stage", funnels, default=funnels)
-    with col3:
-        audiences = df_to_display['Target Audience'].unique()
-        selected_audiences = st.multiselect("Filter by Target Audience", audiences, default=audiences)
-    
-    # Apply filters
-    filtered_df = df_to_display[
-        df_to_display['Category'].isin(selected_categories) &
-        df_to_display['Funnel Stage'].isin(selected_funnels) &
-        df_to_display['Target Audience'].isin(selected_audiences)
-    ]
-
-    st.dataframe(filtered_df, use_container_width=True)
-
-    st.divider()
-    
-    # Use a single download button for the combined CSV
-    combined_csv = convert_df_to_csv(filtered_df, st.session_state.available_pages_df, st.session_state.analysis_results, st.session_state.analyzed_url)
-    st.download_button(
-        label="Download All Results as CSV",
-        data=combined_csv,
-        file_name=f"topic_generator_output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime='text/csv',
-    )
+    show_topics_table()
+
+
+# --- Run Timing ---
+RERUN_HISTORY = 50  # Recent reruns kept for the timing caption
+
+@st.cache_resource
+def get_run_timings():
+    """Process-wide script run times: the first (cold) run and recent reruns."""
+    return {'cold_start': None, 'reruns': deque(maxlen=RERUN_HISTORY)}
+
+run_time = time.perf_counter() - RUN_STARTED
+run_timings = get_run_timings()
+if run_timings['cold_start'] is None:
+    run_timings['cold_start'] = run_time
+else:
+    run_timings['reruns'].append(run_time)
+timing_text = f"Cold start: {run_timings['cold_start'] * 1000:.0f} ms"
+if run_timings['reruns']:
+    timing_text += f" · This run: {run_time * 1000:.0f} ms · Median rerun: {statistics.median(run_timings['reruns']) * 1000:.0f} ms over {len(run_timings['reruns'])} runs"
+st.caption(timing_text)
+
+# --- Session Memory ---
+if st.checkbox("Show session memory", key='show_session_memory'):
+    report = memory_report([(key, value) for key, value in st.session_state.items() if key != 'show_session_memory'])
+    st.dataframe(report[["Item", "Size"]], hide_index=True)
+    st.caption("Crawls, analyses and topics from the shared result store are counted here but held once for all sessions.")
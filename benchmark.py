@@ -0,0 +1,297 @@
+"""Offline benchmarks and golden-output checks for page extraction and topic tables.
+
+    python benchmark.py                  # time, peak memory and throughput per function
+    python benchmark.py --per-page       # ... broken down by fixture page
+    python benchmark.py --check          # compare outputs with benchmark_corpus/golden.json
+    python benchmark.py --update-golden  # rewrite golden.json after an intended output change
+
+The fixtures in benchmark_corpus/ are marketing pages of the kinds the crawler meets:
+a small landing page, a huge store catalog, page-builder div soup, a page with headings
+only, a JavaScript app shell, a windows-1252 page, a UTF-8 page that declares no charset,
+unclosed <p>/<div> markup and other broken markup. Nothing touches the
+network: scrape_page_details is measured end to end against a local HTTP server serving
+the corpus, with the page cache in a temporary directory.
+
+--check exits with status 1 when any output differs from the golden file, so it can run
+before a change to extraction is merged. test_golden.py checks the page records against
+the same file under pytest, on every parser backend.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+# The page cache directory is read when topic_generator is imported; keep benchmark pages out of the user's cache
+CACHE_DIR = tempfile.mkdtemp(prefix="topic-generator-benchmark-")
+os.environ["TOPIC_GENERATOR_CACHE_DIR"] = CACHE_DIR
+
+from topic_generator import (
+    available_parser_backends, clean_soup, crawl_record, extract_meta_description, extract_page_details,
+    get_best_paragraph, parse_html, prepare_dataframe, records, scrape_page_details, summarize_page, summarize_text,
+)
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_corpus")
+GOLDEN_PATH = os.path.join(CORPUS_DIR, "golden.json")
+FIXTURE_URL = "https://fixtures.example/"   # Base URL the offline extraction pretends pages came from
+HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'}
+TOPIC_SIZES = (1_000, 50_000)               # Topics in the synthetic tables given to prepare_dataframe
+GOLDEN_TOPICS = 120                         # Topics in the table whose output is kept in golden.json
+
+
+def load_corpus():
+    """Reads the fixture pages. Returns [(name, bytes)] sorted by name."""
+    return [(name, open(os.path.join(CORPUS_DIR, name), 'rb').read())
+            for name in sorted(os.listdir(CORPUS_DIR)) if name.endswith('.html')]
+
+
+def serve_corpus(corpus):
+    """Serves the fixture pages on a free local port from a daemon thread. Returns the server."""
+    pages = {f"/{name}": content for name, content in corpus}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # headers and body go out as two writes; don't let Nagle hold the body back 40 ms
+
+        def do_GET(self):
+            body = pages.get(self.path.split('?', 1)[0])
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_topics(count, per_publication=5):
+    """Topic data shaped like a model response, with `count` topics spread over products and pages."""
+    funnels, audiences = ("ToFu", "MoFu", "BoFu"), ("Homeowners", "Property managers")
+    per_item = len(funnels) * len(audiences) * per_publication
+    items = max(2, -(-count // per_item))
+
+    def item(n, name_key, name):
+        return {name_key: name, 'funnels': [
+            {'funnelStage': stage, 'audiences': [
+                {'audienceName': audience, 'publications': [
+                    {'publicationNiche': f"{audience} magazine {n % 7}", 'topics': [
+                        {'topic': f"{name}: {stage} idea {t} for {audience.lower()}",
+                         'suggestedHeadline': f"{t + 3} things {audience.lower()} should know about {name.lower()}",
+                         'rationale': f"Readers at the {stage} stage compare options for {name.lower()}.",
+                         'anchorText': f"{name.lower()} guide",
+                         'destinationPage': f"{FIXTURE_URL}{name_key[:4]}/{n % 40}",
+                         'focusKeyword': f"{name.lower()} {audience.split()[0].lower()}"}
+                        for t in range(per_publication)]}]}
+                for audience in audiences]}
+            for stage in funnels]}
+
+    products = [item(n, 'productName', f"Product {n}") for n in range(items // 2)]
+    pages = [item(n, 'pageTitle', f"Page {n}") for n in range(items - items // 2)]
+    return {'productBasedTopics': products, 'pageBasedTopics': pages}
+
+
+def measure(call, setup, repeat):
+    """Times call(*setup()) over `repeat` runs, setup excluded, then traces one more run's peak memory.
+
+    Returns (mean seconds per run, peak bytes allocated during the traced run).
+    """
+    elapsed = 0.0
+    for _ in range(repeat):
+        args = setup()
+        started = time.perf_counter()
+        call(*args)
+        elapsed += time.perf_counter() - started
+    args = setup()
+    tracemalloc.start()
+    try:
+        call(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed / repeat, peak
+
+
+def page_cases(base_url):
+    """(function, setup(name, content), call) for everything timed once per fixture page."""
+    def soup(name, content):
+        return (BeautifulSoup(content, 'html.parser'),)
+
+    def cleaned(name, content):
+        return (clean_soup(BeautifulSoup(content, 'html.parser')),)
+
+    def paragraph(name, content):
+        return (get_best_paragraph(clean_soup(BeautifulSoup(content, 'html.parser'))),)
+
+    runs = itertools.count()
+    cases = [
+        ("BeautifulSoup (html.parser)", lambda name, content: (content, 'html.parser'), BeautifulSoup),
+        ("clean_soup", soup, clean_soup),
+        ("extract_meta_description", soup, extract_meta_description),
+        ("get_best_paragraph", cleaned, get_best_paragraph),
+        ("summarize_text", paragraph, summarize_text),
+    ]
+    cases += [(f"parse_html ({backend})", lambda name, content, backend=backend: (content, backend), parse_html)
+              for backend in available_parser_backends()]
+    cases += [
+        ("summarize_page", lambda name, content: (FIXTURE_URL + name, parse_html(content)), summarize_page),
+        ("extract_page_details", lambda name, content: (FIXTURE_URL + name, content), extract_page_details),
+        # A new query string per run misses the page cache: download, parse, extract and store
+        ("scrape_page_details (cold)", lambda name, content: (f"{base_url}{name}?run={next(runs)}", HEADERS), scrape_page_details),
+        # The same URL again: a fresh cache hit that returns the stored record
+        ("scrape_page_details (warm)", lambda name, content: (f"{base_url}{name}", HEADERS), scrape_page_details),
+    ]
+    return cases
+
+
+def run_benchmarks(corpus, base_url, repeat):
+    """Measures every page function on every fixture and prepare_dataframe on synthetic tables. Returns one row per measurement."""
+    rows = []
+
+    def add(function, label, size, items, seconds, peak):
+        rows.append({'Function': function, 'Input': label, 'Bytes': size, 'Items': items, 'ms': seconds * 1000,
+                     'Peak KiB': peak / 1024, 'Items/s': items / seconds, 'MB/s': size / seconds / 1e6})
+
+    for name, content in corpus:
+        scrape_page_details(f"{base_url}{name}", HEADERS)  # warm the cache for the warm case
+    for function, setup, call in page_cases(base_url):
+        for name, content in corpus:
+            seconds, peak = measure(call, lambda: setup(name, content), repeat)
+            add(function, name, len(content), 1, seconds, peak)
+    for count in TOPIC_SIZES:
+        data = synthetic_topics(count)
+        topics = len(prepare_dataframe(data))
+        seconds, peak = measure(prepare_dataframe, lambda: (data,), repeat)
+        add("prepare_dataframe", f"{topics:,} topics", len(json.dumps(data)), topics, seconds, peak)
+    return pd.DataFrame(rows)
+
+
+def summarize_runs(results):
+    """One row per function (and topic table size): the whole corpus's time, the largest peak and overall throughput."""
+    pages = results['Function'] != "prepare_dataframe"
+    grouped = results[pages].groupby('Function', sort=False).agg(
+        {'Input': 'size', 'Bytes': 'sum', 'Items': 'sum', 'ms': 'sum', 'Peak KiB': 'max'})
+    grouped['Input'] = grouped['Input'].map(lambda n: f"{n} pages")
+    grouped = grouped.reset_index()
+    summary = pd.concat([grouped, results[~pages][grouped.columns]], ignore_index=True)
+    summary['Items/s'] = summary['Items'] / summary['ms'] * 1000
+    summary['MB/s'] = summary['Bytes'] / summary['ms'] / 1000
+    return summary
+
+
+def public_fields(record):
+    """A page record without its URL and internal keys, which vary with where the page was fetched from."""
+    return {key: value for key, value in record.items() if key != 'URL' and not key.startswith('_')}
+
+
+def golden_outputs(corpus):
+    """The outputs golden.json pins down, computed with the reference html.parser backend."""
+    pages = {}
+    for name, content in corpus:
+        url = FIXTURE_URL + name
+        paragraph = get_best_paragraph(clean_soup(BeautifulSoup(content, 'html.parser')))
+        crawl = crawl_record(url, parse_html(content, 'html.parser'))
+        pages[name] = {
+            'meta_description': extract_meta_description(BeautifulSoup(content, 'html.parser')),
+            'best_paragraph': paragraph,
+            'summary': summarize_text(paragraph),
+            'record': public_fields(summarize_page(url, parse_html(content, 'html.parser'))),
+            'crawl_record': public_fields(crawl),
+            'block_count': len(crawl['_blocks']),
+        }
+    df = prepare_dataframe(synthetic_topics(GOLDEN_TOPICS))
+    rows = records(df)
+    table = {
+        'columns': list(df.columns),
+        'rows': len(df),
+        'first_row': rows[0],
+        'sha256': hashlib.sha256(json.dumps(rows, sort_keys=True).encode('utf-8')).hexdigest(),
+    }
+    return {'pages': pages, 'prepare_dataframe': table}
+
+
+def check_golden(corpus, base_url, golden):
+    """Compares current outputs, every parser backend and a live scrape with `golden`. Returns the mismatches."""
+    def compare(where, expected, actual):
+        if expected != actual:
+            problems.append(f"{where}:\n    expected {json.dumps(expected, ensure_ascii=False)[:300]}\n"
+                            f"    actual   {json.dumps(actual, ensure_ascii=False)[:300]}")
+
+    problems = []
+    current = golden_outputs(corpus)
+    for name in sorted(set(golden['pages']) | set(current['pages'])):
+        expected, actual = golden['pages'].get(name), current['pages'].get(name)
+        if expected is None or actual is None:
+            problems.append(f"{name}: {'not in golden.json (run --update-golden)' if expected is None else 'fixture missing'}")
+            continue
+        for field in expected:
+            compare(f"{name} {field}", expected[field], actual.get(field))
+        content = dict(corpus)[name]
+        for backend in available_parser_backends():
+            compare(f"{name} record ({backend})", expected['record'],
+                    public_fields(summarize_page(FIXTURE_URL + name, parse_html(content, backend))))
+        scraped = scrape_page_details(f"{base_url}{name}?check", HEADERS)
+        compare(f"{name} scrape_page_details", expected['crawl_record'], public_fields(scraped) if scraped else None)
+    for field, value in golden['prepare_dataframe'].items():
+        compare(f"prepare_dataframe {field}", value, current['prepare_dataframe'][field])
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction on the offline fixture corpus and check it against golden outputs.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per function and input (default: 5)")
+    parser.add_argument("--per-page", action="store_true", help="Show every fixture page, not only per-function totals")
+    parser.add_argument("--csv", help="Also write every measurement to this CSV file")
+    parser.add_argument("--check", action="store_true", help="Compare outputs with golden.json instead of benchmarking")
+    parser.add_argument("--update-golden", action="store_true", help="Rewrite golden.json from the current outputs")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus()
+    server = serve_corpus(corpus)
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        if args.update_golden:
+            with open(GOLDEN_PATH, 'w', encoding="utf-8") as f:
+                json.dump(golden_outputs(corpus), f, ensure_ascii=False, indent=2)
+                f.write("\n")
+            print(f"Wrote golden outputs for {len(corpus)} pages to {GOLDEN_PATH}")
+            return 0
+        if args.check:
+            with open(GOLDEN_PATH, encoding="utf-8") as f:
+                problems = check_golden(corpus, base_url, json.load(f))
+            for problem in problems:
+                print(f"MISMATCH {problem}")
+            print(f"{len(problems)} mismatch(es) across {len(corpus)} pages" if problems else f"All outputs match golden.json ({len(corpus)} pages)")
+            return 1 if problems else 0
+
+        results = run_benchmarks(corpus, base_url, max(1, args.repeat))
+        print(f"{len(corpus)} fixture pages, {sum(len(content) for _, content in corpus) / 1024:.0f} KiB, "
+              f"{args.repeat} timed runs each; Python {sys.version.split()[0]}, pandas {pd.__version__}\n")
+        table = results if args.per_page else summarize_runs(results)
+        print(table.to_string(index=False, formatters={
+            'Bytes': '{:,}'.format, 'Items': '{:,}'.format, 'ms': '{:.2f}'.format, 'Peak KiB': '{:,.0f}'.format,
+            'Items/s': '{:,.0f}'.format, 'MB/s': '{:.2f}'.format}))
+        if args.csv:
+            results.to_csv(args.csv, index=False)
+        return 0
+    finally:
+        server.shutdown()
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
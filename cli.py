@@ -0,0 +1,198 @@
+"""Batch topic generation for a list of websites, without the Streamlit UI.
+
+    python cli.py urls.txt --out results --workers 4
+
+The URL file has one website per line (blank lines and lines starting with # are skipped).
+The API key comes from --api-key or the GEMINI_API_KEYS / GEMINI_API_KEY environment variables;
+several comma-separated keys are used in turn.
+
+Each finished site gets <out>/sites/<name>.csv (the app's CSV export, or the --formats chosen)
+and <out>/sites/<name>.json.
+<out>/topics.csv combines the topics of every finished site. Progress is checkpointed in
+<out>/checkpoint.jsonl, so running the same command again skips sites that already finished
+and retries the ones that failed.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from topic_generator import (
+    CRAWL_PAGE_BUDGET, EXPORT_FORMATS, api_key_pool, available_export_formats, normalize_url, records,
+    run_site, site_export_tables, write_export,
+)
+
+logger = logging.getLogger("topic_generator.cli")
+
+
+def read_urls(path):
+    """Reads website URLs from a file, adding https:// where the scheme is missing and dropping repeats."""
+    urls, seen = [], set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            if not re.match(r'^https?://', url, re.IGNORECASE):
+                url = f"https://{url}"
+            key = normalize_url(url)
+            if key not in seen:
+                seen.add(key)
+                urls.append(url)
+    return urls
+
+
+def site_name(url):
+    """File name stem for a site's outputs, e.g. example-com-services."""
+    name = re.sub(r'[^a-z0-9]+', '-', normalize_url(url).split('://', 1)[1].lower()).strip('-')
+    return name[:100] or "site"
+
+
+class Checkpoint:
+    """Append-only log of finished sites; the last entry for a URL wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # a line cut short by an interrupted run
+                    self.entries[normalize_url(entry['url'])] = entry
+
+    def done(self, url):
+        entry = self.entries.get(normalize_url(url))
+        return bool(entry) and entry['status'] == 'ok'
+
+    def record(self, entry):
+        with self._lock:
+            self.entries[normalize_url(entry['url'])] = entry
+            with open(self.path, 'a', encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def write_site(out_dir, result, formats=("CSV",)):
+    """Writes one site's exports and JSON data. Returns the JSON path relative to out_dir."""
+    name = site_name(result['url'])
+    sites_dir = os.path.join(out_dir, "sites")
+    os.makedirs(sites_dir, exist_ok=True)
+    tables = site_export_tables(result)
+    for fmt in formats:
+        write_export(os.path.join(sites_dir, f"{name}.{EXPORT_FORMATS[fmt][0]}"), fmt, tables)
+    document = {
+        'url': result['url'],
+        'analysis': result['analysis'],
+        'pages': result['pages'],
+        'topics': records(result['topics_df']),
+        'warnings': result['warnings'],
+    }
+    json_path = os.path.join("sites", f"{name}.json")
+    with open(os.path.join(out_dir, json_path), 'w', encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    return json_path
+
+
+def write_combined(out_dir, checkpoint, urls):
+    """Writes <out>/topics.csv with the topics of every finished site in the URL file, one Website column first."""
+    frames = []
+    for url in urls:
+        entry = checkpoint.entries.get(normalize_url(url))
+        if not entry or entry['status'] != 'ok':
+            continue
+        with open(os.path.join(out_dir, entry['json']), encoding="utf-8") as f:
+            topics = pd.DataFrame(json.load(f)['topics'])
+        topics.insert(0, "Website", url)
+        frames.append(topics)
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Website"])
+    path = os.path.join(out_dir, "topics.csv")
+    combined.to_csv(path, index=False)
+    return path, len(combined)
+
+
+def process_site(url, api_key, args):
+    started = time.monotonic()
+    try:
+        result = run_site(url, api_key, page_budget=args.page_budget, fanout=not args.single_request, use_cache=not args.refresh,
+                          local_destinations=not args.model_destinations)
+    except Exception as e:  # one broken site must not stop the batch
+        logger.exception("unexpected error for %s", url)
+        result = {'url': url, 'error': f"{type(e).__name__}: {e}"}
+    return result, time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate topics for a list of websites.")
+    parser.add_argument("urls", help="File with one website URL per line")
+    parser.add_argument("--out", default="results", help="Output directory (default: results)")
+    parser.add_argument("--workers", type=int, default=4, help="Sites processed at the same time (default: 4)")
+    parser.add_argument("--page-budget", type=int, default=CRAWL_PAGE_BUDGET, help=f"Pages scraped per site (default: {CRAWL_PAGE_BUDGET})")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEYS") or os.environ.get("GEMINI_API_KEY", ""), help="Gemini API key(s), comma-separated")
+    parser.add_argument("--single-request", action="store_true", help="Generate each site's topics in one request instead of per product/page batch")
+    parser.add_argument("--formats", default="CSV", help=f"Comma-separated export formats per site, from {', '.join(available_export_formats())} (default: CSV)")
+    parser.add_argument("--model-destinations", action="store_true", help="List the crawled URLs in the prompt and let the model pick product topics' destination pages")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached model responses")
+    parser.add_argument("--restart", action="store_true", help="Process every site again, ignoring the checkpoint")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if not api_key_pool(args.api_key):
+        parser.error("an API key is required (--api-key or GEMINI_API_KEYS)")
+    formats = {fmt.lower(): fmt for fmt in available_export_formats()}
+    try:
+        args.formats = [formats[fmt.strip().lower()] for fmt in args.formats.split(',') if fmt.strip()]
+    except KeyError as e:
+        parser.error(f"unknown or unavailable export format {e.args[0]!r}")
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint_path = os.path.join(args.out, "checkpoint.jsonl")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    urls = read_urls(args.urls)
+    pending = [url for url in urls if not checkpoint.done(url)]
+    print(f"{len(urls)} sites, {len(urls) - len(pending)} already done, {len(pending)} to process with {args.workers} workers")
+
+    started = time.monotonic()
+    finished = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(process_site, url, args.api_key, args): url for url in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            result, seconds = future.result()
+            finished += 1
+            if result['error']:
+                failed += 1
+                checkpoint.record({'url': url, 'status': 'failed', 'error': result['error'], 'seconds': round(seconds, 1), 'finished_at': time.time()})
+                status = f"failed: {result['error']}"
+            else:
+                json_path = write_site(args.out, result, args.formats)
+                checkpoint.record({'url': url, 'status': 'ok', 'json': json_path, 'topics': len(result['topics_df']),
+                                   'warnings': len(result['warnings']), 'seconds': round(seconds, 1), 'finished_at': time.time()})
+                status = f"{len(result['topics_df'])} topics" + (f", {len(result['warnings'])} batch(es) failed" if result['warnings'] else "")
+            rate = finished / (time.monotonic() - started) * 3600
+            print(f"[{finished}/{len(pending)}] {url}: {status} ({seconds:.1f}s, {rate:.0f} sites/hour)", flush=True)
+
+    combined_path, rows = write_combined(args.out, checkpoint, urls)
+    elapsed = time.monotonic() - started
+    print(f"Done in {elapsed:.0f}s: {finished - failed} succeeded, {failed} failed"
+          + (f", {finished / elapsed * 3600:.0f} sites/hour" if finished and elapsed else "")
+          + f". {rows} topics in {combined_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Local stand-in for the parts of the Gemini API used by app.py, for offline testing.
+
+Run it and point the app at it:
+
+    python mock_gemini.py --port 8799
+    GEMINI_API_BASE=http://127.0.0.1:8799/v1beta streamlit run app.py
+
+It implements models listing (API key check), generateContent, streamGenerateContent
+(alt=sse) and cachedContents. Responses are filled in from the request's responseSchema,
+and usageMetadata reports estimated prompt and cached tokens. With --prefill-ms the
+time to first token grows with the number of uncached input tokens, like the real API.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+MIN_CACHE_TOKENS = 1024   # Gemini refuses to cache prefixes shorter than this
+CHUNK_CHARS = 200         # Characters of response text per streamed event
+
+
+def estimate_tokens(value):
+    """Rough token count (4 characters per token) of any JSON-serializable value."""
+    text = value if isinstance(value, str) else json.dumps(value)
+    return max(1, len(text) // 4)
+
+
+def sample_from_schema(schema, name="value", index=0):
+    """Builds a response that satisfies a Gemini responseSchema."""
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {key: sample_from_schema(sub, key, index) for key, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        items = schema.get("items", {})
+        enum = items.get("enum")
+        count = len(enum) if enum else 2
+        return [sample_from_schema(items, name, i) for i in range(count)]
+    if schema.get("enum"):
+        return schema["enum"][index % len(schema["enum"])]
+    if kind in ("INTEGER", "NUMBER"):
+        return index
+    if kind == "BOOLEAN":
+        return False
+    return f"Sample {name} {index + 1}"
+
+
+class MockGemini:
+    """In-memory state shared by all requests: cached contents and settings."""
+
+    def __init__(self, prefill_ms=0.0, min_cache_tokens=MIN_CACHE_TOKENS):
+        self.prefill_ms = prefill_ms
+        self.min_cache_tokens = min_cache_tokens
+        self.cached_contents = {}
+        self.lock = threading.Lock()
+
+    def create_cache(self, body):
+        tokens = estimate_tokens(body.get("systemInstruction", "")) + estimate_tokens(body.get("contents", ""))
+        if tokens < self.min_cache_tokens:
+            return 400, {"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                   "message": f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.min_cache_tokens}"}}
+        ttl = float(re.sub(r"s$", "", body.get("ttl", "3600s")))
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.cached_contents[name] = {"body": body, "tokens": tokens, "expires": time.time() + ttl}
+        return 200, {"name": name, "model": body.get("model"), "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+                     "usageMetadata": {"totalTokenCount": tokens}}
+
+    def resolve_cache(self, name):
+        with self.lock:
+            entry = self.cached_contents.get(name)
+            if entry and entry["expires"] <= time.time():
+                del self.cached_contents[name]
+                entry = None
+        return entry
+
+    def generate(self, body):
+        """Returns (status, response text or error document, usageMetadata)."""
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            if body.get("systemInstruction"):
+                return 400, {"error": {"code": 400, "status": "INVALID_ARGUMENT",
+                                       "message": "CachedContent can not be used with GenerateContent request setting system_instruction."}}, None
+            entry = self.resolve_cache(body["cachedContent"])
+            if entry is None:
+                return 403, {"error": {"code": 403, "status": "PERMISSION_DENIED",
+                                       "message": "CachedContent not found (or permission denied)"}}, None
+            cached_tokens = entry["tokens"]
+        fresh_tokens = estimate_tokens(body.get("contents", "")) + estimate_tokens(body.get("systemInstruction", ""))
+        fresh_tokens += estimate_tokens(body.get("generationConfig", {}))
+        time.sleep(self.prefill_ms * fresh_tokens / 1000 / 1000)
+        schema = body.get("generationConfig", {}).get("responseSchema", {"type": "STRING"})
+        text = json.dumps(sample_from_schema(schema))
+        usage = {"promptTokenCount": fresh_tokens + cached_tokens, "candidatesTokenCount": estimate_tokens(text),
+                 "totalTokenCount": fresh_tokens + cached_tokens + estimate_tokens(text)}
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        return 200, text, usage
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status, document):
+            body = json.dumps(document).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path.endswith("/models"):
+                self.send_json(200, {"models": [{"name": "models/mock"}]})
+            else:
+                self.send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": "Not found"}})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if path.endswith("/cachedContents"):
+                self.send_json(*state.create_cache(body))
+                return
+            if not (path.endswith(":generateContent") or path.endswith(":streamGenerateContent")):
+                self.send_json(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": "Not found"}})
+                return
+            status, result, usage = state.generate(body)
+            if status != 200:
+                self.send_json(status, result)
+            elif path.endswith(":streamGenerateContent"):
+                self.send_stream(result, usage)
+            else:
+                self.send_json(200, {"candidates": [{"content": {"parts": [{"text": result}], "role": "model"}, "finishReason": "STOP"}],
+                                     "usageMetadata": usage})
+
+        def send_stream(self, text, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(text), CHUNK_CHARS):
+                event = {"candidates": [{"content": {"parts": [{"text": text[start:start + CHUNK_CHARS]}], "role": "model"}}]}
+                if start + CHUNK_CHARS >= len(text):
+                    event["usageMetadata"] = usage
+                chunk = f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8799, prefill_ms=0.0, min_cache_tokens=MIN_CACHE_TOKENS, background=False):
+    """Starts the mock server. With background=True it runs in a daemon thread and the server is returned."""
+    server = ThreadingHTTPServer((host, port), make_handler(MockGemini(prefill_ms, min_cache_tokens)))
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Mock Gemini API on http://{host}:{port}/v1beta")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="Simulated milliseconds per 1000 uncached input tokens")
+    parser.add_argument("--min-cache-tokens", type=int, default=MIN_CACHE_TOKENS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.prefill_ms, args.min_cache_tokens)
@@ -0,0 +1,38 @@
+"""Golden-output tests for page extraction: every benchmark_corpus page, on every parser backend.
+
+    python -m pytest test_golden.py
+
+After an intended change to extraction, regenerate the expected outputs with
+`python benchmark.py --update-golden` and review the diff of golden.json.
+"""
+import json
+import shutil
+
+import pytest
+
+import benchmark  # sets TOPIC_GENERATOR_CACHE_DIR before topic_generator is imported
+from benchmark import FIXTURE_URL, GOLDEN_PATH, load_corpus, public_fields
+from topic_generator import PARSER_BACKENDS, available_parser_backends, parse_html, summarize_page
+
+CORPUS = dict(load_corpus())
+with open(GOLDEN_PATH, encoding="utf-8") as f:
+    GOLDEN = json.load(f)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def benchmark_cache_dir():
+    yield
+    shutil.rmtree(benchmark.CACHE_DIR, ignore_errors=True)
+
+
+def test_golden_covers_corpus():
+    assert sorted(GOLDEN['pages']) == sorted(CORPUS)
+
+
+@pytest.mark.parametrize("backend", sorted(PARSER_BACKENDS))
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_summarize_page_matches_golden(name, backend):
+    if backend not in available_parser_backends():
+        pytest.skip(f"{backend} is not installed")
+    record = summarize_page(FIXTURE_URL + name, parse_html(CORPUS[name], backend))
+    assert public_fields(record) == GOLDEN['pages'][name]['record']
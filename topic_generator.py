@@ -0,0 +1,3063 @@
+"""Scraping, analysis and topic generation core shared by the Streamlit app and the batch CLI."""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+import json
+from datetime import datetime, timezone
+from bs4 import BeautifulSoup, Tag, NavigableString, CData, TemplateString, UnicodeDammit
+from bs4.builder import HTMLTreeBuilder
+import pandas as pd
+import numpy as np
+import io
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+import os
+import re
+import sys
+import sqlite3
+import zlib
+import hashlib
+import heapq
+import gzip
+import xml.etree.ElementTree as ET
+from urllib.robotparser import RobotFileParser
+from collections import Counter, OrderedDict
+from itertools import groupby
+import html
+import logging
+import time
+import random
+from email.utils import parsedate_to_datetime
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext
+from functools import cache
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # html.parser fallback is used instead
+    lxml = None
+
+try:
+    import xlsxwriter
+except ImportError:  # XLSX export is not offered
+    xlsxwriter = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is not offered
+    pa = pq = None
+
+# --- Setup Logger (Patch 3) ---
+logger = logging.getLogger(__name__)
+
+# --- NLTK Stopwords Fix (Patch 1) ---
+# Hardcode stopwords to avoid nltk.download() errors on Streamlit Cloud
+STOPWORDS = set(['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd", 'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 'hers', 'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what', 'which', 'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if', 'or', 'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between', 'into', 'through', 'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out', 'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't", 'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 'couldn', "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 'haven', "haven't", 'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', "shan't", 'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 'wouldn', "wouldn't"])
+
+
+BOILERPLATE_TOKENS = ['©', 'privacy', 'terms', 'cookie', 'subscribe', 'navigation']
+MIN_PARAGRAPH_WORDS = 6
+MIN_DIV_WORDS = 12
+
+def is_boilerplate(s):
+    return any(tok in s.lower() for tok in BOILERPLATE_TOKENS)
+
+# --- Shared HTTP Client ---
+HTTP_POOL_HOSTS = 20        # Number of hosts that keep an open connection pool
+HTTP_POOL_MAXSIZE = 10      # Keep-alive connections kept per host
+HTTP_CONNECT_TIMEOUT = 5    # Seconds to establish a connection (read timeouts are set per call)
+
+@cache
+def get_http_session(pool_hosts=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE):
+    """Returns the process-wide requests.Session so connections are reused across pages, reruns and users."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # ACCEPT_ENCODING lists only the codecs urllib3 can decode here (gzip/deflate, plus br/zstd if installed)
+    session.headers.update({"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
+    return session
+
+def http_timeout(read_timeout, connect_timeout=HTTP_CONNECT_TIMEOUT):
+    """Builds a (connect, read) timeout tuple for requests."""
+    return (min(connect_timeout, read_timeout), read_timeout)
+
+def http_pool_stats():
+    """Counts connections opened vs. requests that reused an existing keep-alive connection."""
+    opened = served = 0
+    for adapter in set(get_http_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                served += pool.num_requests
+    return {"opened": opened, "reused": max(0, served - opened), "requests": served}
+
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+
+def gemini_url(api_key, method="generateContent"):
+    """Builds the Gemini REST endpoint URL for the configured model."""
+    return f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:{method}?key={api_key}"
+
+def api_key_pool(api_key):
+    """Splits the API key setting into its keys; several keys separated by commas or spaces are used round-robin."""
+    return list(dict.fromkeys(re.split(r'[\s,]+', api_key.strip()))) if api_key and api_key.strip() else []
+
+def validate_api_key(api_key):
+    """Checks if every API key in the setting is valid by making a simple request."""
+    keys = api_key_pool(api_key)
+    try:
+        return bool(keys) and all(get_http_session().get(f"{GEMINI_API_BASE}/models?key={key}", timeout=http_timeout(10)).status_code == 200 for key in keys)
+    except requests.RequestException:
+        return False
+
+# --- Page Cache ---
+PAGE_CACHE_DIR = os.environ.get("TOPIC_GENERATOR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "topic-generator"))
+PAGE_CACHE_TTL = 6 * 60 * 60             # Seconds a cached page is trusted without revalidating
+PAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Total compressed bodies kept before LRU eviction
+EXTRACTOR_VERSION = 7                    # Bump when extract_page_details output changes to invalidate cached records
+
+def normalize_url(url):
+    """Normalizes a URL for use as a cache key (case, default ports, fragments, trailing slash, query order)."""
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower() or "http"
+    netloc = parsed.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parsed.path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, netloc, path, '', query, ''))
+
+
+def open_cache_db(path, table_sql):
+    """Opens (creating if needed) a SQLite cache shared across threads, in WAL mode, with the table `table_sql` creates."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(table_sql)
+    db.commit()
+    return db
+
+def evict_lru(db, table, max_bytes):
+    """Deletes the least recently accessed rows of `table` until its `size` column adds up to at most max_bytes."""
+    total = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+    if total <= max_bytes:
+        return
+    for key, size in db.execute(f"SELECT key, size FROM {table} ORDER BY accessed_at").fetchall():
+        db.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+        total -= size
+        if total <= max_bytes:
+            break
+
+
+class PageCache:
+    """SQLite-backed store of page bodies, HTTP validators and extracted records with LRU eviction."""
+
+    def __init__(self, path, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = open_cache_db(path, """CREATE TABLE IF NOT EXISTS pages (
+            key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL,
+            body BLOB, size INTEGER, record TEXT, record_version INTEGER)""")
+
+    def get(self, url):
+        """Returns the cache entry for `url` as a dict, or None."""
+        key = normalize_url(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, fetched_at, body, record, record_version FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        etag, last_modified, fetched_at, body, record, record_version = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() - fetched_at < self.ttl,
+            'body': zlib.decompress(body),
+            'record': json.loads(record) if record and record_version == EXTRACTOR_VERSION else None,
+        }
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """Stores a freshly downloaded body. Any previously extracted record is dropped."""
+        blob = zlib.compress(body)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL)",
+                (normalize_url(url), etag, last_modified, now, now, blob, len(blob)))
+            evict_lru(self._db, "pages", self.max_bytes)
+            self._db.commit()
+
+    def store_record(self, url, record):
+        """Attaches an extracted page details record to the cached body."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET record = ?, record_version = ? WHERE key = ?",
+                             (json.dumps(record), EXTRACTOR_VERSION, normalize_url(url)))
+            self._db.commit()
+
+    def touch(self, url):
+        """Marks an entry as revalidated (e.g. after a 304 Not Modified)."""
+        with self._lock:
+            now = time.time()
+            self._db.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, normalize_url(url)))
+            self._db.commit()
+
+
+@cache
+def get_page_cache():
+    """Returns the process-wide page cache."""
+    return PageCache(os.path.join(PAGE_CACHE_DIR, "pages.sqlite3"))
+
+
+def fetch_page(url, headers, timeout, throttle=None):
+    """Downloads a page through the cache. Returns (content, record).
+
+    `record` is the cached extraction result when the page is still fresh or the
+    server answered 304 Not Modified; otherwise it is None and `content` needs parsing.
+    An optional HostThrottle is only held while the network request is in flight.
+    """
+    cache = get_page_cache()
+    entry = cache.get(url)
+    if entry and entry['fresh']:
+        return entry['body'], entry['record']
+
+    request_headers = dict(headers)
+    if entry:
+        if entry['etag']:
+            request_headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            request_headers['If-Modified-Since'] = entry['last_modified']
+
+    with throttle.slot(url) if throttle else nullcontext():
+        response = get_http_session().get(url, headers=request_headers, timeout=http_timeout(timeout))
+    if response.status_code == 304 and entry:
+        cache.touch(url)
+        return entry['body'], entry['record']
+    response.raise_for_status()
+    cache.store(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.content, None
+
+# --- NEW SCRAPING & SUMMARIZING FUNCTIONS ---
+
+def summarize_text(text, sentence_count=1):
+    """Simple extractive summary from real text. Returns empty string if input is empty/placeholder."""
+    if not text or text.strip() == "" or text.strip().lower() == "no summary available.":
+        return ""  # explicit empty summary to avoid returning the placeholder
+    
+    text = html.unescape(re.sub(r'\s+', ' ', text))  # Normalize whitespace and unescape entities
+    # Split into sentences (simple heuristic)
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    # Choose the first sentence that's long enough, otherwise the longest sentence, otherwise a snippet
+    for s in sentences:
+        if len(s.split()) >= 8:
+            return s.strip()
+    if sentences:
+        longest = max(sentences, key=lambda s: len(s.split()))
+        if len(longest.split()) >= 4:
+            return longest.strip()
+    # fallback snippet
+    return (text[:200].rstrip() + "...") if len(text) > 200 else text.strip()
+
+# common patterns: <meta name="description">, <meta property="og:description">, <meta name="twitter:description">
+META_DESCRIPTION_SELECTORS = [
+    ('name', 'description'),
+    ('property', 'og:description'),
+    ('name', 'twitter:description'),
+    ('itemprop', 'description'),
+]
+JUNK_TAGS = ["script", "style", "nav", "header", "footer", "aside", "form", "noscript"]
+JUNK_ID_RE = re.compile(r"menu|nav|header|footer|sidebar|cookie|consent", re.IGNORECASE)
+JUNK_CLASS_RE = re.compile(r"menu|nav|header|footer|sidebar|skip|cookie|consent", re.IGNORECASE)
+
+def extract_meta_description(soup):
+    """Robust meta description lookup."""
+    for attr, val in META_DESCRIPTION_SELECTORS:
+        tag = soup.find('meta', attrs={attr: val})
+        if tag and tag.get('content'):
+            return tag['content'].strip()
+    return "No Meta Description"
+
+def clean_soup(soup):
+    """Remove unwanted tags and attributes to make text extraction cleaner."""
+    for junk_tag in soup(JUNK_TAGS):
+        junk_tag.extract()
+    # remove common junk by id/class
+    for junk in soup.find_all(id=JUNK_ID_RE):
+        junk.extract()
+    for junk in soup.find_all(class_=JUNK_CLASS_RE):
+        junk.extract()
+    return soup
+
+def get_best_paragraph(soup):
+    """Return the best candidate paragraph text from the parsed page."""
+    candidates = []
+
+    # 1) Prefer paragraphs with >= MIN_PARAGRAPH_WORDS
+    main_content = soup.find("main") or soup.find("article") or soup.find("div", attrs={"role": "main"})
+    if main_content:
+        candidates += [p.get_text(separator=' ', strip=True) for p in main_content.find_all("p") if not is_boilerplate(p.get_text(strip=True)) and len(p.get_text(strip=True).split()) >= MIN_PARAGRAPH_WORDS]
+
+    # 2) If none found, examine all <p> in body
+    if not candidates:
+        body = soup.find("body")
+        if body:
+            candidates = [p.get_text(separator=' ', strip=True) for p in body.find_all("p") if not is_boilerplate(p.get_text(strip=True)) and len(p.get_text(strip=True).split()) >= MIN_PARAGRAPH_WORDS]
+
+    # 2a) consider headings with following sibling text (PATCH #2)
+    if not candidates:
+        for h in soup.find_all(['h1','h2','h3']):
+            heading = h.get_text(separator=' ', strip=True)
+            sib = h.find_next_sibling()
+            gathered = []
+            while sib and len(' '.join(gathered).split()) < 60:
+                txt = sib.get_text(separator=' ', strip=True)
+                if txt:
+                    gathered.append(txt)
+                sib = sib.find_next_sibling()
+            combined = ' '.join([heading] + gathered).strip()
+            if len(combined.split()) >= MIN_PARAGRAPH_WORDS and not is_boilerplate(combined):
+                candidates.append(combined)
+
+    # 3) If still empty, try collecting large text blocks from divs
+    if not candidates:
+        div_texts = []
+        for d in soup.find_all("div"):
+            txt = d.get_text(separator=' ', strip=True)
+            if txt and len(txt.split()) >= MIN_DIV_WORDS and not is_boilerplate(txt): # Use MIN_DIV_WORDS
+                div_texts.append(txt)
+        candidates = div_texts
+
+    # 4) As last resort, use body text chunks split by double newline or long sentences
+    if not candidates:
+        full = soup.get_text(separator='\n', strip=True)
+        chunks = [c.strip() for c in re.split(r'\n{2,}|\r\n{2,}', full) if len(c.split()) >= MIN_PARAGRAPH_WORDS and not is_boilerplate(c)]
+        candidates = chunks
+
+    # 5) Choose best candidate: prefer first paragraph >=MIN_PARAGRAPH_WORDS, otherwise the longest candidate
+    for p in candidates:
+        if p and len(p.split()) >= MIN_PARAGRAPH_WORDS: # Use MIN_PARAGRAPH_WORDS
+            return p.strip()
+    if candidates:
+        longest = max(candidates, key=lambda s: len(s.split()))
+        return longest.strip()
+    return ""
+
+
+# --- Single-pass Extraction ---
+LINE_BLOCK_TAGS = frozenset((  # Elements that start a new line of text, as a browser renders them
+    'address', 'article', 'aside', 'blockquote', 'body', 'caption', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'summary', 'table', 'td', 'th', 'tr', 'ul'))
+
+class ParsedPage:
+    """Everything the scraper reads from a page, collected in one walk of the parsed tree.
+
+    `texts` and `elements` only cover content outside junk elements (what clean_soup
+    would leave behind); `raw_texts` and `hrefs` cover everything except script/style.
+    `raw_blocks` holds, for each raw text, a number identifying its innermost LINE_BLOCK_TAGS element.
+    Each element is [name, role, first text index, end text index, parent, last descendant].
+    Like bs4, a <template> element's own text comes from its TemplateStrings, kept apart in `template_texts`.
+    """
+
+    def __init__(self):
+        self.title = None
+        self.canonical = None
+        self.meta = {}
+        self.hrefs = []
+        self.raw_texts = []
+        self.raw_blocks = []
+        self.texts = []
+        self.template_texts = []
+        self.template_spans = {}
+        self.elements = [['[document]', None, 0, 0, None, 0]]
+        self.children = {0: []}
+
+    def text(self, idx, separator=' '):
+        """Equivalent of element.get_text(separator=separator, strip=True)."""
+        if idx in self.template_spans:
+            start, end = self.template_spans[idx]
+            return separator.join(self.template_texts[start:end])
+        _, _, start, end, _, _ = self.elements[idx]
+        return separator.join(self.texts[start:end])
+
+    def raw_lines(self):
+        """raw_texts joined into one line per block element, so inline markup (links, <strong>) doesn't split sentences."""
+        return [' '.join(text for _, text in run) for _, run in groupby(zip(self.raw_blocks, self.raw_texts), key=lambda item: item[0])]
+
+    def find_all(self, names, within=0):
+        """Indexes of elements named `names` below element `within`, in document order."""
+        names = (names,) if isinstance(names, str) else names
+        last = self.elements[within][5]
+        return [i for i in range(within + 1, last + 1) if self.elements[i][0] in names]
+
+    def find(self, name, within=0, role=None):
+        for i in self.find_all(name, within):
+            if role is None or self.elements[i][1] == role:
+                return i
+        return None
+
+    def meta_description(self):
+        for selector in META_DESCRIPTION_SELECTORS:
+            content = self.meta.get(selector)
+            if content:
+                return content.strip()
+        return "No Meta Description"
+
+
+def _is_junk(tag):
+    if tag.name in JUNK_TAGS:
+        return True
+    attrs = tag.attrs
+    tag_id = attrs.get('id')
+    if tag_id and JUNK_ID_RE.search(tag_id):
+        return True
+    return any(JUNK_CLASS_RE.search(c) for c in attrs.get('class') or ())
+
+
+def parse_page(soup):
+    """Walks the parsed tree once and returns a ParsedPage."""
+    page = ParsedPage()
+    elements, texts, raw_texts = page.elements, page.texts, page.raw_texts
+    title_seen = False
+    blocks = 0
+    # Stack entries: (node, parent element index, inside junk, inside script/style, block number); node None marks an element's end
+    stack = [(child, 0, False, False, 0) for child in reversed(soup.contents)]
+    while stack:
+        node, parent, junk, hidden, block = stack.pop()
+        if node is None:
+            elements[parent][3] = len(texts)
+            elements[parent][5] = len(elements) - 1
+            if parent in page.template_spans:
+                page.template_spans[parent] = (page.template_spans[parent][0], len(page.template_texts))
+            continue
+        if isinstance(node, Tag):
+            name = node.name
+            if name == 'title' and not title_seen:
+                title_seen = True
+                page.title = node.string
+            elif name == 'meta':
+                for selector in META_DESCRIPTION_SELECTORS:
+                    if selector not in page.meta and node.get(selector[0]) == selector[1]:
+                        page.meta[selector] = node.get('content')
+            elif name == 'a' and not hidden and node.get('href') is not None:
+                page.hrefs.append(node['href'].strip())
+            elif name == 'link' and page.canonical is None and 'canonical' in (node.get('rel') or ()) and node.get('href'):
+                page.canonical = node['href'].strip()
+            hidden = hidden or name in ('script', 'style')
+            if name in LINE_BLOCK_TAGS:
+                blocks += 1
+                block = blocks
+            if not junk and _is_junk(node):
+                junk = True
+            if not junk:
+                idx = len(elements)
+                elements.append([name, node.get('role'), len(texts), len(texts), parent, idx])
+                page.children[parent].append(idx)
+                page.children[idx] = []
+                if name == 'template':
+                    page.template_spans[idx] = (len(page.template_texts), None)
+                stack.append((None, idx, junk, hidden, block))
+                parent = idx
+            stack.extend((child, parent, junk, hidden, block) for child in reversed(node.contents))
+        elif type(node) is NavigableString or type(node) is CData:
+            value = node.strip()
+            if value:
+                if not hidden:
+                    raw_texts.append(value)
+                    page.raw_blocks.append(block)
+                if not junk:
+                    texts.append(value)
+        elif type(node) is TemplateString and not junk:
+            value = node.strip()
+            if value:
+                page.template_texts.append(value)
+    elements[0][3] = len(texts)
+    elements[0][5] = len(elements) - 1
+    return page
+
+
+def select_best_paragraph(page, template=None):
+    """Same selection rules as get_best_paragraph, applied to a ParsedPage instead of re-walking the tree.
+
+    Text with BOILERPLATE_TOKENS is skipped, and so are blocks of the SiteTemplate `template` (see boilerplate_check).
+    """
+    skip = boilerplate_check(template)
+
+    def paragraph_candidates(within):
+        found = []
+        for i in page.find_all('p', within):
+            tight = page.text(i, '')  # get_text(strip=True) joins without spaces
+            if len(tight.split()) >= MIN_PARAGRAPH_WORDS and not skip(page.text(i)):
+                found.append(page.text(i))
+        return found
+
+    candidates = []
+
+    # 1) Prefer paragraphs with >= MIN_PARAGRAPH_WORDS
+    main_content = page.find('main')
+    if main_content is None:
+        main_content = page.find('article')
+    if main_content is None:
+        main_content = page.find('div', role='main')
+    if main_content is not None:
+        candidates += paragraph_candidates(main_content)
+
+    # 2) If none found, examine all <p> in body
+    if not candidates:
+        body = page.find('body')
+        if body is not None:
+            candidates = paragraph_candidates(body)
+
+    # 2a) consider headings with following sibling text
+    if not candidates:
+        for h in page.find_all(('h1', 'h2', 'h3')):
+            heading = page.text(h)
+            siblings = page.children[page.elements[h][4]]
+            gathered = []
+            for sib in siblings[siblings.index(h) + 1:]:
+                if len(' '.join(gathered).split()) >= 60:
+                    break
+                txt = page.text(sib)
+                if txt:
+                    gathered.append(txt)
+            combined = ' '.join([heading] + gathered).strip()
+            if len(combined.split()) >= MIN_PARAGRAPH_WORDS and not skip(heading) and not skip(combined):
+                candidates.append(combined)
+
+    # 3) If still empty, try collecting large text blocks from divs
+    if not candidates:
+        for d in page.find_all('div'):
+            txt = page.text(d)
+            if txt and len(txt.split()) >= MIN_DIV_WORDS and not skip(txt):
+                candidates.append(txt)
+
+    # 4) As last resort, use body text chunks split by double newline or long sentences
+    if not candidates:
+        full = '\n'.join(page.texts)
+        candidates = [c.strip() for c in re.split(r'\n{2,}|\r\n{2,}', full) if len(c.split()) >= MIN_PARAGRAPH_WORDS and not skip(c)]
+
+    # 5) Choose best candidate: prefer first paragraph >=MIN_PARAGRAPH_WORDS, otherwise the longest candidate
+    for p in candidates:
+        if p and len(p.split()) >= MIN_PARAGRAPH_WORDS:
+            return p.strip()
+    if candidates:
+        longest = max(candidates, key=lambda s: len(s.split()))
+        return longest.strip()
+    return ""
+
+
+def extract_internal_links(base_url, hrefs):
+    """Resolves hrefs against base_url and keeps same-site page URLs, rewritten to the base URL's scheme and host."""
+    links = set()
+    for href in hrefs:
+        if not href or href.startswith('#') or href.startswith('mailto:') or href.startswith('tel:') or href.lower().startswith('javascript:'):
+            continue
+        site_url = to_site_url(urljoin(base_url, href), base_url)
+        if site_url:
+            links.add(site_url)
+    return links
+
+
+# --- Parser Backends ---
+PARSER_BACKEND = os.environ.get("TOPIC_GENERATOR_PARSER", "auto")  # "auto" (lxml when installed), "lxml" or "html.parser"
+XML_DECLARATION_RE = re.compile(r'^\s*<\?xml[^>]*\?>')
+LXML_TAG_PREFIX = 'tg-'  # Source tags are renamed to unknown elements so libxml2 nests them like html.parser
+LXML_TAG_OPEN_RE = re.compile(r'<(/?)(?=[a-zA-Z])')  # Where html.parser starts a start or end tag
+LXML_END_TAG_RE = re.compile(r'(</[a-zA-Z][^>]*>)')  # An end tag, up to the first '>' like html.parser
+LXML_RAW_TEXT_RE = re.compile(rf'<(/?){LXML_TAG_PREFIX}(script|style)(?=[\t\n\r\f />]|$)', re.IGNORECASE)  # html.parser's CDATA elements keep their names
+LXML_MARKUP_RE = re.compile(rf'(</)(?:{LXML_TAG_PREFIX})?([a-zA-Z][^>]*>)<\?>|<{LXML_TAG_PREFIX}')  # Both rewrites, to undo them in attribute values
+LXML_END_MARKER = '?'  # Text of the bogus comment libxml2 makes of the <?> after each end tag
+VOID_ELEMENTS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS  # Closed right away by bs4; libxml2 sees them as open containers once renamed
+
+def parse_with_html_parser(content):
+    """Reference backend: BeautifulSoup with Python's built-in html.parser."""
+    return parse_page(BeautifulSoup(content, 'html.parser'))
+
+
+def is_end_marker(node):
+    return node.tag is etree.Comment and node.text == LXML_END_MARKER
+
+def lxml_string(node):
+    """bs4's .string for a renamed lxml element: its only text, found through a chain of single children."""
+    while True:
+        contents = [node.text] if node.text else []
+        for child in node:
+            if not is_end_marker(child):
+                contents.append(child)
+            if child.tail:
+                contents.append(child.tail)
+        if len(contents) != 1:
+            return None
+        if isinstance(contents[0], str):
+            return contents[0]
+        node = contents[0]
+        if not isinstance(node.tag, str):
+            return node.text  # a comment is a string to bs4
+        if node.tag[len(LXML_TAG_PREFIX):] in VOID_ELEMENTS:
+            return None
+
+
+def parse_with_lxml(content):
+    """Fast backend: walks an lxml.html tree directly into a ParsedPage, without building a soup.
+
+    libxml2 closes unclosed <p>, <li> and other known elements like a browser, where html.parser
+    leaves them open until an end tag pops them. Every tag except script and style is therefore
+    renamed with LXML_TAG_PREFIX first: libxml2 never auto-closes elements it doesn't know, so the
+    tree nests like html.parser's. The elements libxml2 implies (html, head, body) are skipped, and
+    the children of void elements, which the renamed tags turn into containers, are lifted back
+    into their parent. Pages nested deeper than libxml2 allows are parsed with html.parser.
+    """
+    source = content
+    if isinstance(content, bytes):
+        # lxml assumes latin-1 when the markup declares no charset; decode like bs4 does (declared charset, then UTF-8, ...)
+        content = UnicodeDammit(content, is_html=True).unicode_markup or content.decode('utf-8', errors='replace')
+    content = XML_DECLARATION_RE.sub('', content, count=1)  # lxml refuses str input with an encoding declaration
+    # bs4 ends the current string at every end tag, even one that closes nothing, which libxml2 drops:
+    # an empty bogus comment after each end tag keeps the text on both sides apart
+    content = LXML_END_TAG_RE.sub(r'\1<?>', content)
+    content = LXML_RAW_TEXT_RE.sub(r'<\1\2', LXML_TAG_OPEN_RE.sub(rf'<\1{LXML_TAG_PREFIX}', content))
+    parser = lxml.html.HTMLParser(huge_tree=True)
+    try:
+        root = lxml.html.document_fromstring(content, parser=parser)
+    except (etree.ParserError, ValueError):
+        return ParsedPage()  # empty or unparseable document
+    if any(error.type_name == 'ERR_RESOURCE_LIMIT' for error in parser.error_log):
+        return parse_with_html_parser(source)  # libxml2 dropped what was nested too deep
+    unprefix = lambda value: LXML_MARKUP_RE.sub(lambda m: m.group(1) + m.group(2) if m.group(1) else '<', value) if value and '<' in value else value
+
+    page = ParsedPage()
+    elements, texts, raw_texts = page.elements, page.texts, page.raw_texts
+    title_seen = False
+    blocks = 0
+    # Stack entries: (kind, node or text, parent element index, inside junk, inside <template>, block number)
+    ELEMENT, END, TEXT = 0, 1, 2
+    stack = [(ELEMENT, root, 0, False, False, 0)]
+    while stack:
+        kind, node, parent, junk, in_template, block = stack.pop()
+        if kind == TEXT:
+            value = node.strip()
+            if not value:
+                continue
+            if in_template:
+                if not junk:
+                    page.template_texts.append(value)
+                continue
+            raw_texts.append(value)
+            page.raw_blocks.append(block)
+            if not junk:
+                texts.append(value)
+            continue
+        if kind == END:
+            elements[parent][3] = len(texts)
+            elements[parent][5] = len(elements) - 1
+            if parent in page.template_spans:
+                page.template_spans[parent] = (page.template_spans[parent][0], len(page.template_texts))
+            continue
+
+        name = node.tag
+        if not isinstance(name, str):
+            continue  # comments and processing instructions
+        if name.startswith(LXML_TAG_PREFIX):
+            name = name[len(LXML_TAG_PREFIX):]
+        elif name not in ('script', 'style'):
+            # Implied by libxml2, not in the source: its content belongs to the enclosing element
+            for child in reversed(node):
+                if child.tail:
+                    stack.append((TEXT, child.tail, parent, junk, in_template, block))
+                stack.append((ELEMENT, child, parent, junk, in_template, block))
+            if node.text:
+                stack.append((TEXT, node.text, parent, junk, in_template, block))
+            continue
+        attrs = node.attrib
+        if name == 'title' and not title_seen:
+            title_seen = True
+            page.title = lxml_string(node)
+        elif name == 'meta':
+            for selector in META_DESCRIPTION_SELECTORS:
+                if selector not in page.meta and attrs.get(selector[0]) == selector[1]:
+                    page.meta[selector] = unprefix(attrs.get('content'))
+        elif name == 'a' and attrs.get('href') is not None:
+            page.hrefs.append(unprefix(attrs['href']).strip())
+        elif name == 'link' and page.canonical is None and 'canonical' in attrs.get('rel', '').lower().split() and attrs.get('href'):
+            page.canonical = unprefix(attrs['href']).strip()
+
+        if name in VOID_ELEMENTS:
+            # An empty element; what libxml2 nested inside it follows it in the enclosing element
+            tag_id = attrs.get('id')
+            if not (junk or name in JUNK_TAGS or (tag_id and JUNK_ID_RE.search(tag_id))
+                    or any(JUNK_CLASS_RE.search(c) for c in attrs.get('class', '').split())):
+                idx = len(elements)
+                elements.append([name, attrs.get('role'), len(texts), len(texts), parent, idx])
+                page.children[parent].append(idx)
+                page.children[idx] = []
+            for child in reversed(node):
+                if child.tail:
+                    stack.append((TEXT, child.tail, parent, junk, in_template, block))
+                stack.append((ELEMENT, child, parent, junk, in_template, block))
+            if node.text:
+                stack.append((TEXT, node.text, parent, junk, in_template, block))
+            continue
+
+        if name in LINE_BLOCK_TAGS:
+            blocks += 1
+            block = blocks
+        if not junk:
+            tag_id = attrs.get('id')
+            junk = (name in JUNK_TAGS
+                    or bool(tag_id and JUNK_ID_RE.search(tag_id))
+                    or any(JUNK_CLASS_RE.search(c) for c in attrs.get('class', '').split()))
+        if not junk:
+            idx = len(elements)
+            elements.append([name, attrs.get('role'), len(texts), len(texts), parent, idx])
+            page.children[parent].append(idx)
+            page.children[idx] = []
+            if name == 'template':
+                page.template_spans[idx] = (len(page.template_texts), None)
+            stack.append((END, None, idx, junk, in_template, block))
+            parent = idx
+        child_in_template = in_template or name == 'template'
+        for child in reversed(node):
+            if child.tail:
+                stack.append((TEXT, child.tail, parent, junk, child_in_template, block))
+            stack.append((ELEMENT, child, parent, junk, child_in_template, block))
+        if node.text and name not in ('script', 'style'):
+            stack.append((TEXT, node.text, parent, junk, child_in_template, block))
+
+    elements[0][3] = len(texts)
+    elements[0][5] = len(elements) - 1
+    return page
+
+
+PARSER_BACKENDS = {
+    'lxml': parse_with_lxml,
+    'html.parser': parse_with_html_parser,
+}
+
+def available_parser_backends():
+    """Names of the backends that can run in this environment, fastest first."""
+    return [name for name in PARSER_BACKENDS if name != 'lxml' or lxml is not None]
+
+def parse_html(content, backend=None):
+    """Parses page HTML into a ParsedPage with the configured backend.
+
+    "auto" and unavailable backends use the fastest available one; all produce the same records.
+    """
+    backend = backend or PARSER_BACKEND
+    if backend == 'auto' or backend not in available_parser_backends():
+        backend = available_parser_backends()[0]
+    return PARSER_BACKENDS[backend](content)
+
+
+def compare_parser_backends(pages, repeat=3):
+    """Times parse+extract per page for each available backend and checks records match html.parser.
+
+    `pages` is a list of (url, content) pairs. Returns a DataFrame with one row per page and backend.
+    """
+    rows = []
+    for url, content in pages:
+        reference = summarize_page(url, parse_with_html_parser(content))
+        for backend in available_parser_backends():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                record = summarize_page(url, parse_html(content, backend))
+            elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+            rows.append({'URL': url, 'Backend': backend, 'Bytes': len(content),
+                         'Parse+Extract (ms)': round(elapsed_ms, 2), 'Matches html.parser': record == reference})
+    return pd.DataFrame(rows)
+
+
+def extract_page_details(url, content, backend=None):
+    """Parses raw page HTML into a details record."""
+    return summarize_page(url, parse_html(content, backend))
+
+
+def summarize_page(url, page, template=None):
+    """Builds the page details record from a ParsedPage and avoids returning the title as the content summary.
+
+    `template` is the site's SiteTemplate, whose blocks are never used for the summary (see boilerplate_check).
+    """
+    title = page.title.strip() if page.title else "No Title"
+    meta = page.meta_description()
+
+    content_text = select_best_paragraph(page, template)
+
+    # Better fallback: remove title/meta and pick the longest meaningful chunk
+    if not content_text:
+        full_text = '\n'.join(page.texts)
+        if title and title != "No Title" and title in full_text:
+            # remove only the first occurrence to preserve repeated phrases later
+            full_text = re.sub(rf'\b{re.escape(title)}\b', '', full_text, count=1, flags=re.IGNORECASE).strip()
+        if meta and meta != "No Meta Description" and meta in full_text:
+            full_text = re.sub(rf'\b{re.escape(meta)}\b', '', full_text, count=1, flags=re.IGNORECASE).strip()
+
+        # Keep only lines that look meaningful (>= 8 words, but using new constant)
+        skip = boilerplate_check(template)
+        lines = [ln.strip() for ln in full_text.splitlines() if len(ln.split()) >= MIN_PARAGRAPH_WORDS and not skip(ln)]
+        if lines:
+            content_text = max(lines, key=lambda s: len(s.split()))
+        else:
+            # Last resort: cleaned continuous text snippet (without title)
+            plain = re.sub(r'\s+', ' ', full_text).strip()
+            content_text = plain[:1000] if plain else ""
+
+    summary = summarize_text(content_text)
+    source = content_text
+
+    # Guard: if summary equals the title, try alternative paragraph or give empty summary
+    if summary and title and summary.strip().lower() == title.strip().lower():
+        paras = [page.text(i) for i in page.find_all('p') if len(page.text(i, '').split()) >= MIN_PARAGRAPH_WORDS]
+        # prefer paragraph that is not the title and not identical to content_text
+        paras = [p for p in paras if p.strip().lower() != title.strip().lower() and p.strip().lower() != (content_text or "").strip().lower()]
+        alt = max(paras, key=lambda s: len(s.split())) if paras else ""
+        if alt:
+            summary = summarize_text(alt) or (alt[:200].rstrip() + "..." if len(alt) > 200 else alt)
+            source = alt
+        else:
+            # fallback to meta description if available
+            if meta and meta != "No Meta Description" and len(meta.split()) >= 5:
+                summary = meta
+            else:
+                summary = ""
+            source = None
+
+    if not summary:
+        # Use logger.debug for production, print for this environment
+        logger.debug("no summary for %s; title=%s content_len=%d", url, title, len(content_text.split()) if content_text else 0)
+        summary = ""  # caller can decide placeholder display
+
+    record = {'URL': url, 'Page Title': title, 'Meta Description': meta, 'Content Summary': summary}
+    if page.canonical:
+        record['_canonical'] = urljoin(url, page.canonical)  # internal: used to drop duplicate pages, stripped by scrape_website
+    if summary and source:
+        record['_source'] = block_key(source)  # internal: the block the summary came from, checked against the site template
+    return record
+
+
+def scrape_page_details(url, headers, timeout=8, throttle=None):
+    """Scrapes details from a single page, reusing the cached record when the page has not changed."""
+    try:
+        content, record = fetch_page(url, headers, timeout, throttle)
+        if record is None:
+            record = crawl_record(url, parse_html(content))
+            get_page_cache().store_record(url, record)
+        return dict(record, URL=url)
+    except requests.RequestException:
+        return None
+
+
+# --- Site Template ---
+TEMPLATE_MIN_PAGES = 4      # Pages a crawl needs before a repeated block says anything about the site
+TEMPLATE_PAGE_SHARE = 0.6   # Share of the crawled pages a block must appear on to be template
+TEMPLATE_BLOCK_TAGS = ('p', 'div', 'li', 'section', 'article', 'blockquote', 'td', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+def block_key(text):
+    """Stable short hash of a text block, ignoring case, entities and whitespace."""
+    normalized = ' '.join(html.unescape(text).lower().split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+def page_block_keys(page):
+    """Sorted keys of a ParsedPage's text blocks (block elements and text lines) of at least MIN_LINE_WORDS words."""
+    blocks = [page.text(i) for i in page.find_all(TEMPLATE_BLOCK_TAGS)] + page.raw_lines()
+    return sorted({block_key(block) for block in blocks if len(block.split()) >= MIN_LINE_WORDS})
+
+def boilerplate_check(template):
+    """Predicate for text extraction should skip: text with BOILERPLATE_TOKENS and, given a SiteTemplate, its blocks.
+
+    The tokens still apply with a template: banners on too few pages to be template, and crawls
+    too short or stopped before one exists, would otherwise have no filter at all.
+    """
+    if template is None:
+        return is_boilerplate
+    return lambda text: is_boilerplate(text) or text in template
+
+
+class SiteTemplate:
+    """Text blocks repeated on most pages of a site: navigation, footers, banners, calls to action.
+
+    Built after a crawl from each page's block keys. Extraction skips these blocks on top
+    of BOILERPLATE_TOKENS, catching calls to action, address blocks and testimonials that
+    no keyword describes.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    @classmethod
+    def from_pages(cls, block_keys, min_pages=TEMPLATE_MIN_PAGES, share=TEMPLATE_PAGE_SHARE):
+        """Counts the pages each block appears on; blocks on at least `share` of them are template.
+
+        `block_keys` holds one list of keys per page. Below `min_pages` pages the template is empty.
+        """
+        block_keys = list(block_keys)
+        if len(block_keys) < min_pages:
+            return cls()
+        counts = Counter(key for keys in block_keys for key in set(keys))
+        return cls(key for key, count in counts.items() if count >= share * len(block_keys))
+
+    def __contains__(self, text):
+        return block_key(text) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def crawl_record(url, page):
+    """Page record for a crawl: extracted with BOILERPLATE_TOKENS before the site template is known, plus the page's block keys."""
+    record = summarize_page(url, page)
+    record['_blocks'] = page_block_keys(page)  # internal: counted across the crawl by SiteTemplate.from_pages
+    return record
+
+
+def apply_site_template(records, template, parsed=None):
+    """Re-extracts the crawl records whose summary came from a template block, skipping the template this time.
+
+    Pages are parsed again from the page cache unless `parsed` maps their URL to a
+    ParsedPage, and the new records replace the cached ones so the next crawl of an
+    unchanged site has nothing to redo. Returns (records, number re-extracted).
+    """
+    parsed = parsed or {}
+    updated, changed = [], 0
+    for record in records:
+        if record.get('_source') in template.keys:
+            page = parsed.get(record['URL'])
+            if page is None:
+                entry = get_page_cache().get(record['URL'])
+                page = parse_html(entry['body']) if entry else None
+            if page is not None:
+                record = dict(summarize_page(record['URL'], page, template), _blocks=record['_blocks'])
+                get_page_cache().store_record(record['URL'], record)
+                changed += 1
+        updated.append(record)
+    return updated, changed
+
+
+# --- Concurrent Crawler ---
+CRAWL_MAX_WORKERS = 8      # Total pages fetched at the same time
+CRAWL_PER_HOST_LIMIT = 8   # Max simultaneous requests to a single host
+CRAWL_POLITE_DELAY = 0.1   # Seconds between request starts on the same host
+CRAWL_DEADLINE = 30        # Hard limit in seconds for the whole crawl (robots.txt, sitemaps and subpages)
+
+class HostThrottle:
+    """Limits concurrent requests per host and spaces out their start times."""
+
+    def __init__(self, per_host_limit=CRAWL_PER_HOST_LIMIT, polite_delay=CRAWL_POLITE_DELAY):
+        self.per_host_limit = max(1, per_host_limit)
+        self.polite_delay = polite_delay
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._next_start = {}
+
+    def acquire(self, host):
+        with self._lock:
+            slot = self._slots.setdefault(host, threading.BoundedSemaphore(self.per_host_limit))
+        slot.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start_at + self.polite_delay
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def release(self, host):
+        self._slots[host].release()
+
+    @contextmanager
+    def slot(self, url):
+        """Holds a request slot for the URL's host for the duration of the block."""
+        host = urlparse(url).netloc
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+
+def iter_crawl_pages(urls, headers, max_workers=CRAWL_MAX_WORKERS, per_host_limit=CRAWL_PER_HOST_LIMIT,
+                     polite_delay=CRAWL_POLITE_DELAY, deadline=CRAWL_DEADLINE, page_timeout=8):
+    """Scrapes many pages concurrently, yielding (index in urls, page details or None) as each page finishes.
+
+    Pages that have not finished by the crawl deadline are never yielded.
+    """
+    if not urls:
+        return
+    throttle = HostThrottle(per_host_limit, polite_delay)
+    stop_at = time.monotonic() + deadline
+
+    def fetch(page_url):
+        remaining = stop_at - time.monotonic()
+        if remaining <= 0:
+            return None
+        return scrape_page_details(page_url, headers, timeout=min(page_timeout, remaining), throttle=throttle)
+
+    started = time.monotonic()
+    finished = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    futures = {executor.submit(fetch, u): i for i, u in enumerate(urls)}
+    try:
+        for future in as_completed(futures, timeout=max(0, stop_at - time.monotonic())):
+            index = futures[future]
+            finished += 1
+            if future.exception() is not None:
+                logger.debug("crawl of %s failed: %s", urls[index], future.exception())
+                yield index, None
+            else:
+                yield index, future.result()
+    except TimeoutError:
+        pass
+    finally:
+        # Don't block the UI on stragglers (or a cancelled crawl); they finish in the background and are discarded
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.debug("crawled %d/%d pages in %.2fs", finished, len(urls), time.monotonic() - started)
+
+
+def crawl_pages(urls, headers, **options):
+    """Scrapes many pages concurrently.
+
+    Returns a list aligned with `urls`: the page details dict, or None if the page
+    failed or did not finish before the crawl deadline.
+    """
+    results = [None] * len(urls)
+    for index, details in iter_crawl_pages(urls, headers, **options):
+        results[index] = details
+    return results
+
+
+# --- Crawl Frontier ---
+CRAWL_PAGE_BUDGET = 20       # Pages scraped per site, including the homepage
+SITEMAP_MAX_FILES = 10       # Sitemap files read, including nested sitemap indexes
+SITEMAP_TIMEOUT = 8          # Seconds per robots.txt / sitemap request (never past the crawl deadline)
+SITEMAP_MAX_URLS = 5000      # Sitemap URLs considered before ranking
+ROBOTS_USER_AGENT = "Googlebot"  # Product token matched against robots.txt groups (matches our User-Agent)
+NON_HTML_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.zip', '.mp4', '.mp3', '.xml', '.css', '.js', '.doc', '.docx', '.xls', '.xlsx')
+
+def site_host(netloc):
+    """Host used to decide whether two URLs are the same site (case, port and www. ignored)."""
+    host = netloc.lower().rsplit('@', 1)[-1].split(':', 1)[0]
+    return host[4:] if host.startswith('www.') else host
+
+def canonical_key(url):
+    """Identity of a page for deduplication: ignores scheme, www., trailing slash, query and fragment."""
+    parsed = urlparse(url)
+    return site_host(parsed.netloc) + (parsed.path.rstrip('/') or '')
+
+def to_site_url(url, base_url):
+    """Rewrites a same-site URL onto base_url's scheme and host (no query/fragment, no trailing slash).
+
+    Returns None for other sites and for links to non-HTML files.
+    """
+    parsed, base = urlparse(url), urlparse(base_url)
+    if parsed.scheme not in ('http', 'https') or site_host(parsed.netloc) != site_host(base.netloc):
+        return None
+    if parsed.path.lower().endswith(NON_HTML_EXTENSIONS):
+        return None
+    return (base.scheme + "://" + base.netloc + parsed.path).rstrip('/')
+
+
+def time_left(stop_at, timeout=SITEMAP_TIMEOUT):
+    """Request timeout capped at the seconds left before `stop_at` (a time.monotonic() value, or None for no limit)."""
+    if stop_at is None:
+        return timeout
+    return min(timeout, stop_at - time.monotonic())
+
+
+def fetch_robots(base_url, headers, stop_at=None):
+    """Reads robots.txt through the page cache. Returns a RobotFileParser (allows everything if missing)."""
+    robots = RobotFileParser()
+    base = urlparse(base_url)
+    timeout = time_left(stop_at)
+    try:
+        if timeout <= 0:
+            raise requests.Timeout("crawl deadline passed before robots.txt was read")
+        content, _ = fetch_page(f"{base.scheme}://{base.netloc}/robots.txt", headers, timeout=timeout)
+        robots.parse(content.decode('utf-8', errors='replace').splitlines())
+    except requests.RequestException:
+        robots.parse([])
+    return robots
+
+
+def parse_sitemap(content):
+    """Parses a sitemap or sitemap index. Returns (page entries, nested sitemap URLs)."""
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return [], []
+    def child_text(node, name):
+        for child in node:
+            if child.tag.rsplit('}', 1)[-1] == name and child.text:
+                return child.text.strip()
+        return None
+
+    entries, nested = [], []
+    for node in root:
+        kind = node.tag.rsplit('}', 1)[-1]
+        loc = child_text(node, 'loc')
+        if not loc:
+            continue
+        if kind == 'sitemap':
+            nested.append(loc)
+        elif kind == 'url':
+            try:
+                priority = float(child_text(node, 'priority') or 0.5)
+            except ValueError:
+                priority = 0.5
+            entries.append({'url': loc, 'priority': priority, 'lastmod': child_text(node, 'lastmod') or ''})
+    return entries, nested
+
+
+def fetch_sitemap_entries(sitemap_urls, headers, stop_at=None):
+    """Reads sitemaps breadth-first, following sitemap indexes, within SITEMAP_MAX_FILES / SITEMAP_MAX_URLS.
+
+    No sitemap is requested after `stop_at` (a time.monotonic() value), and none waits past it.
+    """
+    def read(sitemap_url):
+        timeout = time_left(stop_at)
+        if timeout <= 0:
+            return [], []
+        try:
+            return parse_sitemap(fetch_page(sitemap_url, headers, timeout=timeout)[0])
+        except (requests.RequestException, OSError, EOFError):  # missing sitemap or broken gzip
+            return [], []
+
+    entries, seen, level = [], set(), list(dict.fromkeys(sitemap_urls))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        while level and len(seen) < SITEMAP_MAX_FILES and len(entries) < SITEMAP_MAX_URLS and time_left(stop_at) > 0:
+            level = [u for u in level if u not in seen][:SITEMAP_MAX_FILES - len(seen)]
+            seen.update(level)
+            next_level = []
+            for found, nested in executor.map(read, level):
+                entries.extend(found)
+                next_level.extend(nested)
+            level = next_level
+    return entries[:SITEMAP_MAX_URLS]
+
+
+def _lastmod_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def build_crawl_frontier(base_url, homepage_links, headers, budget=CRAWL_PAGE_BUDGET, stop_at=None):
+    """Ranks the subpages to crawl after the homepage. Returns at most `budget - 1` URLs.
+
+    Candidates come from the homepage links and the site's sitemaps (from robots.txt, or
+    /sitemap.xml). They are rewritten onto the homepage's scheme and host, deduplicated,
+    filtered by robots.txt, then ordered by depth, sitemap priority, lastmod (newest first)
+    and URL, so the same site always yields the same pages.
+
+    robots.txt and sitemap requests stop at `stop_at` (the crawl's time.monotonic() deadline);
+    sitemaps not read by then are skipped and the homepage links still make up the frontier.
+    """
+    robots = fetch_robots(base_url, headers, stop_at)
+    base = urlparse(base_url)
+    sitemap_urls = robots.site_maps() or [f"{base.scheme}://{base.netloc}/sitemap.xml"]
+
+    candidates = {}
+    home_key = canonical_key(base_url)
+    def add(url, linked, priority=0.5, lastmod=''):
+        site_url = to_site_url(url, base_url)
+        if not site_url or canonical_key(site_url) == home_key:
+            return
+        key = canonical_key(site_url)
+        path_depth = len([part for part in urlparse(site_url).path.split('/') if part])
+        depth = min(path_depth, 1) if linked else path_depth
+        current = candidates.get(key)
+        if current is None:
+            candidates[key] = {'url': site_url, 'depth': depth, 'priority': priority, 'lastmod': _lastmod_timestamp(lastmod) if lastmod else 0.0}
+        else:
+            current['depth'] = min(current['depth'], depth)
+            current['priority'] = max(current['priority'], priority)
+            if lastmod:
+                current['lastmod'] = max(current['lastmod'], _lastmod_timestamp(lastmod))
+
+    for link in homepage_links:
+        add(link, linked=True)
+    for entry in fetch_sitemap_entries(sitemap_urls, headers, stop_at):
+        add(entry['url'], linked=False, priority=entry['priority'], lastmod=entry['lastmod'])
+
+    allowed = [c for c in candidates.values() if robots.can_fetch(ROBOTS_USER_AGENT, c['url'])]
+    allowed.sort(key=lambda c: (c['depth'], -c['priority'], -c['lastmod'], c['url']))
+    logger.debug("frontier for %s: %d candidates, %d allowed by robots.txt", base_url, len(candidates), len(allowed))
+    return [c['url'] for c in allowed[:max(0, budget - 1)]]
+
+
+def dedupe_pages(pages):
+    """Drops duplicate pages and strips internal keys.
+
+    A page is dropped if its rel=canonical points to another crawled page, or if its
+    URL or canonical target repeats an earlier page.
+    """
+    crawled = {canonical_key(page['URL']) for page in pages}
+    seen, unique = set(), []
+    for page in pages:
+        own_key = canonical_key(page['URL'])
+        target_key = canonical_key(page.get('_canonical') or page['URL'])
+        if target_key != own_key and target_key in crawled:
+            continue
+        if own_key in seen or target_key in seen:
+            continue
+        seen.update((own_key, target_key))
+        unique.append({k: v for k, v in page.items() if not k.startswith('_')})
+    return unique
+
+
+# --- Prompt Compaction ---
+ANALYSIS_TOKEN_BUDGET = 3000   # Approximate tokens of website text sent for analysis
+SUBPAGE_TOKEN_SHARE = 0.3      # Part of the budget that subpage summaries may use
+CHARS_PER_TOKEN = 4            # Rough token estimate for English text
+MIN_LINE_WORDS = 3             # Shorter lines are menu items, buttons and labels
+_WORD_RE = re.compile(r"[^\W\d_][\w'-]+")  # Letters of any script, then letters, digits, apostrophes and hyphens
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def content_words(text):
+    """Lowercased words of `text` without stopwords and very short tokens."""
+    return [w for w in _WORD_RE.findall(text.lower()) if len(w) > 2 and w not in STOPWORDS]
+
+def clean_lines(lines, template=None):
+    """Normalizes text lines and drops repeats, menu-sized fragments and boilerplate.
+
+    Boilerplate is short lines with BOILERPLATE_TOKENS (cookie, footer) and the lines of the SiteTemplate `template`.
+    """
+    seen, kept = set(), []
+    for line in lines:
+        line = html.unescape(re.sub(r'\s+', ' ', line)).strip()
+        words = len(line.split())
+        key = line.lower()
+        if words < MIN_LINE_WORDS or key in seen:
+            continue
+        if (words < 2 * MIN_DIV_WORDS and is_boilerplate(line)) or (template is not None and line in template):
+            continue
+        seen.add(key)
+        kept.append(line)
+    return kept
+
+def rank_sentences(lines):
+    """Orders sentences by information content, best first. Returns [(position, sentence, content words)].
+
+    SumBasic: a sentence scores the average document frequency of its content words, and
+    every pick squares the probability of its words so later picks favor new information.
+    Scores only ever drop, so stale heap entries are re-scored lazily.
+    """
+    sentences, seen = [], set()
+    for line in lines:
+        for sentence in re.split(r'(?<=[.!?])\s+', line):
+            words = set(content_words(sentence))
+            if words and sentence.lower() not in seen:
+                seen.add(sentence.lower())
+                sentences.append((len(sentences), sentence, words))
+    counts = Counter(w for _, _, words in sentences for w in words)
+    total = sum(counts.values()) or 1
+    prob = {w: c / total for w, c in counts.items()}
+
+    def score(entry):
+        return sum(prob[w] for w in entry[2]) / len(entry[2])
+
+    heap = [(-score(entry), entry[0]) for entry in sentences]
+    heapq.heapify(heap)
+    ranked = []
+    while heap:
+        stale, position = heapq.heappop(heap)
+        entry = sentences[position]
+        current = score(entry)
+        if heap and current < -heap[0][0] and current < -stale:
+            heapq.heappush(heap, (-current, position))
+            continue
+        ranked.append(entry)
+        for w in entry[2]:
+            prob[w] *= prob[w]
+    return ranked
+
+def fit_token_budget(ranked, budget_tokens):
+    """Takes ranked sentences that add at least one new content word until the budget is full; returns them in document order."""
+    chosen, used, covered = [], 0, set()
+    for position, sentence, words in ranked:
+        cost = estimate_tokens(sentence)
+        if used + cost <= budget_tokens and not words <= covered:
+            chosen.append((position, sentence))
+            covered |= words
+            used += cost
+    return '\n'.join(sentence for _, sentence in sorted(chosen))
+
+def leading_lines(lines, budget_tokens):
+    """The first `lines` in document order, cut off where the budget runs out."""
+    kept, chars = [], budget_tokens * CHARS_PER_TOKEN
+    for line in lines:
+        if chars <= 0:
+            break
+        kept.append(line[:chars])
+        chars -= len(line) + 1
+    return '\n'.join(kept)
+
+def subpage_digest(pages, reference, budget_tokens):
+    """Title, meta description and summary of the subpages closest to `reference` (a Counter of homepage words), within the budget."""
+    ref_norm = sum(c * c for c in reference.values()) ** 0.5 or 1
+    scored = []
+    for page in pages:
+        title = page.get('Page Title') or "No Title"
+        details = ' '.join(part for part in (page.get('Meta Description'), page.get('Content Summary')) if part and part != "No Meta Description")
+        text = f"{title}: {details}" if details and title != "No Title" else details or title
+        words = Counter(content_words(text))
+        if not words:
+            continue
+        similarity = sum(c * reference[w] for w, c in words.items()) / (ref_norm * sum(c * c for c in words.values()) ** 0.5)
+        scored.append((similarity, text))
+    lines, used = [], 0
+    for _, text in sorted(scored, key=lambda item: -item[0]):
+        cost = estimate_tokens(text)
+        if used + cost <= budget_tokens:
+            lines.append(f"- {text}")
+            used += cost
+    return '\n'.join(lines)
+
+class AnalysisText:
+    """Compacts a homepage once, then merges in subpage summaries for the analysis prompt."""
+
+    def __init__(self, page, budget_tokens=ANALYSIS_TOKEN_BUDGET, template=None):
+        self.budget_tokens = budget_tokens
+        title = page.title.strip() if page.title else ''
+        self.lines = [line for line in clean_lines(page.raw_lines(), template) if line != title]
+        self.header = '\n'.join(part for part in (title, page.meta.get(META_DESCRIPTION_SELECTORS[0])) if part)
+        self.ranked = rank_sentences(self.lines)
+        self.reference = Counter(w for line in self.lines for w in content_words(line))
+
+    def build(self, subpages=()):
+        """Returns the prompt text for the homepage plus `subpages` (page records)."""
+        budget = self.budget_tokens - estimate_tokens(self.header)
+        digest = subpage_digest(subpages, self.reference, int(budget * SUBPAGE_TOKEN_SHARE)) if subpages else ''
+        body_budget = budget - (estimate_tokens(digest) if digest else 0)
+        # When no sentence could be ranked or fits the budget, send the page's lines in document order instead
+        body = fit_token_budget(self.ranked, body_budget) or leading_lines(self.lines, body_budget)
+        text = '\n\n'.join(part for part in (self.header, body) if part)
+        if digest:
+            text += "\n\nOther pages on the site:\n" + digest
+        return text
+
+
+def iter_scrape_website(url, page_budget=CRAWL_PAGE_BUDGET):
+    """Streaming version of scrape_website.
+
+    Yields (text, pages so far, subpages finished, subpages planned, error) once the
+    homepage is in and again as each subpage finishes. Pages are always in frontier order.
+    """
+    try:
+        # UPDATED: Using a Googlebot User-Agent to bypass simple firewalls
+        headers = {'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'}
+        content, homepage_details = fetch_page(url, headers, timeout=12)
+        # One parse of the homepage serves link discovery, the analysis text and its page record
+        page = parse_html(content)
+        analysis_text = AnalysisText(page)
+        links = extract_internal_links(url, page.hrefs)
+        if homepage_details is None:
+            homepage_details = crawl_record(url, page)
+            get_page_cache().store_record(url, homepage_details)
+
+        homepage_details = dict(homepage_details, URL=url)
+        # One deadline covers robots.txt, the sitemaps and the subpages
+        stop_at = time.monotonic() + CRAWL_DEADLINE
+        subpages = build_crawl_frontier(url, links, headers, page_budget, stop_at=stop_at)
+        pages = dedupe_pages([homepage_details])
+        yield analysis_text.build(), pages, 0, len(subpages), None
+
+        # Fetch the subpages concurrently; pages are re-sorted into the frontier's ranking
+        found, finished = {}, 0
+        for index, details in iter_crawl_pages(subpages, headers, deadline=max(0, stop_at - time.monotonic())):
+            finished += 1
+            if details:
+                found[index] = details
+                # Deduplicate by URL and rel=canonical
+                pages = dedupe_pages([homepage_details] + [found[i] for i in sorted(found)])
+            yield analysis_text.build([p for p in pages if p['URL'] != url]), pages, finished, len(subpages), None
+
+        # Blocks on most of the unique pages are site template: drop them from the analysis text and
+        # re-extract the pages whose summary came from one
+        records = [homepage_details] + [found[i] for i in sorted(found)]
+        unique = {p['URL'] for p in pages}
+        template = SiteTemplate.from_pages(record.get('_blocks', ()) for record in records if record['URL'] in unique)
+        if template:
+            records, changed = apply_site_template(records, template, {url: page})
+            analysis_text = AnalysisText(page, template=template)
+            pages = dedupe_pages(records)
+            logger.debug("site template of %s: %d blocks, %d pages re-extracted", url, len(template), changed)
+            yield analysis_text.build([p for p in pages if p['URL'] != url]), pages, finished, len(subpages), None
+        logger.debug("http pool after crawl of %s: %s", url, http_pool_stats())
+    except requests.RequestException as e:
+        yield None, [], 0, 0, f"Failed to fetch website content: {e}"
+
+
+def scrape_website(url, page_budget=CRAWL_PAGE_BUDGET):
+    """Scrapes the main page and extracts internal links and their details."""
+    text, pages, error = None, [], None
+    for text, pages, _, _, error in iter_scrape_website(url, page_budget):
+        pass
+    return text, pages, error
+
+# --- END NEW SCRAPING FUNCTIONS ---
+
+
+# --- Website Analysis ---
+ANALYSIS_INDUSTRY_DATABASE = """
+- Adult Products: Products related to adult entertainment and intimacy (e.g., Adult toys, lingerie, sexual wellness products)
+- Agriculture & Environment: Farming, natural resource management, sustainability (e.g., Crop production, livestock, forestry, conservation)
+- Performing Arts & Cultural Experiences: Creative expression, entertainment (e.g., Theater, dance, concerts, museums)
+- Visual Arts & Entertainment: Creative expression, entertainment (e.g., Visual arts, film, television, gaming)
+- Autos & Vehicles: Design, manufacturing, and sales of vehicles (e.g., Cars, trucks, motorcycles, RVs)
+- Beauty & Fitness: Personal care, appearance, physical well-being (e.g., Cosmetics, skincare, gyms, personal training)
+- Business & Industrial: Commercial activities, manufacturing, professional services (e.g., Manufacturing, construction, logistics, B2B services)
+- Computers & Electronics: Technology and electronic devices (e.g., Hardware, software, IT services, consumer electronics)
+- Fashion: Clothing, footwear, accessories, and style (e.g., Apparel design, manufacturing, retail)
+- Finance: Money management, investments, banking (e.g., Banking, insurance, financial planning, accounting)
+- Firearms & Weapons: Firearms, ammunition, and related equipment (e.g., Guns, rifles, hunting gear)
+- Food & Beverage: Production and sale of food and drinks (e.g., Restaurants, cafes, food manufacturing, grocery stores)
+- Gifts & Shopping: Retail, e-commerce, and consumer goods (e.g., Gift shops, department stores, online retailers)
+- Health & Wellness: Healthcare, personal well-being (e.g., Hospitals, clinics, pharmacies, mental health services, supplements)
+- Hobbies & Leisure: Recreational activities and pastimes (e.g., Arts and crafts, gaming, sports, travel)
+- Home & Garden: Home improvement, décor, gardening (e.g., Furniture, appliances, home décor, landscaping)
+- Hospitality & Travel: Accommodation, tourism, and travel services (e.g., Hotels, resorts, airlines, travel agencies)
+- Internet & Telecommunications: Digital communication and online services (e.g., ISPs, social media platforms)
+- Jobs & Education: Employment, training, and education (e.g., Recruitment, schools, universities, online learning)
+- Kids & Family: Products and services for children and families (e.g., Toys, childcare, parenting resources)
+- Law & Government: Legal services, public administration (e.g., Law firms, government agencies, courts)
+- Lifestyle: Personal interests, values, and way of living (e.g., Fashion, beauty, travel, food)
+- Logistics & Transportation: Movement of goods and people (e.g., Shipping, trucking, warehousing, airlines)
+- Marketing: Promoting products, services, or ideas (e.g., Market research, advertising, digital marketing)
+- Media & Communications: Information dissemination, journalism (e.g., Journalism, publishing, broadcasting)
+- Medical Cannabis: Cannabis for medical use (e.g., Dispensaries, cultivation, medical marijuana products)
+- News: Current events and information (e.g., Newspapers, online news portals)
+- Not For Profit: Charitable organizations and social causes (e.g., Charities, foundations, NGOs)
+- People & Society: Social issues, community, and culture (e.g., Social services, advocacy groups)
+- Pets & Animals: Pet care and animal welfare (e.g., Pet food, veterinary services, animal shelters)
+- Real Estate: Property, land, and buildings (e.g., Residential, commercial, real estate brokerage)
+- Recreational Cannabis: Cannabis for recreational use (where legal) (e.g., Dispensaries, cannabis products)
+- Science: Research, discovery, and innovation (e.g., Scientific research institutions, laboratories)
+- Specialty Products: Unique, niche, or regulated goods (e.g., Antiques, collectibles, luxury goods)
+- Vices & Adult Entertainment: Activities and products considered taboo (e.g., Gambling, pornography, tobacco, alcohol)
+- Other: Any industry not explicitly categorized above.
+"""
+
+ANALYSIS_SYSTEM_PROMPT = f"""You are an expert marketing analyst. Analyze the provided website text and extract the following information. Be concise and summarize the findings.
+
+Industry Database:
+{ANALYSIS_INDUSTRY_DATABASE}
+
+Your Tasks:
+1.  Analyze the website text to determine its primary industry (e.g., "AI-based logistics").
+2.  Compare this identified industry against the 'Industry Database' provided above.
+3.  Format the 'identified_industry' output:
+    - If a clear match is found, return the category name (e.g., "Health & Wellness").
+    - If no clear match is found, return "Not found (Identified as: [Industry you found])".
+4.  Extract all other required information.
+5.  For 'business_services_products', identify each distinct service or product. For each one, find its most relevant industry, target audience, and the specific pain point it solves.
+
+- **target_audience_pain_points:** The *overall* target audience and their main problems.
+- **business_services_products:** A list of objects, where each object contains:
+    - 'service_or_product' (string)
+    - 'associated_industry' (string)
+    - 'associated_audience' (string)
+    - 'associated_pain_point' (string)
+- **target_location:** The primary geographical market (e.g., USA, California, Global).
+- **identified_industry:** [Your formatted output from step 3]
+- **branding_tone_voice:** The style and personality of the business's communication.
+- **branding_guidelines_summary:** Summarize any core messaging or branding principles evident from the text."""
+
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "target_audience_pain_points": {"type": "STRING"},
+        "business_services_products": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "service_or_product": {"type": "STRING"},
+                    "associated_industry": {"type": "STRING"},
+                    "associated_audience": {"type": "STRING"},
+                    "associated_pain_point": {"type": "STRING"}
+                },
+                "required": ["service_or_product", "associated_industry", "associated_audience", "associated_pain_point"]
+            }
+        },
+        "target_location": {"type": "STRING"},
+        "identified_industry": {"type": "STRING", "description": "The industry, formatted as specified in the prompt."},
+        "branding_tone_voice": {"type": "STRING"},
+        "branding_guidelines_summary": {"type": "STRING"}
+    },
+    "required": ["target_audience_pain_points", "business_services_products", "target_location", "identified_industry", "branding_tone_voice", "branding_guidelines_summary"]
+}
+
+@cache
+def analysis_prompt_prefix():
+    """Returns the analysis system prompt and schema, serialized once per process."""
+    return PromptPrefix(ANALYSIS_SYSTEM_PROMPT, ANALYSIS_SCHEMA)
+
+def analyze_scraped_text(api_key, text, use_cache=True, on_wait=None):
+    """Uses AI to analyze scraped text and extract business details."""
+    return generate_json(api_key, analysis_prompt_prefix(), text, use_cache, on_wait=on_wait)
+
+
+# --- API Resilience ---
+API_DEADLINE = 240            # Seconds one API call may take in total, including retries and waits
+API_READ_TIMEOUT = 180        # Longest wait for a response on a single attempt
+API_BACKOFF_BASE = 1.0        # Seconds; the backoff window doubles with every attempt
+API_BACKOFF_MAX = 30          # Cap on a single backoff wait (Retry-After is honored while it fits the deadline)
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}  # Statuses worth retrying; anything else is returned as is
+BREAKER_THRESHOLD = 5         # Consecutive failed calls before the circuit breaker opens
+BREAKER_COOLDOWN = 60         # Seconds the breaker stays open before letting a trial call through
+
+class CircuitBreaker:
+    """Stops calling the API for a while after repeated upstream failures (5xx or network errors)."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True when a call may go out. After the cooldown a single trial call is let through (half-open)."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()  # the trial call gets a full cooldown before the next one
+                return True
+            return False
+
+    def retry_in(self):
+        """Seconds until the breaker lets a call through again."""
+        with self._lock:
+            return 0 if self.opened_at is None else max(0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("circuit breaker opened after %d failed API calls", self.failures)
+                self.opened_at = time.monotonic()
+
+
+@cache
+def get_circuit_breaker():
+    """Returns the process-wide API circuit breaker."""
+    return CircuitBreaker()
+
+
+def retry_delay(attempt, response=None):
+    """Seconds to wait before the next attempt: the server's Retry-After when given, else exponential backoff with full jitter."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass  # unparseable header, fall back to backoff
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+
+
+def fetch_with_retry(url, options, retries=3, stream=False, deadline=API_DEADLINE, before_retry=None):
+    """Retry logic for the API call within an overall deadline. Returns (response, error_message).
+
+    Network errors and RETRY_STATUSES are retried with backoff (honoring Retry-After);
+    other responses, including 4xx errors, are returned to the caller.
+    With stream=True the body is left unread; the read timeout then applies between chunks.
+    `before_retry` is called before each retry, e.g. to wait for rate limit capacity.
+    """
+    breaker = get_circuit_breaker()
+    if not breaker.allow():
+        return None, f"The AI service is failing repeatedly, so requests are paused for {breaker.retry_in():.0f}s. Please try again shortly."
+
+    started = time.monotonic()
+    error_msg, upstream_failure = "The request could not be completed before the deadline.", False
+    attempts = 0  # Requests actually sent; the deadline can end the loop before `retries` is used up
+    for attempt in range(retries):
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        attempts += 1
+        attempt_started = time.monotonic()
+        response = None
+        try:
+            response = get_http_session().post(url, headers=options['headers'], data=options['body'], timeout=http_timeout(min(API_READ_TIMEOUT, remaining)), stream=stream)
+        except requests.exceptions.RequestException as e:
+            logger.info("api attempt %d/%d failed after %.2fs: %s", attempt + 1, retries, time.monotonic() - attempt_started, e)
+            error_msg, upstream_failure = f"A network error occurred: {e}. Please check the connection and try again.", True
+        else:
+            logger.info("api attempt %d/%d: status %d in %.2fs", attempt + 1, retries, response.status_code, time.monotonic() - attempt_started)
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response, None
+            if response.status_code == 429:
+                error_msg, upstream_failure = "The API rate limit was reached (Status 429). Please wait a moment and try again.", False
+            else:
+                error_msg, upstream_failure = f"The server responded with an error (Status {response.status_code}) after multiple retries.", True
+            response.close()
+        if attempt == retries - 1:
+            break
+        delay = retry_delay(attempt, response)
+        if time.monotonic() - started + delay >= deadline:
+            break
+        time.sleep(delay)
+        if before_retry:
+            before_retry()
+
+    logger.info("api call gave up after %d attempt(s) in %.2fs", attempts, time.monotonic() - started)
+    if upstream_failure:
+        breaker.record_failure()
+    return None, error_msg
+
+# --- API Rate Limiting ---
+# Per-key limits of your Gemini tier, 0 for none. Free tier keys on Flash allow 10 requests and 250,000 input
+# tokens a minute (GEMINI_RPM_LIMIT=10 GEMINI_TPM_LIMIT=250000); paid tiers are far higher and need no limit here.
+API_RPM_LIMIT = int(os.environ.get("GEMINI_RPM_LIMIT", 0))         # Requests per minute allowed per API key
+API_TPM_LIMIT = int(os.environ.get("GEMINI_TPM_LIMIT", 0))         # Input tokens per minute allowed per API key
+
+class KeyRateLimiter:
+    """Process-wide token buckets per API key, one for requests and one for estimated input tokens.
+
+    Callers block until a key has capacity instead of failing; keys of a pool are tried round-robin.
+    A limit of 0 is not enforced.
+    """
+
+    def __init__(self, rpm=API_RPM_LIMIT, tpm=API_TPM_LIMIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.waiting = 0
+        self._buckets = {}     # key -> [requests available, tokens available, last refill]
+        self._next = {}        # key pool -> index of the key to try first
+        self._cond = threading.Condition()
+
+    def _refill(self, bucket, now):
+        elapsed = now - bucket[2]
+        bucket[0] = min(self.rpm, bucket[0] + elapsed * self.rpm / 60)
+        bucket[1] = min(self.tpm, bucket[1] + elapsed * self.tpm / 60)
+        bucket[2] = now
+
+    def _wait(self, bucket, tokens):
+        """Seconds until the bucket can take a request of `tokens` (0 or less when it can now)."""
+        waits = [0.0]
+        if self.rpm:
+            waits.append((1 - bucket[0]) * 60 / self.rpm)
+        if self.tpm:
+            waits.append((tokens - bucket[1]) * 60 / self.tpm)
+        return max(waits)
+
+    def acquire(self, keys, tokens, on_wait=None):
+        """Waits until one of `keys` can take a request of `tokens`, charges it and returns that key.
+
+        on_wait(seconds) is called before each wait for capacity.
+        """
+        if self.tpm:
+            tokens = min(tokens, self.tpm)  # an oversized request still goes through on a full bucket
+        pool = tuple(keys)
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    start = self._next.get(pool, 0)
+                    waits = []
+                    for offset in range(len(pool)):
+                        key = pool[(start + offset) % len(pool)]
+                        bucket = self._buckets.setdefault(key, [self.rpm, self.tpm, now])
+                        self._refill(bucket, now)
+                        wait = self._wait(bucket, tokens)
+                        if wait <= 0:
+                            bucket[0] -= 1
+                            bucket[1] -= tokens
+                            self._next[pool] = (start + offset + 1) % len(pool)
+                            return key
+                        waits.append(wait)
+                    logger.debug("rate limit: waiting %.1fs for capacity on %d key(s)", min(waits), len(pool))
+                    if on_wait:
+                        on_wait(min(waits))
+                    self._cond.wait(min(waits))
+            finally:
+                self.waiting -= 1
+
+
+@cache
+def get_rate_limiter():
+    """Returns the process-wide per-key rate limiter."""
+    return KeyRateLimiter()
+
+
+# --- Response Cache ---
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60          # Seconds a model response is reused for identical inputs
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024     # Total compressed responses kept before LRU eviction
+RESPONSE_CACHE_STATS_INTERVAL = 5               # Seconds between recounts of the stored entries for display
+CURRENT_DATE_LINE_RE = re.compile(r'\ACurrent Date: [^\n]*\n+')  # Leading date line of topic queries (build_topic_query)
+
+def response_cache_key(prefix, user_text):
+    """Content hash of everything that determines a response: model, system prompt, query, schema and generation config.
+
+    A topic query's leading "Current Date:" line is left out, so a response is reused for the
+    whole RESPONSE_CACHE_TTL instead of only on the day it was generated.
+    """
+    user_text = CURRENT_DATE_LINE_RE.sub('', user_text, count=1)
+    return hashlib.sha256(f"{prefix.digest}\0{user_text}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed store of parsed model responses with a TTL, LRU eviction and hit/miss counters."""
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._counts = (0, 0)
+        self._counted_at = None
+        self._lock = threading.Lock()
+        self._db = open_cache_db(path, """CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, created_at REAL, accessed_at REAL, body BLOB, size INTEGER)""")
+
+    def get(self, key):
+        """Returns the cached response data for `key`, or None when missing or expired."""
+        with self._lock:
+            row = self._db.execute("SELECT created_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[0] >= self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def store(self, key, data):
+        """Stores parsed response data under `key`."""
+        blob = zlib.compress(json.dumps(data).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, now, now, blob, len(blob)))
+            evict_lru(self._db, "responses", self.max_bytes)
+            self._db.commit()
+
+    def stats(self):
+        """Returns {'hits', 'misses', 'entries', 'bytes'} for display.
+
+        Entries and bytes are recounted at most every RESPONSE_CACHE_STATS_INTERVAL seconds so
+        that every rerun of the page does not wait on the database.
+        """
+        now = time.monotonic()
+        if self._counted_at is None or now - self._counted_at >= RESPONSE_CACHE_STATS_INTERVAL:
+            with self._lock:
+                self._counts = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self._counted_at = now
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self._counts[0], 'bytes': self._counts[1]}
+
+
+@cache
+def get_response_cache():
+    """Returns the process-wide model response cache."""
+    return ResponseCache(os.path.join(PAGE_CACHE_DIR, "responses.sqlite3"))
+
+
+def generate_json(api_key, prefix, user_text, use_cache=True, retries=3, on_wait=None):
+    """Calls generateContent for a JSON response through the response cache. Returns (data, error_message).
+
+    With use_cache=False the cached entry is ignored but the fresh response still replaces it.
+    Only responses that parse as JSON are cached, so truncated output is retried next time.
+    `retries` bounds the attempts fetch_with_retry makes; `on_wait` is passed to send_prompt.
+    """
+    cache = get_response_cache()
+    key = response_cache_key(prefix, user_text)
+    if use_cache:
+        data = cache.get(key)
+        if data is not None:
+            return data, None
+
+    response, error = send_prompt(api_key, prefix, user_text, retries=retries, on_wait=on_wait)
+    if error:
+        return None, error
+    if response.status_code != 200:
+        try:
+            return None, f"API request failed with status code: {response.status_code}: {json.dumps(response.json())}"
+        except json.JSONDecodeError:
+            return None, f"API request failed with status code: {response.status_code}."
+    try:
+        result = response.json()
+        get_prompt_cache_registry().record_usage(result.get('usageMetadata'))
+        text_content = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
+        if not text_content:
+            return None, "No content received from API."
+        data = json.loads(text_content)
+    except (json.JSONDecodeError, IndexError, KeyError) as e:
+        return None, f"Failed to parse API response: {e}"
+    cache.store(key, data)
+    return data, None
+
+
+# --- Prompt Prefix Caching ---
+PROMPT_CACHE_MODE = os.environ.get("TOPIC_GENERATOR_PROMPT_CACHE", "provider")  # "provider" (Gemini cachedContents) or "off"
+PROMPT_CACHE_TTL = 60 * 60      # Seconds a provider-side prompt cache is kept alive
+PROMPT_CACHE_MARGIN = 60        # Stop using a provider cache this many seconds before it expires
+PROMPT_CACHE_RETRY = 15 * 60    # Seconds before retrying a prefix the provider refused to cache (e.g. too short)
+
+class PromptPrefix:
+    """The static part of a JSON request (system prompt and response schema), serialized once."""
+
+    def __init__(self, system_prompt, schema, model=GEMINI_MODEL):
+        self.model = model
+        self.system_instruction = {"parts": [{"text": system_prompt}]}
+        self.system_json = json.dumps(self.system_instruction)
+        self.config_json = json.dumps({"responseMimeType": "application/json", "responseSchema": schema})
+        self.digest = hashlib.sha256(f"{model}\0{self.system_json}\0{self.config_json}".encode('utf-8')).hexdigest()
+        self.tokens = estimate_tokens(self.system_json) + estimate_tokens(self.config_json)
+
+    def body(self, user_text, cached_content=None):
+        """Serializes a request for `user_text`. With cached_content the system prompt is referenced instead of sent."""
+        contents = json.dumps([{"parts": [{"text": user_text}]}])
+        if cached_content:
+            return f'{{"cachedContent": {json.dumps(cached_content)}, "contents": {contents}, "generationConfig": {self.config_json}}}'
+        return f'{{"contents": {contents}, "systemInstruction": {self.system_json}, "generationConfig": {self.config_json}}}'
+
+
+class PromptCacheRegistry:
+    """Keeps track of provider-side cachedContents holding prompt prefixes, per API key."""
+
+    def __init__(self, ttl=PROMPT_CACHE_TTL):
+        self.ttl = ttl
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._entries = {}   # (api key hash, prefix digest) -> (cachedContent name or None, valid until)
+        self._creating = {}  # (api key hash, prefix digest) -> Future of the cachedContent creation in progress
+        self._lock = threading.Lock()
+
+    def _slot(self, api_key, prefix):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest(), prefix.digest
+
+    def lookup(self, api_key, prefix):
+        """Returns the cachedContent name for `prefix`, creating it if needed, or None to send the prefix inline.
+
+        Only one caller per slot creates the cachedContent, outside the lock; concurrent callers for the
+        same slot wait for its result, and callers for other slots are not held up.
+        """
+        if PROMPT_CACHE_MODE != "provider":
+            return None
+        slot = self._slot(api_key, prefix)
+        with self._lock:
+            entry = self._entries.get(slot)
+            if entry and time.time() < entry[1]:
+                return entry[0]
+            future = self._creating.get(slot)
+            owner = future is None
+            if owner:
+                future = self._creating[slot] = Future()
+        if not owner:
+            return future.result()
+
+        name = None
+        try:
+            name = self._create(api_key, prefix)
+        finally:
+            valid_for = self.ttl - PROMPT_CACHE_MARGIN if name else PROMPT_CACHE_RETRY
+            with self._lock:
+                self._entries[slot] = (name, time.time() + valid_for)
+                self._creating.pop(slot, None)
+            future.set_result(name)
+        return name
+
+    def invalidate(self, api_key, prefix):
+        """Forgets a cachedContent the provider no longer accepts (expired or deleted)."""
+        with self._lock:
+            self._entries.pop(self._slot(api_key, prefix), None)
+
+    def record_usage(self, usage):
+        """Adds a response's usageMetadata to the input token counters."""
+        if usage:
+            with self._lock:
+                self.prompt_tokens += usage.get('promptTokenCount', 0)
+                self.cached_tokens += usage.get('cachedContentTokenCount', 0)
+
+    def _create(self, api_key, prefix):
+        body = {"model": f"models/{prefix.model}", "systemInstruction": prefix.system_instruction, "ttl": f"{self.ttl}s"}
+        try:
+            response = get_http_session().post(f"{GEMINI_API_BASE}/cachedContents?key={api_key}", json=body, timeout=http_timeout(30))
+        except requests.exceptions.RequestException as e:
+            logger.info("prompt cache creation failed: %s", e)
+            return None
+        if response.status_code != 200:
+            logger.info("prompt cache not created (status %s), sending the prefix inline", response.status_code)
+            return None
+        try:
+            return response.json().get('name')
+        except (ValueError, AttributeError) as e:
+            logger.info("prompt cache creation returned an unreadable response: %s", e)
+            return None
+
+
+@cache
+def get_prompt_cache_registry():
+    """Returns the process-wide provider prompt cache registry."""
+    return PromptCacheRegistry()
+
+
+def send_prompt(api_key, prefix, user_text, stream=False, retries=3, on_wait=None):
+    """Posts a request, referencing the provider-cached prefix when available. Returns (response, error_message).
+
+    The request waits for rate limit capacity and goes out on the next key of the pool that has it;
+    on_wait(seconds) is called before every such wait. `retries` is passed to fetch_with_retry.
+
+    If the provider rejects the cached prefix (expired or deleted) the request is resent with the prefix inline.
+    """
+    keys = api_key_pool(api_key)
+    if not keys:
+        return None, "No API key provided."
+    limiter = get_rate_limiter()
+    tokens = prefix.tokens + estimate_tokens(user_text)
+    api_key = limiter.acquire(keys, tokens, on_wait)
+    wait_for_capacity = lambda: limiter.acquire([api_key], tokens, on_wait)
+
+    registry = get_prompt_cache_registry()
+    url = gemini_url(api_key, "streamGenerateContent") + "&alt=sse" if stream else gemini_url(api_key)
+    headers = {'Content-Type': 'application/json'}
+    cached_content = registry.lookup(api_key, prefix)
+    if cached_content:
+        response, error = fetch_with_retry(url, {'headers': headers, 'body': prefix.body(user_text, cached_content)}, retries, stream=stream, before_retry=wait_for_capacity)
+        if error or response.status_code not in (400, 403, 404):
+            return response, error
+        response.close()
+        registry.invalidate(api_key, prefix)
+        logger.info("cached prompt prefix rejected (status %s), resending inline", response.status_code)
+        wait_for_capacity()
+    return fetch_with_retry(url, {'headers': headers, 'body': prefix.body(user_text)}, retries, stream=stream, before_retry=wait_for_capacity)
+
+# --- Export ---
+EXPORT_CHUNK_ROWS = 5000    # Rows serialized at a time, so no export holds a second full copy of a table
+PRODUCT_COLUMNS = ["Service/Product", "Associated Industry", "Associated Audience", "Associated Pain Point"]
+
+def export_tables(topics_df, available_pages_df, analysis_data, analyzed_url):
+    """The tables shown in the app, as (sheet name, CSV title, DataFrame, header) in export order."""
+    tables = []
+    # Table 1: Business Analysis Summary
+    if analysis_data:
+        summary_df = pd.DataFrame([
+            ["Website URL:", analyzed_url],
+            ["Target Location:", analysis_data.get('target_location', 'Not found')],
+            ["Identified Industry:", analysis_data.get('identified_industry', 'Not found')],
+            ["Target Audience and Pain Points:", analysis_data.get('target_audience_pain_points', 'Not found')]
+        ], columns=["Metric", "Details"])
+        tables.append(("Summary", "Table 1: Business Analysis Summary", summary_df, False))
+        products_df = pd.DataFrame(analysis_data.get('business_services_products', []))
+        # Rename columns for clarity in the export
+        if not products_df.empty:
+            products_df.columns = PRODUCT_COLUMNS
+        tables.append(("Products", "Business Services and/or Products", products_df, True))
+
+    # Table 2: Available Pages for Linking
+    if available_pages_df is not None and len(available_pages_df):
+        pages_df = available_pages_df if isinstance(available_pages_df, pd.DataFrame) else pd.DataFrame(available_pages_df)
+        tables.append(("Pages", "Table 2: Available Pages for Linking", pages_df, True))
+
+    # Table 3: Topics
+    tables.append(("Topics", "Table 3: Topics", topics_df, True))
+    return tables
+
+def iter_chunks(df, rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+def write_csv(f, tables):
+    """All tables in one CSV, each under its title line and followed by a blank line (the app's original layout)."""
+    out = io.TextIOWrapper(f, encoding='utf-8', newline='', write_through=True)
+    for sheet, title, df, header in tables:
+        out.write(f"{title}\n")
+        if not len(df):
+            df.to_csv(out, index=False, header=header)
+        for i, chunk in enumerate(iter_chunks(df)):
+            chunk.to_csv(out, index=False, header=header and i == 0)
+        if sheet != "Topics":
+            out.write("\n")
+    out.detach()
+
+def records(df):
+    """DataFrame rows as dicts, with missing values (NaN, NA) as None."""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def write_jsonl(f, tables):
+    """One JSON object per row, with a "table" field naming the table it came from."""
+    for sheet, title, df, header in tables:
+        for chunk in iter_chunks(df):
+            f.write("".join(json.dumps({"table": sheet, **record}, ensure_ascii=False, default=str) + "\n" for record in records(chunk)).encode('utf-8'))
+
+def write_xlsx(f, tables):
+    """One worksheet per table. Rows are flushed as they are written (xlsxwriter's constant_memory mode)."""
+    workbook = xlsxwriter.Workbook(f, {'constant_memory': True, 'strings_to_urls': False, 'strings_to_formulas': False})
+    bold = workbook.add_format({'bold': True})
+    for sheet, title, df, header in tables:
+        worksheet = workbook.add_worksheet(sheet)
+        row = 0
+        if header:
+            worksheet.write_row(row, 0, [str(column) for column in df.columns], bold)
+            row += 1
+        for chunk in iter_chunks(df):
+            for values in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                worksheet.write_row(row, 0, ["" if v is None else v if isinstance(v, (int, float, str)) else str(v) for v in values])
+                row += 1
+    workbook.close()
+
+def write_parquet(f, tables):
+    """The topics table as Parquet, written one row group per chunk. Parquet holds a single table, so the
+    other tables are stored as JSON under the file's "topic_generator" key-value metadata."""
+    topics_df = tables[-1][2]
+    # Text and categorical columns are written as strings (Parquet dictionary-encodes them itself); flags and numbers keep their types
+    topics_df = topics_df.astype({column: "string" for column, dtype in topics_df.dtypes.items()
+                                  if dtype == object or isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype))})
+    extra = {sheet: records(df) for sheet, title, df, header in tables[:-1]}
+    schema = pa.Schema.from_pandas(topics_df, preserve_index=False).with_metadata({"topic_generator": json.dumps(extra, default=str)})
+    with pq.ParquetWriter(f, schema) as writer:
+        for chunk in iter_chunks(topics_df):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        if not len(topics_df):
+            writer.write_table(pa.Table.from_pandas(topics_df, schema=schema, preserve_index=False))
+
+# name: (file extension, MIME type, writer, available)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv", write_csv, True),
+    "JSONL": ("jsonl", "application/jsonl", write_jsonl, True),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", write_xlsx, xlsxwriter is not None),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", write_parquet, pq is not None),
+}
+
+def available_export_formats():
+    return [name for name, (ext, mime, writer, available) in EXPORT_FORMATS.items() if available]
+
+def write_export(target, fmt, tables):
+    """Streams `tables` in format `fmt` to a path or a binary file object."""
+    writer = EXPORT_FORMATS[fmt][2]
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'wb') as f:
+            writer(f, tables)
+    else:
+        writer(target, tables)
+
+def export_bytes(fmt, tables):
+    output = io.BytesIO()
+    write_export(output, fmt, tables)
+    return output.getvalue()
+
+def convert_df_to_csv(topics_df, available_pages_df, analysis_data, analyzed_url):
+    """Prepares data for CSV export with all three tables."""
+    return export_bytes("CSV", export_tables(topics_df, available_pages_df, analysis_data, analyzed_url))
+
+
+TOPIC_COLUMNS = ["Category", "Group Name", "Target Audience", "Publication Niche", "Funnel Stage", "Topic", "Suggested Headline", "Rationale", "Anchor text", "Destination Page", "Focus Keyword"]
+
+def topic_row(category, group_name, funnel, audience, pub, topic):
+    """Builds one Table 3 row from a topic and the funnel/audience/publication objects it sits in."""
+    return {
+        "Category": category,
+        "Group Name": group_name,
+        "Target Audience": audience.get('audienceName'),
+        "Publication Niche": pub.get('publicationNiche'),
+        "Funnel Stage": funnel.get('funnelStage'),
+        "Topic": topic.get('topic'),
+        "Suggested Headline": topic.get('suggestedHeadline'),
+        "Rationale": topic.get('rationale'),
+        "Anchor text": topic.get('anchorText'),
+        "Destination Page": topic.get('destinationPage'),
+        "Focus Keyword": topic.get('focusKeyword')
+    }
+
+TOPIC_FIELDS = {"Topic": 'topic', "Suggested Headline": 'suggestedHeadline', "Rationale": 'rationale', "Anchor text": 'anchorText', "Destination Page": 'destinationPage', "Focus Keyword": 'focusKeyword'}
+# Columns whose values repeat across many topics; stored as categoricals so each distinct string is kept once
+TOPIC_CATEGORY_COLUMNS = ["Category", "Group Name", "Target Audience", "Publication Niche", "Funnel Stage", "Destination Page"]
+
+class CategoryColumn:
+    """Categorical column built a value (or a run of equal values) at a time."""
+
+    def __init__(self):
+        self.codes = []
+        self.categories = {}
+
+    def extend(self, value, count=1):
+        if value is None:
+            code = -1
+        else:
+            code = self.categories.setdefault(value if isinstance(value, str) else str(value), len(self.categories))
+        self.codes.extend([code] * count)
+
+    def to_categorical(self):
+        return pd.Categorical.from_codes(np.array(self.codes, dtype=np.int32), categories=list(self.categories))
+
+def prepare_dataframe(data):
+    """Flattens the nested topic data into a DataFrame, one column at a time.
+
+    Category, group, audience, niche and funnel stage are shared by every topic of a publication, so
+    they are appended once per publication as a run of category codes rather than once per topic.
+    """
+    categorical = {column: CategoryColumn() for column in TOPIC_CATEGORY_COLUMNS}
+    text = {column: [] for column in TOPIC_FIELDS if column not in categorical}
+
+    # 1. Topics for Products/Services, then 2. topics for Available Pages
+    for category, section, name_key in (("Product/Service", 'productBasedTopics', 'productName'), ("Available Page", 'pageBasedTopics', 'pageTitle')):
+        for item in data.get(section, []):
+            group_name = item.get(name_key)
+            for funnel in item.get('funnels', []):
+                for audience in funnel.get('audiences', []):
+                    for pub in audience.get('publications', []):
+                        topics = pub.get('topics', [])
+                        if not topics:
+                            continue
+                        for column, value in (("Category", category), ("Group Name", group_name), ("Target Audience", audience.get('audienceName')),
+                                              ("Publication Niche", pub.get('publicationNiche')), ("Funnel Stage", funnel.get('funnelStage'))):
+                            categorical[column].extend(value, len(topics))
+                        for topic in topics:
+                            categorical["Destination Page"].extend(topic.get('destinationPage'))
+                            for column, values in text.items():
+                                values.append(topic.get(TOPIC_FIELDS[column]))
+
+    columns = {column: categorical[column].to_categorical() if column in categorical else pd.Series(text[column])
+               for column in TOPIC_COLUMNS}
+    return pd.DataFrame(columns, columns=TOPIC_COLUMNS)
+
+def isin_mask(series, values):
+    """Boolean array of series.isin(values); categoricals are matched on their integer codes through a lookup table."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.isin(values).to_numpy()
+    selected = np.zeros(len(series.cat.categories) + 1, dtype=bool)  # the extra last slot is code -1 (missing)
+    positions = series.cat.categories.get_indexer(list(values))
+    selected[positions[positions >= 0]] = True
+    selected[-1] = any(pd.isna(v) for v in values)  # like isin, a selected NaN/None matches missing values
+    return selected[series.cat.codes.to_numpy()]
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by `obj`, following containers and counting DataFrames with memory_usage(deep=True)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def memory_report(items):
+    """DataFrame of the approximate size of each named object, largest first, with a Total row."""
+    seen = set()
+    sizes = sorted(((name, deep_sizeof(value, seen)) for name, value in items), key=lambda item: -item[1])
+    report = pd.DataFrame(sizes + [("Total", sum(size for _, size in sizes))], columns=["Item", "Bytes"])
+    report["Size"] = [f"{size / 1024 / 1024:.2f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KB" for size in report["Bytes"]]
+    return report
+
+
+# --- Result Store ---
+RESULT_STORE_TTL = 60 * 60                  # Seconds a finished crawl, analysis or topic set is shared before it is redone
+RESULT_STORE_MAX_BYTES = int(os.environ.get("TOPIC_GENERATOR_STORE_MB", "256")) * 1024 * 1024  # Memory cap before LRU eviction
+RESULT_STORE_MAX_ENTRIES = 500
+
+def result_key(kind, url, *inputs):
+    """Store key for a `kind` of result for a site: the normalized URL and a hash of every other input."""
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return (kind, normalize_url(url) if url else "", digest)
+
+class ResultInterrupted(Exception):
+    """Raised to callers waiting on a computation whose owner stopped before finishing."""
+
+class ResultStore:
+    """In-memory store of finished results shared by every session in the process, with single-flight computing.
+
+    Values are handed out by reference, so callers must treat them as read-only. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted beyond `max_bytes` (sizes from
+    deep_sizeof) or `max_entries`. While one caller computes a key, others asking for it wait for
+    that result instead of starting the same crawl or API call again.
+    """
+
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES, ttl=RESULT_STORE_TTL, max_entries=RESULT_STORE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires), least recently used first
+        self._inflight = {}            # key -> Future of the computation in progress
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+    def get(self, key):
+        """Returns the stored value for `key`, or None."""
+        with self._lock:
+            entry = self._lookup(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value):
+        size = deep_sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            now = time.monotonic()
+            for stale in [k for k, (_, _, expires) in self._entries.items() if expires <= now]:
+                self._drop(stale)
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def get_or_compute(self, key, compute, keep=lambda value: True, on_wait=None):
+        """Returns the value for `key`, calling compute() only if no one has it stored or is computing it.
+
+        A result is stored when keep(value) is true; failed results still reach the callers that
+        waited on them. on_wait() is called before waiting on another caller. If that caller raises or
+        is interrupted, waiters retry and one of them computes instead.
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry:
+                    self.hits += 1
+                    return entry[0]
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    self.misses += 1
+                    break
+                self.joined += 1
+            if on_wait:
+                on_wait()
+            try:
+                return future.result()
+            except Exception:
+                continue
+
+        try:
+            value = compute()
+        except BaseException as e:  # includes Streamlit's rerun/stop, which end the owner's script mid-computation
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e if isinstance(e, Exception) else ResultInterrupted(type(e).__name__))
+            raise
+        if keep(value):
+            self.put(key, value)
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'joined': self.joined, 'in_progress': len(self._inflight)}
+
+@cache
+def get_result_store():
+    """Returns the process-wide result store."""
+    return ResultStore()
+
+
+# --- Topic Search ---
+SEARCH_TERM_PATTERN = re.compile(r'(?:([A-Za-z_]+):)?(?:"([^"]*)"?|(\S*))')
+SEARCH_DENSE_TOKENS = 64    # Matching vocabulary tokens above which one pass over all postings beats per-token slices
+
+def column_alias(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+class TopicSearchIndex:
+    """Inverted index over the text columns of a topics DataFrame.
+
+    Cells are lowercased and split on whitespace; every (token, row, column) occurrence is kept in
+    postings sorted by token. A search term matches a row when it is a substring of one of the row's
+    tokens, so the vocabulary is scanned once per term and only the postings of matching tokens are
+    touched. Terms are ANDed. `column:term` limits a term to one column, named by its full name or any
+    word of it (`keyword:mmj`, `headline:guide`, `funnel_stage:tofu`), and `"quoted phrases"` must
+    appear verbatim in a single cell.
+    """
+
+    def __init__(self, df, columns=None):
+        self.df = df
+        self.columns = [c for c in (columns or df.columns) if c in df.columns]
+        self.aliases = {}
+        for i, column in enumerate(self.columns):
+            for alias in [column_alias(column)] + [column_alias(w) for w in column.split()]:
+                self.aliases.setdefault(alias, i)
+
+        self.lowered = [df[column].reset_index(drop=True).astype(object).fillna('').astype(str).str.lower() for column in self.columns]
+        rows, cols, tokens = [], [], []
+        for i, lowered in enumerate(self.lowered):
+            exploded = lowered.str.split().explode().dropna()
+            rows.append(exploded.index.to_numpy())
+            cols.append(np.full(len(exploded), i, dtype=np.int8))
+            tokens.append(exploded.to_numpy(dtype=object))
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int8)
+        codes, vocabulary = pd.factorize(np.concatenate(tokens) if tokens else np.empty(0, dtype=object))
+        order = np.argsort(codes, kind='stable')
+        self.vocabulary = pd.Series(vocabulary, dtype="string")
+        self.token_codes = codes[order]
+        self.rows = rows[order].astype(np.int32)
+        self.cols = cols[order]
+        self.offsets = np.searchsorted(self.token_codes, np.arange(len(vocabulary) + 1))
+
+    def __len__(self):
+        return len(self.df)
+
+    def parse(self, query):
+        """Splits a query into (column position or None, text, is_phrase) terms. Unknown column prefixes are searched as text."""
+        terms = []
+        for match in SEARCH_TERM_PATTERN.finditer(query or ''):
+            prefix, phrase, word = match.groups()
+            column = self.aliases.get(column_alias(prefix)) if prefix else None
+            if prefix and column is not None and not (phrase or word):
+                continue  # a column prefix still being typed
+            if prefix and column is None:
+                if phrase is not None:
+                    phrase = f"{prefix}:{phrase}"
+                else:
+                    word = f"{prefix}:{word}"
+            text = (phrase if phrase is not None else word).lower()
+            if text.strip():
+                terms.append((column, text, phrase is not None and len(text.split()) > 1))
+        return terms
+
+    def token_rows(self, needle, column=None):
+        """Boolean mask of rows holding a token that contains `needle` (in `column` when given)."""
+        hits = np.zeros(len(self.df), dtype=bool)
+        matching = np.flatnonzero(self.vocabulary.str.contains(needle, regex=False).to_numpy(dtype=bool))
+        if not len(matching):
+            return hits
+        if len(matching) > SEARCH_DENSE_TOKENS:
+            selected = np.zeros(len(self.vocabulary), dtype=bool)
+            selected[matching] = True
+            selected = selected[self.token_codes]
+        else:
+            selected = np.concatenate([np.arange(self.offsets[t], self.offsets[t + 1]) for t in matching])
+        if column is not None:
+            rows, cols = self.rows[selected], self.cols[selected]
+            hits[rows[cols == column]] = True
+        else:
+            hits[self.rows[selected]] = True
+        return hits
+
+    def phrase_rows(self, phrase, column, candidates):
+        """Narrows `candidates` to rows where `phrase` appears verbatim in one cell."""
+        positions = np.flatnonzero(candidates)
+        found = np.zeros(len(positions), dtype=bool)
+        for lowered in ([self.lowered[column]] if column is not None else self.lowered):
+            found |= lowered.iloc[positions].str.contains(phrase, regex=False).to_numpy(dtype=bool)
+        hits = np.zeros(len(self.df), dtype=bool)
+        hits[positions[found]] = True
+        return hits
+
+    def mask(self, query):
+        """Boolean array over the DataFrame's rows matching every term of `query` (all True for an empty query)."""
+        hits = np.ones(len(self.df), dtype=bool)
+        for column, text, is_phrase in self.parse(query):
+            for word in text.split():
+                hits &= self.token_rows(word, column)
+            if is_phrase and hits.any():
+                hits &= self.phrase_rows(text, column, hits)
+            if not hits.any():
+                break
+        return hits
+
+    def search(self, query):
+        return self.df[self.mask(query)]
+
+
+# --- Near-duplicate Topics ---
+DEDUP_COLUMNS = ["Topic", "Suggested Headline"]
+DEDUP_THRESHOLD = 0.6   # Jaccard similarity of content words above which two topics are the same idea
+DEDUP_BANDS = 24        # LSH bands x rows = MinHash permutations; 24 x 4 finds 0.6-similar pairs ~96% of the time
+DEDUP_ROWS = 4
+DEDUP_PERM_CHUNK = 8    # Permutations hashed at a time, bounding the temporary (occurrences x chunk) array
+
+def minhash_signatures(doc_ids, token_ids, n_docs, num_perm, seed=0):
+    """MinHash signature per document from flat (document, token id) arrays sorted by document.
+
+    Uses multiply-shift hashing on 64-bit words; documents without tokens keep all-max signatures.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    signatures = np.full((n_docs, num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    if not len(doc_ids):
+        return signatures
+    starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+    x = (token_ids.astype(np.uint64) + np.uint64(1))[:, None]
+    for first in range(0, num_perm, DEDUP_PERM_CHUNK):
+        chunk = slice(first, first + DEDUP_PERM_CHUNK)
+        hashed = ((x * a[chunk] + b[chunk]) >> np.uint64(32)).astype(np.uint32)
+        signatures[doc_ids[starts], chunk] = np.minimum.reduceat(hashed, starts, axis=0)
+    return signatures
+
+def lsh_candidate_pairs(signatures, docs, bands=DEDUP_BANDS, rows=DEDUP_ROWS):
+    """Pairs of `docs` that share a band of their signatures, as an (n, 2) array with i < j.
+
+    Within a bucket every document is paired with the bucket's first document and with its
+    predecessor, so a bucket of k documents yields at most 2k pairs however large it is.
+    """
+    pairs = []
+    mix = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93], dtype=np.uint64)
+    for band in range(bands):
+        block = signatures[docs, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = np.bitwise_xor.reduce(block * mix[np.arange(rows) % len(mix)], axis=1) ^ np.uint64(band)
+        order = np.argsort(keys, kind='stable')
+        ordered = keys[order]
+        same = ordered[1:] == ordered[:-1]
+        if not same.any():
+            continue
+        index = np.arange(len(order))
+        leader = np.maximum.accumulate(np.where(np.r_[True, ~same], index, 0))
+        follower = np.flatnonzero(same) + 1
+        for other in (follower - 1, leader[follower]):
+            pairs.append(np.stack([docs[order[other]], docs[order[follower]]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+
+def near_duplicate_groups(texts, threshold=DEDUP_THRESHOLD, bands=DEDUP_BANDS, rows=DEDUP_ROWS):
+    """Groups texts whose content words (STOPWORDS removed) have Jaccard similarity >= threshold.
+
+    MinHash + LSH proposes candidate pairs in near-linear time and each candidate is confirmed with
+    the exact Jaccard similarity. Returns an array with, per text, the position of its group's
+    representative (the group's first text), or -1 when it has no near-duplicates.
+    """
+    vocabulary, word_sets, doc_ids, token_ids = {}, [], [], []
+    for position, text in enumerate(texts):
+        words = frozenset(content_words(text or ""))
+        word_sets.append(words)
+        for word in words:
+            doc_ids.append(position)
+            token_ids.append(vocabulary.setdefault(word, len(vocabulary)))
+    groups = np.full(len(word_sets), -1, dtype=np.int64)
+    docs = np.array([i for i, words in enumerate(word_sets) if words], dtype=np.int64)
+    if len(docs) < 2:
+        return groups
+    signatures = minhash_signatures(np.array(doc_ids, dtype=np.int64), np.array(token_ids, dtype=np.int64), len(word_sets), bands * rows)
+    candidates = lsh_candidate_pairs(signatures, docs, bands, rows)
+
+    parent = list(range(len(word_sets)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in candidates.tolist():
+        first, second = word_sets[i], word_sets[j]
+        if len(first & second) >= threshold * len(first | second):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)  # the earliest text stays the representative
+
+    roots = np.array([find(i) for i in range(len(word_sets))], dtype=np.int64)
+    grouped = np.bincount(roots, minlength=len(roots))[roots] > 1
+    groups[grouped] = roots[grouped]
+    return groups
+
+def flag_near_duplicates(df, columns=DEDUP_COLUMNS, threshold=DEDUP_THRESHOLD):
+    """Adds "Duplicate Group" (the row number of the group's representative, empty for unique topics) and
+    "Near Duplicate" (True for every group member except the representative) to a topics DataFrame."""
+    df = df.copy()
+    present = [column for column in columns if column in df.columns]
+    texts = df[present].astype(object).fillna('').astype(str).agg(' '.join, axis=1).tolist() if present and len(df) else [''] * len(df)
+    groups = near_duplicate_groups(texts, threshold)
+    df["Duplicate Group"] = pd.Series(groups + 1, index=df.index, dtype="Int64").where(groups >= 0)
+    df["Near Duplicate"] = (groups >= 0) & (groups != np.arange(len(groups)))
+    return df
+
+
+# --- Destination Pages ---
+PAGE_MATCH_TITLE_WEIGHT = 2     # Title and URL words count this many times in a page's TF-IDF vector
+
+def page_words(page):
+    """Content words describing a crawled page record: title and URL slug (weighted), meta description and summary."""
+    path_words = ' '.join(re.split(r'[^a-z]+', urlparse(page.get('URL', '')).path.lower()))
+    description = page.get('Meta Description')
+    words = content_words(f"{page.get('Page Title') or ''} {path_words}") * PAGE_MATCH_TITLE_WEIGHT
+    words += content_words(f"{description if description != 'No Meta Description' else ''} {page.get('Content Summary') or ''}")
+    return words
+
+class PageMatcher:
+    """TF-IDF index over crawled page records for choosing a topic's destination page locally.
+
+    Page vectors (sublinear tf, smoothed idf, L2-normalized) are kept as a dense pages x vocabulary
+    matrix, which stays small for a crawl budget of pages. Queries are sparse: each query word adds
+    its weight times that word's column, summed per query with one reduceat across all topics.
+    """
+
+    def __init__(self, pages):
+        self.pages = [page for page in pages if page.get('URL')]
+        self.by_url = {normalize_url(page['URL']): page['URL'] for page in self.pages}
+        self.by_title = {}
+        for page in self.pages:
+            self.by_title.setdefault((page.get('Page Title') or '').strip().lower(), page['URL'])
+        self.vocabulary = {}
+        counts = [Counter(page_words(page)) for page in self.pages]
+        for words in counts:
+            for word in words:
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+        matrix = np.zeros((len(self.pages), len(self.vocabulary)), dtype=np.float32)
+        for row, words in enumerate(counts):
+            for word, count in words.items():
+                matrix[row, self.vocabulary[word]] = 1 + np.log(count)
+        document_frequency = (matrix > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(self.pages)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms > 0, norms, 1)
+
+    def scores(self, texts):
+        """Cosine similarity of each text to each page, as a (texts x pages) array."""
+        rows, columns, weights = [], [], []
+        for row, text in enumerate(texts):
+            for word, count in Counter(w for w in content_words(text or '') if w in self.vocabulary).items():
+                rows.append(row)
+                columns.append(self.vocabulary[word])
+                weights.append(1 + np.log(count))
+        scores = np.zeros((len(texts), len(self.pages)), dtype=np.float32)
+        if not rows:
+            return scores
+        rows, columns = np.array(rows), np.array(columns)
+        weights = np.array(weights, dtype=np.float32) * self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(texts)))
+        contributions = (weights / norms[rows])[:, None] * self.matrix[:, columns].T
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])  # rows were appended in order
+        scores[rows[starts]] = np.add.reduceat(contributions, starts, axis=0)
+        return scores
+
+    def rank(self, texts, top_k=3):
+        """Best pages for each text as [[(URL, score), ...], ...], highest first; pages scoring 0 are left out."""
+        scores = self.scores(texts)
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        return [[(self.pages[i]['URL'], float(row_scores[i])) for i in row_order if row_scores[i] > 0]
+                for row_order, row_scores in zip(order, scores)]
+
+    def resolve(self, url, base_url=None):
+        """The crawled URL that `url` refers to (ignoring case, trailing slashes and the like), or None."""
+        if not url or not isinstance(url, str):
+            return None
+        if base_url:
+            url = urljoin(base_url, url.strip())
+        return self.by_url.get(normalize_url(url))
+
+def match_destination_pages(data, pages, analyzed_url, rematch_products=True):
+    """Checks every destinationPage in generated topic data against the crawled pages. Returns (data, changed count).
+
+    Page-based topics get their page's own URL (found by pageURL, then title). Product topics keep a crawled URL the model chose unless
+    `rematch_products` is set (the prompt left out the URL list); otherwise, and for URLs that were never
+    crawled, the TF-IDF best match for the product and topic is used, falling back to the base URL.
+    The input is not modified.
+    """
+    matcher = PageMatcher(pages)
+    if not data or not matcher.pages:
+        return data, 0
+    data = json.loads(json.dumps(data))
+    changed = 0
+
+    def topics_of(item):
+        for funnel in item.get('funnels', []):
+            for audience in funnel.get('audiences', []):
+                for pub in audience.get('publications', []):
+                    yield from pub.get('topics', [])
+
+    product_topics, queries = [], []
+    for item in data.get('productBasedTopics', []):
+        for topic in topics_of(item):
+            resolved = None if rematch_products else matcher.resolve(topic.get('destinationPage'), analyzed_url)
+            if resolved:
+                changed += resolved != topic.get('destinationPage')
+                topic['destinationPage'] = resolved
+            else:
+                product_topics.append(topic)
+                queries.append(' '.join(str(topic.get(key) or '') for key in ('topic', 'suggestedHeadline', 'focusKeyword')) + f" {item.get('productName') or ''}")
+    for topic, ranked in zip(product_topics, matcher.rank(queries, top_k=1)):
+        best = ranked[0][0] if ranked else analyzed_url
+        changed += best != topic.get('destinationPage')
+        topic['destinationPage'] = best
+
+    for item in data.get('pageBasedTopics', []):
+        title = (item.get('pageTitle') or '').strip()
+        page_url = matcher.resolve(item.get('pageURL'), analyzed_url) or matcher.by_title.get(title.lower())
+        if page_url is None:
+            ranked = matcher.rank([title], top_k=1)[0]
+            page_url = ranked[0][0] if ranked else analyzed_url
+        for topic in topics_of(item):
+            changed += page_url != topic.get('destinationPage')
+            topic['destinationPage'] = page_url
+    return data, changed
+
+
+# --- Topic Generation ---
+TOPIC_SET_INSTRUCTIONS = {
+    'products': """**Topics for each Product/Service:** For EACH item in the `List of Business Services`, generate **creative, non-promotional** topics for all three marketing funnels (ToFu, MoFu, BoFu) that address the associated pain points.
+    - *Example Good (ToFu):* "5 Common Mistakes to Avoid When Applying for an MMJ Card"
+    - *Example Bad (Promotional):* "Get Your MMJ Card Today With Our Help\"""",
+    'pages': """**Topics for each Available Page:** For EACH item in the `List of Available Pages`, generate **non-promotional, page-specific** topics for all three marketing funnels (ToFu, MoFu, BoFu) based on that page's summary.
+    - *Example Good (MoFu):* "What to Expect at Your First MMJ Appointment" (for a "Patient Forms" page)
+    - *Example Bad (Promotional):* "Book Your Appointment at Our Tampa Office\"""",
+}
+TOPIC_DESTINATION_RULES = {
+    'products': "    - For `productBasedTopics`, select the most relevant URL from the `List of Available URLs` that matches the product.",
+    'products_local': "    - For `productBasedTopics`, use the `Base Website URL for Destination Pages`; the best matching page is filled in afterwards.",
+    'pages': "    - For `pageBasedTopics`, this MUST be the *exact* `pageURL` for the page you are generating topics for.",
+}
+TOPIC_PROMPT_TEMPLATE = """You are a strategic content and marketing analyst. Your task is to generate {task} based on the provided business details:
+
+{sets}
+
+**CRITICAL RULE: DO NOT CREATE PROMOTIONAL TOPICS.**
+These topics are for external guest posts, not the company's website.
+- **AVOID:** Direct calls to action (e.g., "Book Now," "Get Certified," "Schedule Today").
+- **AVOID:** Topics focused on "expert help" or "support" from this specific company (e.g., "Why Our Doctors Are Best").
+- **AVOID:** Topics designed to persuade the user to choose this company's service.
+- **FOCUS ON:** Explaining concepts, processes, general information, and answering the target audience's questions and pain points.
+
+For EACH funnel stage (ToFu, MoFu, BoFu) in {scope}, you must identify a relevant `audienceName` and `publicationNiche`, and then provide at least one topic.
+
+For each generated topic, you must provide six elements:
+- 'topic': A short, concise title (MAXIMUM 60 characters).
+- 'suggestedHeadline': A longer, more engaging headline for an article.
+- 'rationale': A brief explanation of the topic's value.
+- 'anchorText': A descriptive, concise, and relevant anchor text. VARY the type of anchor text (Branded, Naked, Title, Generic, Exact Match, Partial Match) based on the context.
+- 'destinationPage': 
+{destinations}
+- 'focusKeyword': Based on the topic and headline, suggest a primary focus keyword for the content.
+
+The final output must be a single JSON object adhering to the provided schema.
+"""
+
+def topic_system_prompt(include_products=True, include_pages=True, local_destinations=False):
+    """The topic system prompt with instructions for the requested topic sets only, so a fan-out shard doesn't carry the other set's.
+
+    With local_destinations the request carries no URL list (see build_topic_query): product topics
+    point at the base URL and match_destination_pages picks their page.
+    """
+    sets = [name for name, included in (('products', include_products), ('pages', include_pages)) if included]
+    rules = {**TOPIC_DESTINATION_RULES, 'products': TOPIC_DESTINATION_RULES['products_local']} if local_destinations else TOPIC_DESTINATION_RULES
+    return TOPIC_PROMPT_TEMPLATE.format(
+        task="two distinct sets of topics" if len(sets) > 1 else "one set of topics",
+        sets="\n\n".join(f"{number}.  {TOPIC_SET_INSTRUCTIONS[name]}" for number, name in enumerate(sets, start=1)),
+        scope="both sets" if len(sets) > 1 else "this set",
+        destinations="\n".join(rules[name] for name in sets))
+
+TOPIC_SYSTEM_PROMPT = topic_system_prompt()
+
+def topic_response_schema(include_products=True, include_pages=True):
+    """Response schema for topic generation; fan-out shards can ask for just one of the two sets."""
+    topic_properties = {"type": "OBJECT", "properties": {"topic": {"type": "STRING"}, "suggestedHeadline": {"type": "STRING"}, "rationale": {"type": "STRING"}, "anchorText": {"type": "STRING"}, "destinationPage": {"type": "STRING"}, "focusKeyword": {"type": "STRING"}}, "required": ["topic", "suggestedHeadline", "rationale", "anchorText", "destinationPage", "focusKeyword"]}
+    publication_properties = {"type": "OBJECT", "properties": {"publicationNiche": {"type": "STRING"}, "topics": {"type": "ARRAY", "items": topic_properties}}, "required": ["publicationNiche", "topics"], "propertyOrdering": ["publicationNiche", "topics"]}
+    audience_properties = {"type": "OBJECT", "properties": {"audienceName": {"type": "STRING"}, "publications": {"type": "ARRAY", "items": publication_properties}}, "required": ["audienceName", "publications"], "propertyOrdering": ["audienceName", "publications"]}
+    funnel_properties = {"type": "OBJECT", "properties": {"funnelStage": {"type": "STRING", "enum": ["ToFu", "MoFu", "BoFu"]}, "audiences": {"type": "ARRAY", "items": audience_properties}}, "required": ["funnelStage", "audiences"], "propertyOrdering": ["funnelStage", "audiences"]}
+
+    product_based_topics_properties = {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"productName": {"type": "STRING", "description": "The name of the product/service."}, "funnels": {"type": "ARRAY", "items": funnel_properties}}, "required": ["productName", "funnels"], "propertyOrdering": ["productName", "funnels"]}}
+
+    page_based_topics_properties = {"type": "ARRAY", "items": {"type": "OBJECT", "properties": {"pageTitle": {"type": "STRING"}, "pageURL": {"type": "STRING"}, "funnels": {"type": "ARRAY", "items": funnel_properties}}, "required": ["pageTitle", "pageURL", "funnels"], "propertyOrdering": ["pageTitle", "pageURL", "funnels"]}}
+    # propertyOrdering makes group/funnel/audience labels arrive before their topics when streaming
+    properties, required = {}, []
+    if include_products:
+        properties["productBasedTopics"] = product_based_topics_properties
+        required.append("productBasedTopics")
+    if include_pages:
+        properties["pageBasedTopics"] = page_based_topics_properties
+        required.append("pageBasedTopics")
+    return {"type": "OBJECT", "properties": properties, "required": required}
+
+def build_business_details(guidelines, industry, tone, audience, product_input, analysis_results):
+    """Builds the guidelines / business details block shared by every topic request."""
+    details = ""
+    if guidelines:
+        details += f"Full Copywriting Guidelines:\n---\n{guidelines}\n---\n"
+        optional_inputs = {"Specific Industry/Niche": industry, "Specific Branding Tone/Voice": tone, "Specific Target Audiences": audience, "Specific Products/Services": product_input}
+        if analysis_results:
+            optional_details = "\n".join([f"- {key}: {value}" for key, value in optional_inputs.items() if value and value != analysis_results.get(key.lower().replace('specific ', '').replace(' ', '_'))])
+        else:
+            optional_details = "\n".join([f"- {key}: {value}" for key, value in optional_inputs.items() if value])
+        if optional_details: details += f"\nSupplemental Details from Optional Fields:\n{optional_details}"
+    else:
+        details += "Business Details:\n"
+        primary_inputs = {"Industry/Niche": industry, "Branding Tone/Voice": tone, "Target Audiences": audience, "Products/Services to Highlight": product_input}
+        primary_details = "\n".join([f"- {key}: {value}" for key, value in primary_inputs.items() if value])
+        details += primary_details
+    return details
+
+def build_topic_query(current_date, analyzed_url, url_pages, products, pages, business_details):
+    """Builds the user query for a topic request covering the given products and pages."""
+    user_query = f"Current Date: {current_date}\n\n"
+    if analyzed_url:
+        user_query += f"Base Website URL for Destination Pages: {analyzed_url}\n"
+        if url_pages:
+            user_query += "List of Available URLs to choose from for the 'destinationPage' (with their anchor text for context):\n"
+            for page in url_pages:
+                user_query += f"- {page['URL']} (Context: {page['Page Title']})\n"
+            user_query += "\n"
+        elif products:
+            user_query += "Use the Base Website URL as the 'destinationPage' of product topics; the best matching page is filled in afterwards.\n\n"
+
+    if products:
+        user_query += "List of Business Services to generate topics for:\n"
+        for product in products:
+            user_query += f"- {product['service_or_product']} (Audience: {product['associated_audience']}, Pain Point: {product['associated_pain_point']})\n"
+        user_query += "\n"
+
+    if pages:
+        user_query += "List of Available Pages to generate topics for:\n"
+        for page in pages:
+            user_query += f"- Page Title: {page['Page Title']}\n  URL: {page['URL']}\n  Summary: {page['Content Summary']}\n"
+        user_query += "\n"
+
+    return user_query + business_details
+
+@cache
+def topic_prompt_prefix(include_products=True, include_pages=True, local_destinations=False):
+    """Returns the topic system prompt and schema, serialized once per process."""
+    return PromptPrefix(topic_system_prompt(include_products, include_pages, local_destinations), topic_response_schema(include_products, include_pages))
+
+
+# --- Fan-out Topic Generation ---
+TOPIC_SHARD_PRODUCTS = 2     # Products per fan-out request
+TOPIC_SHARD_PAGES = 3        # Pages per fan-out request
+TOPIC_FANOUT_WORKERS = 4     # Fan-out requests in flight at once
+TOPIC_SHARD_ATTEMPTS = 3     # API calls per shard, retries included, before it is reported as failed
+TOPIC_WAIT_REPORT_INTERVAL = 1  # Seconds between on_wait reports while shards wait for rate limit capacity
+
+def plan_topic_shards(products, pages, products_per_shard=TOPIC_SHARD_PRODUCTS, pages_per_shard=TOPIC_SHARD_PAGES):
+    """Splits products and pages into small batches, one request each."""
+    shards = [{'products': products[i:i + products_per_shard], 'pages': []} for i in range(0, len(products), products_per_shard)]
+    shards += [{'products': [], 'pages': pages[i:i + pages_per_shard]} for i in range(0, len(pages), pages_per_shard)]
+    return shards
+
+def merge_topic_results(results):
+    """Merges shard results (in shard order) into the structure prepare_dataframe expects."""
+    merged = {'productBasedTopics': [], 'pageBasedTopics': []}
+    for data in results:
+        if data:
+            for key in merged:
+                merged[key].extend(data.get(key, []))
+    return merged
+
+def generate_topic_shard(api_key, prefix, user_text, attempts=TOPIC_SHARD_ATTEMPTS, use_cache=True, on_wait=None):
+    """Runs one shard request, retrying the shard alone on errors or unparseable (e.g. truncated) output.
+
+    Each try is a single API call (no fetch_with_retry retries on top), so a shard makes at most `attempts` calls.
+    """
+    error = None
+    for attempt in range(attempts):
+        data, error = generate_json(api_key, prefix, user_text, use_cache, retries=1, on_wait=on_wait)
+        if not error:
+            return data, None
+        logger.debug("topic shard attempt %d/%d failed: %s", attempt + 1, attempts, error)
+        if attempt < attempts - 1:
+            time.sleep(retry_delay(attempt))
+    return None, error
+
+def generate_topics_fanout(api_key, current_date, analyzed_url, url_pages, products, pages, business_details,
+                           on_progress=None, max_workers=TOPIC_FANOUT_WORKERS, use_cache=True, on_wait=None):
+    """Generates topics with one smaller request per batch of products or pages.
+
+    Each request carries the shared business details; only product shards get the URL list.
+    Calls on_progress(merged data so far, shards finished, shard count) as shards complete, and
+    on_wait(seconds until the next shard gets capacity) every TOPIC_WAIT_REPORT_INTERVAL while
+    shards are held back by the rate limiter. Both are called on the caller's thread.
+    Returns (merged data, errors for shards that still failed after retrying).
+    """
+    shards = plan_topic_shards(products, pages)
+    requests_to_send = [(topic_prompt_prefix(bool(shard['products']), bool(shard['pages']), not url_pages),
+                         build_topic_query(current_date, analyzed_url, url_pages if shard['products'] else [], shard['products'], shard['pages'], business_details))
+                        for shard in shards]
+
+    results, errors = [None] * len(shards), []
+    resume_at = [0.0] * len(shards)  # when each shard's rate limit wait ends (time.monotonic())
+    def shard_waiting(index):
+        return lambda seconds: resume_at.__setitem__(index, time.monotonic() + seconds)
+
+    finished = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        futures = {executor.submit(generate_topic_shard, api_key, prefix, query, use_cache=use_cache, on_wait=shard_waiting(i)): i
+                   for i, (prefix, query) in enumerate(requests_to_send)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=TOPIC_WAIT_REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            waits = [t - now for t in resume_at if t > now]
+            if not done and waits and on_wait:
+                on_wait(min(waits))
+            for future in done:
+                index = futures[future]
+                finished += 1
+                data, error = future.result()
+                if error:
+                    shard = shards[index]
+                    names = [p['service_or_product'] for p in shard['products']] + [p['Page Title'] for p in shard['pages']]
+                    errors.append(f"{', '.join(names)}: {error}")
+                else:
+                    results[index] = data
+                if on_progress:
+                    on_progress(merge_topic_results(results), finished, len(shards))
+    return merge_topic_results(results), errors
+
+
+# --- Streaming Topic Generation ---
+_JSON_TOKEN_RE = re.compile(r'''\s*(?:(?P<punct>[{}\[\]:,])|(?P<string>"(?:[^"\\]|\\.)*")|(?P<literal>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)(?=[\s,\]}]))''')
+
+class IncrementalJSONParser:
+    """Parses a JSON document fed in chunks and reports every object as soon as it closes.
+
+    on_object(path, containers) receives the object's path from the root (keys and list
+    indexes) and the open containers from the root down to the object, so ancestor fields
+    that have already arrived can be read.
+    """
+
+    def __init__(self, on_object=None):
+        self.on_object = on_object
+        self.text = ""
+        self.pos = 0
+        self.root = None
+        self.done = False
+        self._containers = []
+        self._path = []
+        self._key = None
+        self._expect_key = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        while not self.done:
+            match = _JSON_TOKEN_RE.match(self.text, self.pos)
+            if not match:
+                break  # incomplete token: wait for the next chunk
+            self.pos = match.end()
+            if match.group('punct'):
+                self._punct(match.group('punct'))
+            elif match.group('string') is not None:
+                value = json.loads(match.group('string'))
+                if self._expect_key:
+                    self._key, self._expect_key = value, False
+                else:
+                    self._attach(value)
+            else:
+                self._attach(json.loads(match.group('literal')))
+
+    def _attach(self, value):
+        if not self._containers:
+            self.root = value
+        elif isinstance(self._containers[-1], dict):
+            self._containers[-1][self._key] = value
+        else:
+            self._containers[-1].append(value)
+
+    def _punct(self, char):
+        if char in '{[':
+            container = {} if char == '{' else []
+            parent = self._containers[-1] if self._containers else None
+            self._path.append(self._key if isinstance(parent, dict) else len(parent) if parent is not None else None)
+            self._attach(container)
+            self._containers.append(container)
+            self._expect_key = char == '{'
+        elif char in '}]':
+            if char == '}' and self.on_object:
+                self.on_object(tuple(self._path[1:]), list(self._containers))
+            self._containers.pop()
+            self._path.pop()
+            self._expect_key = False
+            self.done = not self._containers
+        elif char == ',':
+            self._expect_key = isinstance(self._containers[-1], dict)
+
+
+TOPIC_SECTIONS = {'productBasedTopics': ("Product/Service", 'productName'), 'pageBasedTopics': ("Available Page", 'pageTitle')}
+
+class TopicStreamCollector:
+    """Turns topic objects from a streamed topic-generation response into Table 3 rows as they complete."""
+
+    def __init__(self):
+        self.rows = []
+        self._pending = []
+        self.parser = IncrementalJSONParser(self._on_object)
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+
+    def _on_object(self, path, containers):
+        # path: (section, i, 'funnels', j, 'audiences', k, 'publications', l, 'topics', m)
+        if len(path) == 10 and path[0] in TOPIC_SECTIONS and path[8] == 'topics':
+            self._pending.append((path[0],) + tuple(containers[2:11:2]))
+        if self._pending:
+            self._flush()
+
+    def _flush(self, final=False):
+        waiting = []
+        for section, group, funnel, audience, pub, topic in self._pending:
+            category, name_key = TOPIC_SECTIONS[section]
+            labels = (group.get(name_key), funnel.get('funnelStage'), audience.get('audienceName'), pub.get('publicationNiche'))
+            # Hold a topic back until its group/funnel/audience/publication labels have streamed in
+            if final or None not in labels:
+                self.rows.append(topic_row(category, labels[0], funnel, audience, pub, topic))
+            else:
+                waiting.append((section, group, funnel, audience, pub, topic))
+        self._pending = waiting
+
+    def finish(self):
+        """Emits any held-back topics and returns the parsed document (None if it never completed)."""
+        self._flush(final=True)
+        return self.parser.root if self.parser.done else None
+
+
+def iter_sse_text(response, usage=None):
+    """Yields the text parts of each server-sent event from a streamGenerateContent?alt=sse response.
+
+    If a dict is passed as `usage` it is updated with the latest usageMetadata.
+    """
+    for line in response.iter_lines():
+        if not line.startswith(b'data:'):
+            continue
+        event = json.loads(line[5:].decode('utf-8'))
+        if usage is not None and event.get('usageMetadata'):
+            usage.update(event['usageMetadata'])
+        for candidate in event.get('candidates', [])[:1]:
+            for part in candidate.get('content', {}).get('parts', []):
+                if part.get('text'):
+                    yield part['text']
+
+
+def stream_topic_generation(api_key, prefix, user_text, on_rows=None, use_cache=True, on_wait=None):
+    """Generates topics with streamGenerateContent, calling on_rows(rows) whenever new topics complete.
+
+    Returns (data, error_message) like the non-streaming path. Cached responses are returned without streaming.
+    `on_wait` is passed to send_prompt.
+    """
+    cache = get_response_cache()
+    key = response_cache_key(prefix, user_text)
+    if use_cache:
+        data = cache.get(key)
+        if data is not None:
+            return data, None
+
+    response, error = send_prompt(api_key, prefix, user_text, stream=True, on_wait=on_wait)
+    if error:
+        return None, error
+    if response.status_code != 200:
+        try:
+            return None, f"API request failed with status code: {response.status_code}: {json.dumps(response.json())}"
+        except json.JSONDecodeError:
+            return None, f"API request failed with status code: {response.status_code}."
+
+    collector = TopicStreamCollector()
+    usage = {}
+    try:
+        for text in iter_sse_text(response, usage):
+            emitted = len(collector.rows)
+            collector.feed(text)
+            if on_rows and len(collector.rows) > emitted:
+                on_rows(collector.rows)
+    except (requests.RequestException, json.JSONDecodeError) as e:
+        return None, f"The topic stream was interrupted: {e}"
+    finally:
+        response.close()
+
+    get_prompt_cache_registry().record_usage(usage)
+    data = collector.finish()
+    if data is None:
+        return None, "The topic stream ended before the response was complete. Please try again."
+    cache.store(key, data)
+    return data, None
+
+
+# --- Pipeline ---
+def analysis_details(analysis):
+    """The business detail fields filled in from a website analysis, as the sidebar shows them."""
+    products_list = analysis.get('business_services_products', [])
+    return {
+        'industry': analysis.get('identified_industry', ''),
+        'tone': analysis.get('branding_tone_voice', ''),
+        'audience_input': analysis.get('target_audience_pain_points', ''),
+        # Services list as a string for the text area
+        'product_input': "\n".join([f"- {p.get('service_or_product')}" for p in products_list]),
+        'guidelines': analysis.get('branding_guidelines_summary', ''),
+    }
+
+def generate_topics(api_key, analyzed_url, analysis, pages, details, fanout=True, use_cache=True, on_progress=None, local_destinations=True):
+    """Generates topics like the Generate Topics button (without streaming). Returns (data or None, error messages).
+
+    With local_destinations the prompt leaves out the URL list and product topics get their destination
+    page from PageMatcher; either way every destinationPage is checked against the crawled pages.
+    """
+    current_date = datetime.now().strftime('%B %d, %Y')
+    products = analysis.get('business_services_products', []) if analysis else []
+    business_details = build_business_details(details['guidelines'], details['industry'], details['tone'], details['audience_input'], details['product_input'], analysis)
+    url_pages = [] if local_destinations else pages
+    if fanout and (products or pages):
+        data, errors = generate_topics_fanout(api_key, current_date, analyzed_url, url_pages, products, pages, business_details, on_progress, use_cache=use_cache)
+        data = data if data['productBasedTopics'] or data['pageBasedTopics'] else None
+    else:
+        user_query = build_topic_query(current_date, analyzed_url, url_pages, products, pages, business_details)
+        data, error = generate_json(api_key, topic_prompt_prefix(local_destinations=not url_pages), user_query, use_cache)
+        errors = [error] if error else []
+    data, _ = match_destination_pages(data, pages, analyzed_url, rematch_products=local_destinations)
+    return data, errors
+
+def run_site(url, api_key, page_budget=CRAWL_PAGE_BUDGET, fanout=True, use_cache=True, local_destinations=True):
+    """Runs scrape → analyze → generate for one website.
+
+    Returns a dict with 'url', 'analysis', 'pages', 'topics' (raw data), 'topics_df', 'warnings'
+    for topic batches that failed, and 'error' when the site failed. Pass it to site_export_tables
+    and write_export to save the app's export.
+    """
+    result = {'url': url, 'analysis': None, 'pages': [], 'topics': None, 'topics_df': None, 'warnings': [], 'error': None}
+    text, pages, error = scrape_website(url, page_budget)
+    if error:
+        return dict(result, error=error)
+    analysis, error = analyze_scraped_text(api_key, text, use_cache)
+    if error:
+        return dict(result, pages=pages, error=error)
+    data, errors = generate_topics(api_key, url, analysis, pages, analysis_details(analysis), fanout, use_cache, local_destinations=local_destinations)
+    if data is None:
+        return dict(result, analysis=analysis, pages=pages, error='; '.join(errors) or "No topics were generated.")
+    return dict(result, analysis=analysis, pages=pages, topics=data, topics_df=flag_near_duplicates(prepare_dataframe(data)), warnings=errors)
+
+def site_export_tables(result):
+    """The export tables of a successful run_site result."""
+    return export_tables(result['topics_df'], pd.DataFrame(result['pages']), result['analysis'], result['url'])